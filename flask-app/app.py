@@ -1,31 +1,122 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response
 from pathlib import Path
+import os
 import threading
 import subprocess
-import zipfile
+import shutil
 import secrets
+import shlex
+import hmac
+import hashlib
 import string
-import re
 import xml.etree.ElementTree as ET
 from functools import wraps
 import time
-import queue
+import io
+import json
+import zipfile
+
+from render_profiles import (
+    RENDER_PROFILES,
+    resolve_profile_name,
+    build_consumer_args,
+    record_encode,
+    get_profile_summary,
+    get_units_per_second,
+    PREVIEW_PROFILE_NAME,
+)
+from downloads import send_media_file, send_growing_mp4
+from melt_progress import iter_melt_output, parse_progress
+from ingest import IngestError, extract_zip, ingest_stream
+from storage import StorageManager
+from catalog import RenderCatalog, CatalogQueryError
+from render_cache import RenderCache, compute_job_key, link_output
+from scheduler import JobScheduler, job_cost_units, estimate_seconds
+from farm import FarmCoordinator, iter_tar_stream
+from upload_receiver import UploadReceiver, UploadRejected, UPLOAD_RECEIVER_PORT
+from render_watchdog import RenderWatchdog, RenderStalled, cleanup_stale_xvfb, MAX_RETRIES
+from preflight import PreflightError, check, inspect_directory, inspect_zip
+from xvfb_pool import XVFB_POOL_ENABLED, XvfbPool, melt_launch
+from segments import SegmentCache, ffmpeg_available, plan_segments, stitch_segments
+from checkpoint import CHECKPOINTS_ENABLED, RenderJournal, find_journals, stop_orphaned_melt
+from metrics import (
+    REGISTRY,
+    JobTelemetry,
+    clear_job_gauges,
+    upload_bytes_total,
+    jobs_total,
+    job_duration_seconds,
+    queue_wait_seconds,
+    extract_seconds,
+    queue_length,
+)
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 60 * 1024 * 1024 * 1024  # 60GBまでOK
 
-UPLOAD_FOLDER = Path("/data/rendering")
+UPLOAD_FOLDER = Path(os.getenv("RENDER_UPLOAD_FOLDER", "/data/rendering"))
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 
+# レンダリング方式
+#   local       : このプロセスのワーカースレッドで melt を実行（従来動作）
+#   coordinator : melt はレンダリングエージェント（python -m render_agent）が実行
+RENDER_MODE = os.getenv("RENDER_MODE", "local").lower()
+# 同時に処理するジョブ数（coordinator では同時にエージェントへ渡すジョブ数）
+RENDER_SLOTS = int(os.getenv("RENDER_SLOTS", "1" if RENDER_MODE == "local" else "8"))
+# エージェント認証用トークン（未設定なら ALLOWED_IPS とローカルホストのみ許可）
+RENDER_AGENT_TOKEN = os.getenv("RENDER_AGENT_TOKEN", "")
+# melt コマンド（負荷試験では "python fake_melt.py" のような偽の melt を指定できる）
+MELT_COMMAND = shlex.split(os.getenv("MELT_PATH", "/usr/bin/melt"))
+# 0 なら Xvfb 無しで melt を起動（偽の melt を使う場合など）
+MELT_XVFB = os.getenv("MELT_XVFB", "1").lower() not in ("0", "false", "no", "off")
+
 # 進行状況を追跡する辞書
 progress_dict = {}  # uid -> { 'current': 0, 'total': 1, 'status': 'running' }
 
+# ジョブごとの付随情報
+job_meta = {}  # uid -> { 'profile': 'final', 'queued_at': ..., 'upload_bytes': ... }
+job_telemetry = {}  # uid -> JobTelemetry（レンダリング中・完了後の速度やリソース使用量）
+
 # キュー機能のためのグローバル変数
-job_queue = queue.Queue()
-completed_jobs = set()  # task_done()が呼ばれたジョブのIDを記録
+# 見積もり時間の短いジョブを優先（待ち時間によるエイジング・クライアントIPごとの公平性つき）
+job_queue = JobScheduler(slots=RENDER_SLOTS)
+# レンダリング枠ごとに常駐させる Xvfb（起動できなければ xvfb-run -a にフォールバック）
+xvfb_pool = XvfbPool(RENDER_SLOTS) if XVFB_POOL_ENABLED and MELT_XVFB and RENDER_MODE != "coordinator" else None
+completed_jobs = set()  # 処理が終わったジョブのIDを記録
 processing_jobs = set()  # 現在処理中のジョブのIDを記録
 worker_started = False
 
+def is_job_active(unique_id):
+    """待機中・処理中のジョブか（容量管理で削除対象から除外する）"""
+    if unique_id in processing_jobs:
+        return True
+    meta = job_meta.get(unique_id)
+    return meta is not None and unique_id not in completed_jobs
+
+# 止まった melt を検出して停止する監視スレッド
+render_watchdog = RenderWatchdog()
+
+# レンダリング済みファイルのカタログ（/list はここから返す）
+catalog = RenderCatalog(UPLOAD_FOLDER / ".catalog.sqlite3")
+
+def find_cached_output(job_key):
+    """同じジョブキーで完了済みの output.mp4 を探す（削除済みのものは飛ばす）"""
+    for uid in catalog.find_by_key(job_key):
+        output_file = UPLOAD_FOLDER / uid / "output.mp4"
+        if output_file.exists():
+            return output_file
+    return None
+
+# レンダリング結果キャッシュ（同一プロジェクト・素材・プロファイルの再レンダリングを省略）
+render_cache = RenderCache(find_cached_output)
+# セグメント単位のキャッシュ（一部だけ変わったプロジェクトは変わったセグメントだけ再レンダリング）
+segment_cache = SegmentCache(UPLOAD_FOLDER / ".segment-cache")
+
+# ディスク容量管理（zip削除・入力素材の期限切れ削除・LRUでの出力削除）
+# セグメントキャッシュは SEGMENT_CACHE_MAX_GB で別に上限を持つため、クォータの使用量には数えない
+storage = StorageManager(UPLOAD_FOLDER, is_active=is_job_active, on_evict=catalog.remove,
+                         exclude_names=(segment_cache.directory.name,))
+
 # 許可するIP（必要に応じて拡張可）
 ALLOWED_IPS = {"163.58.36.32"}
 
@@ -45,87 +136,133 @@ def ip_restricted(view_func):
         return view_func(*args, **kwargs)
     return _wrapped
 
+def is_truthy(value):
+    """ヘッダー値（1 / true / yes）を真偽値に変換"""
+    return (value or "").strip().lower() in ("1", "true", "yes")
+
 def generate_unique_id():
     """16桁の大文字小文字数字のユニークIDを生成"""
     alphabet = string.ascii_letters + string.digits  # a-z, A-Z, 0-9
     return ''.join(secrets.choice(alphabet) for _ in range(16))
 
 # Fnctions for job queue / ジョブキュー用関数群
-def get_queue_position(unique_id):
-    """キュー内でのジョブの位置を取得（0から始まる）"""
-    # キュー内の位置を計算
-    queue_position = 0
-    
-    # キュー内のジョブを確認して位置を計算
-    temp_jobs = []
-    position = 0
-    found_position = -1
-    
-    # キューからすべてのジョブを取り出して確認
-    while True:
-        try:
-            job = job_queue.get_nowait()
-            temp_jobs.append(job)
-            if job == unique_id:
-                found_position = position
-            position += 1
-        except queue.Empty:
-            break
-    
-    # 取り出したジョブをキューに戻す
-    for job in temp_jobs:
-        job_queue.put(job)
-    
-    if found_position != -1:
-        queue_position = found_position
-    else:
-        queue_position = 0  # 見つからない場合は0とする
-    
-    return queue_position
-
 def get_job_status(unique_id):
-    """job_queueベースでジョブの状態を判定"""
-    # 状態判定（キュー操作を避けて、セットベースで判定）
+    """スケジューラの状態からジョブの状態を判定"""
     if unique_id in processing_jobs:
-        # 処理中
         return "processing"
     elif unique_id in completed_jobs:
-        # 完了済み
         return "completed"
+    elif job_queue.is_waiting(unique_id):
+        return "waiting"
     else:
-        # キュー内のジョブを確認（非破壊的に）
-        temp_jobs = []
-        job_in_queue = False
-        
-        # キューからすべてのジョブを取り出して確認
-        while True:
-            try:
-                job = job_queue.get_nowait()
-                temp_jobs.append(job)
-                if job == unique_id:
-                    job_in_queue = True
-            except queue.Empty:
-                break
-        
-        # 取り出したジョブをキューに戻す
-        for job in temp_jobs:
-            job_queue.put(job)
-        
-        if job_in_queue:
-            return "waiting"
-        else:
-            return "unknown"
+        return "unknown"
+
+def predict_schedule():
+    """各ジョブの開始・終了予定時刻（実行中のジョブはテレメトリのETAを使用）"""
+    running_remaining = {}
+    for uid in list(processing_jobs):
+        telemetry = job_telemetry.get(uid)
+        if telemetry is not None and telemetry.eta_seconds is not None:
+            running_remaining[uid] = telemetry.eta_seconds
+    return job_queue.predict(running_remaining)
+
+REGISTRY.add_collector(lambda: queue_length.set(job_queue.qsize()))
 
 def start_worker():
     """ワーカースレッドを起動（重複起動を防ぐ）"""
     print("Worker: Starting worker thread...")
     global worker_started
     if not worker_started:
-        worker = threading.Thread(target=worker_thread, daemon=True)
-        worker.start()
+        for _ in range(RENDER_SLOTS):
+            worker = threading.Thread(target=worker_thread, daemon=True)
+            worker.start()
         worker_started = True
+        catalog.backfill(UPLOAD_FOLDER)
+        # 前回のプロセスでレンダリング中だったジョブを再開（容量管理の削除対象にならないよう先に登録）
+        if RENDER_MODE != "coordinator" and CHECKPOINTS_ENABLED:
+            recover_jobs()
+        storage.start()
+        # 前回のプロセスが残した Xvfb のロック・一時ディレクトリを掃除
+        if MELT_XVFB:
+            cleanup_stale_xvfb(remove_run_dirs=True)
+        start_xvfb_pool()
+        if UPLOAD_RECEIVER_PORT:
+            upload_receiver.start()
         print("Worker thread started and waiting for jobs...")
 
+def job_journal(unique_id):
+    """ジョブのチェックポイントのジャーナル（無効・coordinator ではエージェント側でレンダリングするため None）"""
+    if RENDER_MODE == "coordinator" or not CHECKPOINTS_ENABLED:
+        return None
+    return RenderJournal(UPLOAD_FOLDER / unique_id)
+
+def checkpoint_status(segmented=None):
+    """
+    /status の checkpoint: サーバーが再起動した場合にジョブがどうなるか
+
+    Args:
+        segmented: None ならレンダリング開始前、True / False はセグメント単位・1回の melt でのレンダリング
+    """
+    if RENDER_MODE == "coordinator" or not CHECKPOINTS_ENABLED:
+        return {'mode': 'none', 'on_restart': 'lost'}
+    if segmented is None:
+        return {'mode': 'queued', 'on_restart': 'requeued'}
+    if segmented:
+        return {'mode': 'segments', 'on_restart': 'resume_from_last_segment'}
+    # 1回の melt では途中から再開できない（分割するには RENDER_SEGMENT_SECONDS と ffmpeg が必要）
+    return {'mode': 'single_pass', 'on_restart': 'restart_from_frame_0'}
+
+def recover_jobs():
+    """ジャーナルが残っている（待機中・レンダリング中に終了した）ジョブを復元し、元の投入時刻で再キュー"""
+    for journal in find_journals(UPLOAD_FOLDER):
+        uid = journal.job_dir.name
+        if uid in job_meta:
+            continue
+        mlt_file = journal.job_dir / "cloud_rendering.mlt"
+        output_file = journal.job_dir / "output.mp4"
+        if journal.running_pid:
+            stop_orphaned_melt(journal.running_pid, str(mlt_file))
+        single_pass = journal.started and not journal.total_frames
+        if output_file.exists() and not single_pass:
+            # 出力（キャッシュのリンク・セグメントの連結結果）は完成してから置かれる
+            journal.discard()
+            continue
+        # 1回の melt で書いていた出力（断片化MP4など）は途中までなので捨てる
+        output_file.unlink(missing_ok=True)
+        zip_file = UPLOAD_FOLDER / f"{uid}.zip"
+        if zip_file.exists():
+            extracted = False  # 展開し直す
+        elif mlt_file.exists():
+            extracted = True
+        else:
+            journal.discard()
+            continue
+        meta = job_meta[uid] = dict(journal.job, extracted=extracted)
+        meta['resumed'] = journal.started
+        meta['checkpoint'] = checkpoint_status()
+        done, total = journal.completed_frames(), journal.total_frames
+        if total:
+            progress_dict[uid] = {'current': done, 'total': total, 'status': 'waiting'}
+        # 残りのフレーム分だけを見積もりに使う
+        estimate = estimate_job(uid) * (1 - done / total if total else 1)
+        job_queue.put(uid, estimate, meta.get('client_ip', ''), enqueued_at=meta.get('queued_at'))
+        if total:
+            print(f"Checkpoint: resuming job {uid} from frame {done}/{total}")
+        else:
+            print(f"Checkpoint: requeued job {uid}" + (" (restarting from frame 0)" if journal.started else ""))
+
+def start_xvfb_pool():
+    """常駐 Xvfb を起動。失敗した場合は従来の xvfb-run -a で melt を起動する"""
+    global xvfb_pool
+    if xvfb_pool is None:
+        return
+    try:
+        xvfb_pool.start()
+    except Exception as e:
+        print(f"Xvfb pool unavailable, falling back to xvfb-run: {e}")
+        xvfb_pool.stop()
+        xvfb_pool = None
+
 def worker_thread():
     """ワーカースレッド：キューからジョブを取り出して処理する"""
     while True:
@@ -139,32 +276,41 @@ def worker_thread():
             
             # 処理中としてマーク
             processing_jobs.add(unique_id)
+            meta = job_meta.setdefault(unique_id, {})
+            if 'queued_at' in meta:
+                meta['queue_wait_seconds'] = time.time() - meta['queued_at']
+                queue_wait_seconds.observe(meta['queue_wait_seconds'])
             
             # ファイルパスを構築
             filepath = UPLOAD_FOLDER / f"{unique_id}.zip"
             
-            # ファイルが存在するかチェック
-            if not filepath.exists():
+            # ファイルが存在するかチェック（ストリーム展開済みのジョブはZIPを持たない）
+            if not filepath.exists() and not meta.get('extracted'):
                 print(f"Worker: File not found for job {unique_id}: {filepath}")
-                job_queue.task_done()
+                job_queue.finish(unique_id)
                 processing_jobs.discard(unique_id)
                 completed_jobs.add(unique_id)
                 continue
             
             # 既存のprocess_file関数を使用してファイル処理
-            process_file(filepath, unique_id)
+            if process_file(filepath, unique_id):
+                # 監視スレッドが停止させたジョブは再キュー（待ち時間はそのまま引き継ぐ）
+                job_queue.requeue(unique_id)
+                processing_jobs.discard(unique_id)
+                print(f"Worker: Job {unique_id} requeued")
+                continue
             
             print(f"Worker: Job {unique_id} completed")
             
             # タスク完了をマーク
-            job_queue.task_done()
+            job_queue.finish(unique_id)
             processing_jobs.discard(unique_id)
             completed_jobs.add(unique_id)
             
         except Exception as e:
             print(f"Worker error: {e}")
             # エラーでもタスク完了をマーク
-            job_queue.task_done()
+            job_queue.finish(unique_id)
             processing_jobs.discard(unique_id)
             completed_jobs.add(unique_id)
 
@@ -223,73 +369,455 @@ def get_mlt_duration(mlt_file):
         print(f"Error parsing MLT file: {e}")
         return 1
 
-def render_with_progress(mlt_file, output_file, uid):
+    # タイムコードが取得できない場合も進捗計算が壊れないよう1を返す
+    return 1
+
+def get_mlt_profile_size(mlt_file):
+    """MLTファイルの<profile>から (width, height) を取得。取得できなければNone"""
+    try:
+        profile = ET.parse(mlt_file).getroot().find('profile')
+        if profile is not None:
+            return int(profile.get('width')), int(profile.get('height'))
+    except Exception as e:
+        print(f"Error reading MLT profile size: {e}")
+    return None
+
+def get_mlt_fps(mlt_file):
+    """MLTファイルの<profile>からfpsを取得。取得できなければNone"""
+    try:
+        profile = ET.parse(mlt_file).getroot().find('profile')
+        if profile is not None:
+            fps_den = int(profile.get('frame_rate_den', '1'))
+            return int(profile.get('frame_rate_num', '0')) / fps_den if fps_den else None
+    except Exception as e:
+        print(f"Error reading MLT fps: {e}")
+    return None
+
+def read_job_mlt(unique_id):
+    """キュー登録前のジョブの cloud_rendering.mlt をバイト列で取得（展開済みならファイル、未展開ならZIPから）"""
+    extract_dir = UPLOAD_FOLDER / unique_id
+    if job_meta.get(unique_id, {}).get('extracted'):
+        return (extract_dir / "cloud_rendering.mlt").read_bytes()
+    with zipfile.ZipFile(UPLOAD_FOLDER / f"{unique_id}.zip") as zip_ref:
+        return zip_ref.read("cloud_rendering.mlt")
+
+def estimate_job(unique_id):
+    """
+    キュー登録時にジョブのレンダリング時間を見積もる
+    （総フレーム数・出力解像度・フィルター数・プロファイルの実績処理速度から算出）
+    """
+    meta = job_meta.setdefault(unique_id, {})
+    profile_name = meta.get('profile')
+    if not profile_name and meta.get('extracted'):
+        profile_name = resolve_profile_name(read_render_manifest(UPLOAD_FOLDER / unique_id).get('profile'))
+    profile_name = profile_name or resolve_profile_name(None)
+    report = meta.get('preflight') or {}
+    if report.get('total_frames'):
+        # 事前検査で解析済みなら MLT を読み直さない
+        total_frames = report['total_frames']
+        width, height = report.get('width') or 1920, report.get('height') or 1080
+        filter_count = report.get('filter_count', 0)
+    else:
+        try:
+            mlt_bytes = read_job_mlt(unique_id)
+            total_frames = get_mlt_duration(io.BytesIO(mlt_bytes))
+            width, height = get_mlt_profile_size(io.BytesIO(mlt_bytes)) or (1920, 1080)
+            filter_count = sum(1 for _ in ET.fromstring(mlt_bytes).iter('filter'))
+        except Exception as e:
+            print(f"Cost estimation failed for {unique_id}: {e}")
+            return 0.0
+    scale = RENDER_PROFILES.get(profile_name, {}).get('scale', 1.0)
+    units = job_cost_units(total_frames, width, height, scale, filter_count)
+    seconds = estimate_seconds(units, profile_name, get_units_per_second(profile_name))
+    meta['cost_units'] = units
+    meta['estimated_seconds'] = seconds
+    print(f"Job {unique_id} estimate: {total_frames} frames, {width}x{height}, "
+          f"{filter_count} filters -> {seconds:.0f}s ({profile_name})")
+    return seconds
+
+def read_render_manifest(extract_dir: Path):
+    """アーカイブ内の render.json（任意）を読み込む"""
+    manifest_file = extract_dir / "render.json"
+    if not manifest_file.exists():
+        return {}
+    try:
+        return json.loads(manifest_file.read_text(encoding='utf-8'))
+    except Exception as e:
+        print(f"Invalid render.json: {e}")
+        return {}
+
+def start_melt(cmd):
+    """
+    melt を起動（常駐 Xvfb があれば DISPLAY を設定して直接、無ければ xvfb-run -a 経由。MELT_XVFB=0 ならそのまま）
+
+    Returns:
+        (proc, display)。display は終了後に release_display() へ渡す
+    """
+    if MELT_XVFB:
+        cmd, env, display = melt_launch(xvfb_pool, cmd)
+    else:
+        env, display = None, None
+    try:
+        # melt（xvfb-run 経由なら Xvfb も）をまとめて停止できるよう新しいセッションで起動
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                start_new_session=True, env=env)
+    except Exception:
+        release_display(display)
+        raise
+    return proc, display
+
+def release_display(display):
+    if display is not None and xvfb_pool is not None:
+        xvfb_pool.release(display)
+
+def run_melt(cmd, uid, telemetry, watch_frames, frame_offset=0, on_launch=None):
+    """
+    melt を起動し、進捗を progress_dict とテレメトリに反映しながら終了を待つ
+
+    Args:
+        watch_frames: この melt が出力するフレーム数（監視スレッドの制限時間の計算用）
+        frame_offset: 進捗に足すフレーム数（セグメント単位のレンダリングで、先行セグメントの分）
+        on_launch: 起動直後に melt の PID を渡して呼ぶ関数（チェックポイントのジャーナルへの記録用）
+
+    Returns:
+        melt の終了コード。監視スレッドが停止させた場合は RenderStalled
+    """
+    launched = time.time()
+    proc, display = start_melt(cmd)
+    if on_launch is not None:
+        on_launch(proc.pid)
+    render_watchdog.watch(uid, proc, watch_frames)
+    last_log_time = 0
+    total_frames = progress_dict[uid]['total']
+
+    try:
+        for line in iter_melt_output(proc.stdout):
+            current_pos = parse_progress(line)
+            if current_pos is not None:
+                if telemetry.startup_seconds is None:
+                    # ディスプレイ確保から最初のフレームまで（常駐 Xvfb による短縮を確認する）
+                    display_mode = "pool" if display else "xvfb-run" if MELT_XVFB else "none"
+                    telemetry.record_startup(time.time() - launched, display_mode)
+                    print(f"melt started in {telemetry.startup_seconds:.2f}s "
+                          f"({display.name if display else display_mode})")
+                # in= を指定した melt はタイムライン上の位置を報告する
+                if frame_offset and current_pos >= frame_offset:
+                    current_pos -= frame_offset
+                current_pos = frame_offset + min(current_pos, watch_frames)
+                progress_dict[uid]['current'] = current_pos
+                render_watchdog.progress(uid, current_pos)
+
+                # 進捗ログ・テレメトリ更新は1秒間隔で制限
+                if telemetry.update(current_pos, proc.pid):
+                    progress_pct = int(current_pos/total_frames*100) if total_frames > 0 else 0
+                    print(f"Progress: {current_pos}/{total_frames} ({progress_pct}%) {telemetry.fps:.1f}fps")
+            else:
+                # 進捗以外の出力（警告など）も1秒間隔でログ
+                current_time = time.time()
+                if current_time - last_log_time >= 1.0:
+                    print(f"Melt output: {line}")
+                    last_log_time = current_time
+
+        proc.wait()
+    finally:
+        stalled = render_watchdog.unwatch(uid)
+        release_display(display)
+
+    if stalled:
+        jobs_total.inc(profile=telemetry.profile, status='stalled')
+        raise RenderStalled(stalled)
+    if proc.returncode != 0:
+        print(f"melt exited with code {proc.returncode}")
+    return proc.returncode
+
+def render_with_progress(mlt_file, output_file, uid, profile_name):
     """進行状況を追跡しながらレンダリングを実行"""
     # MLTファイルから総フレーム数を取得
     total_frames = get_mlt_duration(mlt_file)
-    print(f"MLT duration: {total_frames} frames")
+    print(f"MLT duration: {total_frames} frames, profile: {profile_name}")
     
     progress_dict[uid] = {'current': 0, 'total': total_frames, 'status': 'running'}
-    cmd = ["xvfb-run", "-a", "/usr/bin/melt", str(mlt_file), "-progress", "-consumer", f"avformat:{output_file}"]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    consumer_args = build_consumer_args(profile_name, output_file, get_mlt_profile_size(mlt_file),
+                                        progressive=job_meta.get(uid, {}).get('progressive', False))
+    telemetry = JobTelemetry(uid, profile_name, total_frames)
+    job_telemetry[uid] = telemetry
+    # 途中から再開はできないが、再起動後に再キューし、残った melt を止められるよう記録する
+    journal = job_journal(uid)
+    if journal is not None:
+        journal.begin(job_meta.get(uid, {}))
+    job_meta.setdefault(uid, {})['checkpoint'] = checkpoint_status(segmented=False)
 
-    last_log_time = 0
-    last_progress_time = 0
-    
-    for line in proc.stdout:
-        line = line.strip()
-        current_time = time.time()
-        
-        # デバッグログは1秒間隔で制限
-        if current_time - last_log_time >= 1.0:
-            print(f"Melt output: {line}")
-            last_log_time = current_time
-        
-        # 複数のパターンでCurrent Positionを取得
-        patterns = [
-            r"Current Position:\s*(\d+)",
-            r"Position:\s*(\d+)",
-            r"Frame:\s*(\d+)",
-            r"(\d+)\s*frames"
-        ]
-        
-        for pattern in patterns:
-            m = re.search(pattern, line)
-            if m:
-                current_pos = int(m.group(1))
-                progress_dict[uid]['current'] = current_pos
-                
-                # 進捗ログも1秒間隔で制限
-                if current_time - last_progress_time >= 1.0:
-                    progress_pct = int(current_pos/total_frames*100) if total_frames > 0 else 0
-                    print(f"Progress: {current_pos}/{total_frames} ({progress_pct}%)")
-                    last_progress_time = current_time
-                break
+    try:
+        returncode = run_melt(MELT_COMMAND + [str(mlt_file), "-progress"] + consumer_args, uid, telemetry, total_frames,
+                              on_launch=journal.set_running if journal is not None else None)
+    finally:
+        clear_job_gauges(uid, profile_name)
+    finish_render(uid, profile_name, telemetry, returncode == 0)
+    return returncode == 0
+
+def plan_job_segments(mlt_file, uid, profile_name):
+    """
+    セグメント単位でレンダリングする場合はセグメントの一覧、しない場合は None
+    （断片化MP4・ffmpeg が無い・短いプロジェクト・RENDER_SEGMENT_SECONDS=0 では分割しない）
+    チェックポイントが有効なら、キャッシュのキーを作れないプロジェクトもキー無しで分割する
+    """
+    if job_meta.get(uid, {}).get('progressive') or not ffmpeg_available():
+        return None
+    # 出力に影響するレンダリング設定（スレッド数など出力の変わらない指定は含めない）
+    fingerprint = json.dumps({
+        'profile': profile_name,
+        'settings': RENDER_PROFILES.get(profile_name),
+        'source_size': get_mlt_profile_size(mlt_file),
+    }, sort_keys=True)
+    return plan_segments(mlt_file, get_mlt_duration(mlt_file), get_mlt_fps(mlt_file),
+                         job_meta.get(uid, {}).get('member_hashes', {}), fingerprint,
+                         keyless_fallback=CHECKPOINTS_ENABLED)
+
+def render_segment(mlt_file, segment_file, uid, profile_name, segment, telemetry, journal=None):
+    """1セグメントを melt の in/out でレンダリング（途中で止まっても中途半端なファイルを残さない）"""
+    partial = segment_file.with_name(f"{segment_file.stem}.partial.mp4")
+    consumer_args = build_consumer_args(profile_name, partial, get_mlt_profile_size(mlt_file))
+    cmd = MELT_COMMAND + [str(mlt_file), f"in={segment.start}", f"out={segment.end - 1}", "-progress"] + consumer_args
+    try:
+        on_launch = journal.set_running if journal is not None else None
+        if run_melt(cmd, uid, telemetry, segment.frames, frame_offset=segment.start,
+                    on_launch=on_launch) != 0 or not partial.exists():
+            return False
+        os.replace(partial, segment_file)
+        return True
+    finally:
+        partial.unlink(missing_ok=True)
+
+def render_segmented(mlt_file, output_file, uid, profile_name, segments):
+    """
+    キャッシュに無いセグメントだけをレンダリングし、ffmpeg で1本の output.mp4 につなぐ
+
+    チェックポイントが有効なら完了したセグメントをジャーナルに記録し、
+    再起動後の再開では記録済みのセグメントを飛ばして、進捗もその続きから数える。
+    """
+    total_frames = segments[-1].end
+    segment_dir = output_file.parent / "segments"
+    segment_dir.mkdir(exist_ok=True)
+    journal = job_journal(uid)
+    done = set()
+    if journal is not None:
+        journal.begin(job_meta.get(uid, {}), segments)
+        done = {segment.index for segment in segments
+                if journal.is_completed(segment, segment_dir / segment.file_name)}
+    job_meta.setdefault(uid, {})['checkpoint'] = checkpoint_status(segmented=True)
+    resumed_frames = sum(segment.frames for segment in segments if segment.index in done)
+    print(f"MLT duration: {total_frames} frames in {len(segments)} segments, profile: {profile_name}"
+          + (f", resuming after {len(done)} completed segments" if done else ""))
+    progress_dict[uid] = {'current': resumed_frames, 'total': total_frames, 'status': 'running'}
+    telemetry = JobTelemetry(uid, profile_name, total_frames)
+    telemetry.skip_to(resumed_frames)
+    job_telemetry[uid] = telemetry
+    info = job_meta.setdefault(uid, {})['segments'] = {'total': len(segments), 'reused': 0, 'rendered': 0,
+                                                        'resumed': len(done)}
+
+    encoded_frames = 0
+    try:
+        for segment in segments:
+            if segment.index in done:
+                continue
+            segment_file = segment_dir / segment.file_name
+            cached = segment_cache.lookup(segment.key) if segment.key is not None else None
+            try:
+                if cached is not None:
+                    link_output(cached, segment_file)
+                    info['reused'] += 1
+                    progress_dict[uid]['current'] = segment.end
+                    telemetry.skip_to(segment.end)
+                    if journal is not None:
+                        journal.record(segment, segment_file)
+                    continue
+            except OSError:
+                # 確認後にキャッシュから削除された場合はレンダリングする
+                pass
+            if not render_segment(mlt_file, segment_file, uid, profile_name, segment, telemetry, journal):
+                print(f"Segment {segment.index} failed (ID: {uid})")
+                finish_render(uid, profile_name, telemetry, False)
+                return False
+            if journal is not None:
+                journal.record(segment, segment_file)
+            if segment.key is not None:
+                segment_cache.store(segment.key, segment_file)
+            info['rendered'] += 1
+            encoded_frames += segment.frames
+            progress_dict[uid]['current'] = segment.end
+    finally:
+        clear_job_gauges(uid, profile_name)
+
+    stitch_segments([segment_dir / segment.file_name for segment in segments], output_file)
+    # 再利用できるものはキャッシュに登録済み。ジョブ側に残すと出力の2倍近くディスクを使い、
+    # ハードリンクがキャッシュから削除したファイルも残してしまう
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    print(f"Segments: {info['rendered']} rendered, {info['reused']} reused from cache, "
+          f"{info['resumed']} resumed from checkpoint (ID: {uid})")
+    finish_render(uid, profile_name, telemetry, True, encoded_frames=encoded_frames)
+    return True
+
+def render_locally(mlt_file, output_file, uid, profile_name):
+    """このサーバーでレンダリング（分割できるプロジェクトはセグメント単位）"""
+    segments = plan_job_segments(mlt_file, uid, profile_name)
+    if segments is None:
+        return render_with_progress(mlt_file, output_file, uid, profile_name)
+    return render_segmented(mlt_file, output_file, uid, profile_name, segments)
+
+def render_preview(mlt_file, preview_file, uid):
+    """本レンダリングの前に低解像度・高速プリセットのプレビューを出力（失敗しても本レンダリングは続行）"""
+    total_frames = get_mlt_duration(mlt_file)
+    preview = {'status': 'rendering', 'progress': 0}
+    job_meta.setdefault(uid, {})['preview'] = preview
+    consumer_args = build_consumer_args(PREVIEW_PROFILE_NAME, preview_file, get_mlt_profile_size(mlt_file))
+    print(f"Starting preview render (ID: {uid})")
+
+    started = time.time()
+    proc, display = start_melt(MELT_COMMAND + [str(mlt_file), "-progress"] + consumer_args)
+    watch_key = f"{uid}:preview"
+    render_watchdog.watch(watch_key, proc, total_frames)
+    try:
+        for line in iter_melt_output(proc.stdout):
+            current_pos = parse_progress(line)
+            if current_pos is not None:
+                render_watchdog.progress(watch_key, current_pos)
+                if total_frames > 0:
+                    preview['progress'] = min(100, int(current_pos / total_frames * 100))
+        proc.wait()
+    finally:
+        stalled = render_watchdog.unwatch(watch_key)
+        release_display(display)
+
+    preview['seconds'] = round(time.time() - started, 1)
+    if proc.returncode == 0 and preview_file.exists():
+        preview.update(status='ready', progress=100)
+        print(f"Preview ready in {preview['seconds']}s (ID: {uid})")
+    else:
+        preview['status'] = 'error'
+        print(f"Preview render failed (ID: {uid}): {stalled or f'exit code {proc.returncode}'}")
+
+def finish_render(uid, profile_name, telemetry, succeeded, encoded_frames=None):
+    """
+    レンダリング終了時のメトリクス記録と進捗の更新
+
+    Args:
+        encoded_frames: 実際にエンコードしたフレーム数（キャッシュ済みセグメントを除く）。省略時は進捗のフレーム数
+    """
+    duration = time.time() - telemetry.started_at
+    jobs_total.inc(profile=profile_name, status='completed' if succeeded else 'error')
+    job_duration_seconds.observe(duration, profile=profile_name)
+    if succeeded and encoded_frames != 0:
+        # 処理速度の学習には全体をレンダリングしたジョブだけ使う（一部だけのジョブは速く見えてしまう）
+        cost_units = job_meta.get(uid, {}).get('cost_units') if encoded_frames is None else None
+        record_encode(profile_name, encoded_frames if encoded_frames is not None else progress_dict[uid]['current'],
+                      duration, cost_units)
+    if succeeded:
+        progress_dict[uid]['current'] = progress_dict[uid]['total']
+    # 失敗は 'error'（レンダリング中のダウンロードが、途中までのファイルを完了として扱わないように）
+    progress_dict[uid]['status'] = 'completed' if succeeded else 'error'
+
+def update_farm_progress(uid, current_frame):
+    """エージェントからの進捗報告を反映"""
+    if uid in progress_dict:
+        progress_dict[uid]['current'] = current_frame
+    telemetry = job_telemetry.get(uid)
+    if telemetry is not None:
+        telemetry.update(current_frame)
+
+# 分散レンダリングのコーディネーター（RENDER_MODE=coordinator のときのみ使用）
+farm = FarmCoordinator(on_progress=update_farm_progress)
+
+def render_on_farm(mlt_file, output_file, uid, profile_name):
+    """レンダリングエージェントにジョブを渡し、結果のアップロードまで待つ"""
+    total_frames = get_mlt_duration(mlt_file)
+    print(f"MLT duration: {total_frames} frames, profile: {profile_name} (farm)")
+
+    progress_dict[uid] = {'current': 0, 'total': total_frames, 'status': 'running'}
+    telemetry = JobTelemetry(uid, profile_name, total_frames)
+    job_telemetry[uid] = telemetry
 
-    proc.wait()
-    progress_dict[uid]['current'] = progress_dict[uid]['total']
-    progress_dict[uid]['status'] = 'completed'
+    spec = {
+        'profile': profile_name,
+        'total_frames': total_frames,
+        'source_size': get_mlt_profile_size(mlt_file),
+    }
+    try:
+        succeeded, error = farm.submit(uid, spec)
+    finally:
+        clear_job_gauges(uid, profile_name)
+
+    if not succeeded:
+        print(f"Farm render failed (ID: {uid}): {error}")
+    finish_render(uid, profile_name, telemetry, succeeded and output_file.exists())
+    return succeeded and output_file.exists()
+
+render_job = render_on_farm if RENDER_MODE == "coordinator" else render_locally
+
+def record_render(unique_id, mlt_file, output_file, profile_name, job_key):
+    """完了したレンダリングをカタログに登録（/list・キャッシュ検索用）"""
+    if not output_file.exists():
+        return
+    fps = get_mlt_fps(mlt_file)
+    total_frames = progress_dict[unique_id]['total']
+    catalog.record(
+        unique_id,
+        size=output_file.stat().st_size,
+        created=time.time(),
+        duration=round(total_frames / fps, 3) if fps else None,
+        profile=profile_name,
+        job_key=job_key
+    )
+
+def wants_option(unique_id, extract_dir, name):
+    """
+    ジョブごとの任意指定が有効か（アップロード時のヘッダー または render.json の "<name>": true）
+
+    name: "preview"（X-Preview）/ "progressive"（X-Progressive）
+    """
+    if job_meta.get(unique_id, {}).get(f'{name}_requested'):
+        return True
+    return bool(read_render_manifest(extract_dir).get(name))
 
 def process_file(filepath: Path, unique_id: str):
-    """バックグラウンドでZIP解凍とレンダリングを行う"""
+    """
+    バックグラウンドでZIP解凍とレンダリングを行う
+
+    Returns:
+        監視スレッドが melt を停止し、再キューすべき場合は True
+    """
     try:
         print(f"Processing file: {filepath} (ID: {unique_id})")
         
-        # meltコマンドの存在確認
-        melt_path = "/usr/bin/melt"
-        if not Path(melt_path).exists():
-            raise FileNotFoundError(f"Path check:melt command not found at {melt_path}")
+        # meltコマンドの存在確認（coordinator ではエージェント側で実行するため不要）
+        if RENDER_MODE != "coordinator" and shutil.which(MELT_COMMAND[0]) is None:
+            raise FileNotFoundError(f"Path check:melt command not found at {MELT_COMMAND[0]}")
         print(f"Path check successful")
 
         # 解凍用フォルダ（ユニークIDを使用）
         extract_dir = filepath.parent / unique_id
-        extract_dir.mkdir(exist_ok=True)
-        print(f"Extracting to: {extract_dir}")
 
-        # zip解凍
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
-        print("ZIP extraction completed")
+        if job_meta.get(unique_id, {}).get('extracted'):
+            # アップロード中に展開済み
+            print(f"Already extracted during upload: {extract_dir}")
+        else:
+            extract_dir.mkdir(exist_ok=True)
+            print(f"Extracting to: {extract_dir}")
+
+            # zip解凍（同時に各ファイルのハッシュを計算）
+            extract_start = time.time()
+            job_meta.setdefault(unique_id, {})['member_hashes'] = extract_zip(filepath, extract_dir)
+            extract_elapsed = time.time() - extract_start
+            job_meta.setdefault(unique_id, {})['extract_seconds'] = extract_elapsed
+            job_meta[unique_id]['extracted'] = True  # 再キュー時は展開を省略
+            journal = job_journal(unique_id)
+            if journal is not None:
+                # zip は削除するので、再起動後は展開済みのファイルから再開する
+                journal.save_job(job_meta[unique_id])
+            extract_seconds.observe(extract_elapsed)
+            print(f"ZIP extraction completed in {extract_elapsed:.1f}s")
+
+            # 展開が終わった zip は不要なので削除
+            storage.on_extracted(unique_id)
 
         # meltコマンドでレンダリング（進行状況付き）
         output_file = extract_dir / "output.mp4"
@@ -298,14 +826,80 @@ def process_file(filepath: Path, unique_id: str):
         if not mlt_file.exists():
             raise FileNotFoundError(f"MLT file not found: {mlt_file}")
         
-        print(f"Starting render with progress tracking (ID: {unique_id})")
-        render_with_progress(mlt_file, output_file, unique_id)
+        # プロファイル決定（ヘッダー指定 > render.json > デフォルト）
+        meta = job_meta.setdefault(unique_id, {})
+        profile_name = meta.get('profile')
+        if not profile_name:
+            profile_name = resolve_profile_name(read_render_manifest(extract_dir).get('profile'))
+            if profile_name is None:
+                raise ValueError("Unknown render profile in render.json")
+            meta['profile'] = profile_name
+
+        # 同一内容のレンダリング結果があれば再利用
+        # 断片化MP4（レンダリング中からダウンロード可能）。coordinator では出力がエージェント側にあるため無効
+        meta['progressive'] = RENDER_MODE != "coordinator" and wants_option(unique_id, extract_dir, 'progressive')
+
+        job_key = compute_job_key(mlt_file, meta.get('member_hashes', {}), profile_name,
+                                  {'progressive': True} if meta['progressive'] else None)
+        meta['job_key'] = job_key
+        cached_output, leader_uid = render_cache.acquire(job_key, unique_id)
+
+        if cached_output is not None:
+            link_output(cached_output, output_file)
+            meta['cache_hit'] = leader_uid or cached_output.parent.name
+            total_frames = get_mlt_duration(mlt_file)
+            progress_dict[unique_id] = {'current': total_frames, 'total': total_frames, 'status': 'completed'}
+            print(f"Render cache hit (ID: {unique_id}, source: {meta['cache_hit']})")
+            record_render(unique_id, mlt_file, output_file, profile_name, job_key)
+            if wants_option(unique_id, extract_dir, 'preview'):
+                # 本レンダリングの結果がすぐ使えるのでプレビューは作らない
+                meta['preview'] = {'status': 'skipped', 'reason': 'render_cache_hit'}
+        else:
+            try:
+                if wants_option(unique_id, extract_dir, 'preview'):
+                    preview_file = extract_dir / "preview.mp4"
+                    if RENDER_MODE == "coordinator":
+                        print(f"Preview is not available in coordinator mode (ID: {unique_id})")
+                        meta['preview'] = {'status': 'skipped', 'reason': 'coordinator_mode'}
+                    elif meta.get('resumed'):
+                        # 再起動後に再開したジョブはプレビューを作り直さない
+                        meta['preview'] = ({'status': 'ready', 'progress': 100} if preview_file.exists()
+                                           else {'status': 'skipped', 'reason': 'resumed_after_restart'})
+                    else:
+                        render_preview(mlt_file, preview_file, unique_id)
+                print(f"Starting render with progress tracking (ID: {unique_id})")
+                if render_job(mlt_file, output_file, unique_id, profile_name):
+                    # 待機中の同一ジョブが結果を見つけられるよう、通知前にカタログへ登録
+                    record_render(unique_id, mlt_file, output_file, profile_name, job_key)
+            finally:
+                render_cache.release(job_key)
+        storage.on_render_finished(unique_id)
+        # 完了（または失敗）したジョブは再起動しても再開しない
+        RenderJournal(extract_dir).discard()
 
         print(f"[OK] Render finished: {output_file}")
 
+    except RenderStalled as e:
+        # 途中までの出力は破棄し、再試行回数が残っていれば再キュー（完了済みのセグメントからは再開する）
+        (filepath.parent / unique_id / "output.mp4").unlink(missing_ok=True)
+        meta = job_meta.setdefault(unique_id, {})
+        retries = meta.get('retries', 0)
+        if retries < MAX_RETRIES:
+            meta['retries'] = retries + 1
+            journal = RenderJournal(filepath.parent / unique_id)
+            progress_dict[unique_id] = {'current': journal.completed_frames(), 'total': journal.total_frames or 1,
+                                        'status': 'waiting'}
+            print(f"[RETRY] Render stalled ({e}), retry {retries + 1}/{MAX_RETRIES}")
+            return True
+        print(f"[ERROR] Render stalled ({e}), no retries left")
+        progress_dict[unique_id] = {'current': 0, 'total': 1, 'status': 'error'}
+        RenderJournal(filepath.parent / unique_id).discard()
+
     except Exception as e:
         print(f"[ERROR] Processing failed: {e}")
         progress_dict[unique_id] = {'current': 0, 'total': 1, 'status': 'error'}
+        RenderJournal(filepath.parent / unique_id).discard()
+    return False
 
 
 # endpoint: test テスト用エンドポイント
@@ -340,14 +934,41 @@ def upload():
     """ファイルアップロードエンドポイント：ファイルアップロード後にキューに登録"""
     
     filename = request.headers.get('X-Filename', 'data.zip')
+
+    # レンダリングプロファイル（未指定なら render.json またはデフォルトを後で採用）
+    requested_profile = request.headers.get('X-Render-Profile')
+    profile_name = None
+    if requested_profile:
+        profile_name = resolve_profile_name(requested_profile)
+        if profile_name is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown render profile: {requested_profile}",
+                "profiles": list(RENDER_PROFILES)
+            }), 400
     
     # 16桁のユニークIDを生成
     unique_id = generate_unique_id()
     print(f"Generated unique ID: {unique_id}")
     
+    # アップロード中も容量管理の削除対象にならないよう先に登録
+    job_meta[unique_id] = {
+        'profile': profile_name,
+        'preview_requested': is_truthy(request.headers.get('X-Preview')),
+        'progressive_requested': is_truthy(request.headers.get('X-Progressive')),
+    }
+
+    # ストリーム展開モード（X-Ingest: stream）では受信しながら展開し、ZIPを保存しない
+    archive_format = request.headers.get('X-Archive-Format', 'zip').lower()
+    stream_ingest = request.headers.get('X-Ingest', '').lower() == 'stream' or archive_format == 'tar'
+    if stream_ingest:
+        return upload_streaming(unique_id, filename, profile_name, archive_format)
+
     # ユニークIDをファイル名として使用
     filepath = UPLOAD_FOLDER / f"{unique_id}.zip"
     
+    upload_start = time.time()
+    upload_bytes = 0
     try:
         print(f"Starting file upload to: {filepath}")
         with filepath.open('wb') as f:
@@ -357,23 +978,172 @@ def upload():
                 if not chunk:
                     break
                 f.write(chunk)
-        print(f"File upload completed: {filepath}")
+                upload_bytes += len(chunk)
+                upload_bytes_total.inc(len(chunk))
+        print(f"File upload completed: {filepath} ({upload_bytes} bytes)")
     except PermissionError:
+        job_meta.pop(unique_id, None)
         return jsonify({"status": "error", "message": "Permission denied: cannot write to upload folder"}), 403
     except Exception as e:
+        job_meta.pop(unique_id, None)
         return jsonify({"status": "error", "message": f"Error saving file: {str(e)}"}), 500
 
     # キューにジョブを登録
-    job_queue.put(unique_id)
-    print(f"Job {unique_id} added to queue")
+    try:
+        enqueue_job(unique_id, get_client_ip(), upload_bytes=upload_bytes, upload_seconds=time.time() - upload_start)
+    except PreflightError as e:
+        return jsonify(preflight_rejection(e)), 422
     
-    return jsonify({
-        "status": "success", 
-        "message": "Upload complete and job queued", 
+    return jsonify(upload_result(unique_id, filename, profile_name, "Upload complete and job queued")), 200
+
+
+def run_preflight(unique_id):
+    """
+    アップロード直後の事前検査（ZIPのセントラルディレクトリと MLT だけを読む）
+
+    Raises:
+        PreflightError: MLT が無い・読めない、素材がアーカイブに無いなど
+    """
+    meta = job_meta[unique_id]
+    if meta.get('extracted'):
+        report = inspect_directory(UPLOAD_FOLDER / unique_id, meta.get('member_hashes', {}))
+    else:
+        report = inspect_zip(UPLOAD_FOLDER / f"{unique_id}.zip")
+    meta['preflight'] = report
+    for warning in report['warnings']:
+        print(f"Preflight warning ({unique_id}): {warning}")
+    return check(report)
+
+
+def reject_job(unique_id):
+    """事前検査で拒否したジョブのファイルと状態を削除"""
+    job_meta.pop(unique_id, None)
+    (UPLOAD_FOLDER / f"{unique_id}.zip").unlink(missing_ok=True)
+    shutil.rmtree(UPLOAD_FOLDER / unique_id, ignore_errors=True)
+
+
+def preflight_rejection(error):
+    """事前検査で拒否した場合のレスポンス本文"""
+    return {"status": "error", "message": f"Preflight failed: {error}", "errors": error.errors}
+
+
+def enqueue_job(unique_id, client_ip, **meta):
+    """
+    アップロード完了したジョブを事前検査し、見積もり付きでスケジューラに登録
+
+    Raises:
+        PreflightError: 事前検査で拒否した場合（ジョブのファイルは削除済み）
+    """
+    job_meta[unique_id].update(meta, client_ip=client_ip, queued_at=time.time())
+    try:
+        run_preflight(unique_id)
+    except PreflightError as e:
+        print(f"Job {unique_id} rejected by preflight: {e}")
+        reject_job(unique_id)
+        raise
+    # サーバーが再起動しても待機中のジョブを失わないよう、キュー登録前にジャーナルを書く
+    journal = job_journal(unique_id)
+    if journal is not None:
+        journal.save_job(job_meta[unique_id])
+    job_meta[unique_id]['checkpoint'] = checkpoint_status()
+    job_queue.put(unique_id, estimate_job(unique_id), client_ip)
+    print(f"Job {unique_id} added to queue")
+
+
+def upload_result(unique_id, filename, profile_name, message):
+    """/upload の成功レスポンス本文"""
+    return {
+        "status": "success",
+        "message": message,
         "original_filename": filename,
         "unique_id": unique_id,
+        "render_profile": profile_name,
         "download_url": f"/download/{unique_id}"
-    }), 200
+    }
+
+
+def upload_streaming(unique_id, filename, profile_name, archive_format):
+    """リクエストボディを受信しながら UPLOAD_FOLDER/<id>/ に展開してキューに登録"""
+    extract_dir = UPLOAD_FOLDER / unique_id
+    upload_start = time.time()
+    try:
+        print(f"Starting streaming ingest ({archive_format}) to: {extract_dir}")
+        upload_bytes, member_hashes = ingest_stream(
+            request.stream, extract_dir, archive_format,
+            on_bytes=lambda n: upload_bytes_total.inc(n)
+        )
+        print(f"Streaming ingest completed: {len(member_hashes)} files, {upload_bytes} bytes")
+    except IngestError as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        job_meta.pop(unique_id, None)
+        return jsonify({"status": "error", "message": f"Invalid archive: {str(e)}"}), 400
+    except PermissionError:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        job_meta.pop(unique_id, None)
+        return jsonify({"status": "error", "message": "Permission denied: cannot write to upload folder"}), 403
+    except Exception as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        job_meta.pop(unique_id, None)
+        return jsonify({"status": "error", "message": f"Error saving file: {str(e)}"}), 500
+
+    # 最後のバイトを受信した時点でレンダリング可能
+    try:
+        enqueue_job(unique_id, get_client_ip(), upload_bytes=upload_bytes,
+                    upload_seconds=time.time() - upload_start, extracted=True, member_hashes=member_hashes)
+    except PreflightError as e:
+        return jsonify(preflight_rejection(e)), 422
+
+    return jsonify(upload_result(unique_id, filename, profile_name, "Upload extracted and job queued")), 200
+
+
+# upload receiver callbacks / 専用アップロード受信サーバー（UPLOAD_RECEIVER_PORT）用の処理
+def begin_receiver_upload(headers, client_ip, content_length):
+    """受信開始：プロファイル確認・ID発行（/upload と同じ検証）"""
+    requested_profile = headers.get('x-render-profile')
+    profile_name = None
+    if requested_profile:
+        profile_name = resolve_profile_name(requested_profile)
+        if profile_name is None:
+            raise UploadRejected(400, {
+                "status": "error",
+                "message": f"Unknown render profile: {requested_profile}",
+                "profiles": list(RENDER_PROFILES)
+            })
+    if headers.get('x-archive-format', 'zip').lower() != 'zip':
+        raise UploadRejected(400, {"status": "error", "message": "The upload receiver accepts zip archives only"})
+
+    unique_id = generate_unique_id()
+    print(f"Generated unique ID: {unique_id} (receiver, {content_length} bytes)")
+    job_meta[unique_id] = {
+        'profile': profile_name,
+        'preview_requested': is_truthy(headers.get('x-preview')),
+        'progressive_requested': is_truthy(headers.get('x-progressive')),
+        'client_ip': client_ip,
+        'original_filename': headers.get('x-filename', 'data.zip'),
+    }
+    return unique_id, UPLOAD_FOLDER / f"{unique_id}.zip"
+
+def finish_receiver_upload(unique_id, upload_bytes, upload_seconds):
+    """受信完了：キューに登録してレスポンス本文を返す"""
+    upload_bytes_total.inc(upload_bytes)
+    meta = job_meta[unique_id]
+    print(f"File upload completed: {unique_id}.zip ({upload_bytes} bytes, {upload_seconds:.1f}s)")
+    try:
+        enqueue_job(unique_id, meta['client_ip'], upload_bytes=upload_bytes, upload_seconds=upload_seconds)
+    except PreflightError as e:
+        return 422, preflight_rejection(e)
+    return 200, upload_result(unique_id, meta['original_filename'], meta['profile'], "Upload complete and job queued")
+
+def abort_receiver_upload(unique_id):
+    """受信失敗：途中までのファイルを削除"""
+    job_meta.pop(unique_id, None)
+    (UPLOAD_FOLDER / f"{unique_id}.zip").unlink(missing_ok=True)
+
+# gunicorn のスレッドを使わずに大容量アップロードを受信するサーバー
+upload_receiver = UploadReceiver(
+    begin_receiver_upload, finish_receiver_upload, abort_receiver_upload,
+    max_content_length=app.config['MAX_CONTENT_LENGTH']
+)
 
 
 # endpoint: download file ファイルダウンロードエンドポイント
@@ -383,22 +1153,65 @@ def download_file(unique_id):
     try:
         # ファイルパスを構築（ユニークIDを使用）
         file_path = UPLOAD_FOLDER / unique_id / "output.mp4"
+
+        # 断片化MP4でレンダリング中なら、書き終わった断片までを順次送信
+        if job_meta.get(unique_id, {}).get('progressive') and unique_id in processing_jobs:
+            storage.on_download(unique_id)
+            return send_growing_mp4(file_path, f"{unique_id}_output.mp4",
+                                    lambda: unique_id not in processing_jobs,
+                                    lambda: progress_dict.get(unique_id, {}).get('status') == 'completed')
         
         if not file_path.exists():
             return jsonify({"status": "error", "message": "File not found"}), 404
         
-        # ファイルをダウンロードとして送信
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=f"{unique_id}_output.mp4",
-            mimetype="video/mp4"
-        )
+        # ファイルをダウンロードとして送信（Range / If-Range 対応）
+        storage.on_download(unique_id)
+        catalog.touch_download(unique_id, time.time())
+        return send_media_file(file_path, f"{unique_id}_output.mp4", UPLOAD_FOLDER)
     
     except Exception as e:
         return jsonify({"status": "error", "message": f"Download failed: {str(e)}"}), 500
 
 
+@app.route('/download/<unique_id>/preview')
+def download_preview(unique_id):
+    """プレビュー（低解像度版）をダウンロード"""
+    try:
+        file_path = UPLOAD_FOLDER / unique_id / "preview.mp4"
+        if not file_path.exists():
+            return jsonify({"status": "error", "message": "Preview not found"}), 404
+        return send_media_file(file_path, f"{unique_id}_preview.mp4", UPLOAD_FOLDER)
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Download failed: {str(e)}"}), 500
+
+
+def get_preview_status(unique_id):
+    """プレビューの状態（要求されていなければ None）"""
+    meta = job_meta.get(unique_id, {})
+    preview = meta.get('preview')
+    if preview is None:
+        if not meta.get('preview_requested'):
+            return None
+        if unique_id in completed_jobs:
+            # プレビューの前に処理が失敗したジョブ
+            return {'status': 'skipped', 'reason': 'job_finished'}
+        return {'status': 'pending', 'progress': 0}
+    result = dict(preview)
+    if preview['status'] == 'ready':
+        result['download_url'] = f"/download/{unique_id}/preview"
+    return result
+
+
+def get_job_telemetry(unique_id):
+    """ジョブのテレメトリ（アップロード・待機・解凍・レンダリング）をまとめる"""
+    meta = job_meta.get(unique_id, {})
+    result = {key: meta.get(key) for key in ('upload_bytes', 'upload_seconds', 'queue_wait_seconds', 'extract_seconds')}
+    telemetry = job_telemetry.get(unique_id)
+    if telemetry is not None:
+        result.update(telemetry.as_dict())
+    return result
+
+
 # endpoint: check job status ジョブ状態確認エンドポイント 
 @app.route('/status/<unique_id>')
 def status(unique_id):
@@ -417,15 +1230,28 @@ def status(unique_id):
     else:
         progress = 0
     
-    # キュー内の位置を計算
-    queue_position = get_queue_position(unique_id)
+    # キュー内の位置と開始・終了予定時刻（UNIX時間）
+    prediction = predict_schedule().get(unique_id, {})
+    queue_position = prediction.get('position') or 0
     
     return jsonify({
         "status": job_status_result,
         "progress": progress,
         "current": progress_info['current'],
         "total": progress_info['total'],
-        "queue": queue_position
+        "queue": queue_position,
+        "estimated_seconds": prediction.get('estimated_seconds'),
+        "predicted_start": prediction.get('predicted_start'),
+        "predicted_finish": prediction.get('predicted_finish'),
+        "render_profile": job_meta.get(unique_id, {}).get('profile'),
+        "cache_hit": job_meta.get(unique_id, {}).get('cache_hit'),
+        "segments": job_meta.get(unique_id, {}).get('segments'),
+        "checkpoint": job_meta.get(unique_id, {}).get('checkpoint'),
+        "preview": get_preview_status(unique_id),
+        "progressive": job_meta.get(unique_id, {}).get('progressive', False),
+        "retries": job_meta.get(unique_id, {}).get('retries', 0),
+        "warnings": job_meta.get(unique_id, {}).get('preflight', {}).get('warnings', []),
+        "telemetry": get_job_telemetry(unique_id)
     })
 
 
@@ -447,38 +1273,215 @@ def server_status():
         else:
             server_status = "processing"
         
+        # 待機中・実行中ジョブの開始・終了予定時刻（開始予定順）
+        schedule = sorted(
+            ({"unique_id": uid, **prediction} for uid, prediction in predict_schedule().items()),
+            key=lambda item: item['predicted_start']
+        )
+        
         return jsonify({
             "status": server_status,
             "queue": queue_count,
-            "current_job": current_job
+            "current_job": current_job,
+            "schedule": schedule,
+            "render_mode": RENDER_MODE,
+            "receiver_uploads": upload_receiver.active_uploads,
+            "watchdog_kills": render_watchdog.kills_total,
+            "xvfb_pool": xvfb_pool.get_stats() if xvfb_pool is not None else None,
+            "farm": farm.get_stats() if RENDER_MODE == "coordinator" else None,
+            "storage": storage.get_stats(),
+            "segment_cache": segment_cache.get_stats()
         }), 200
     
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to get server status: {str(e)}"}), 500
 
 
+@app.route('/metrics')
+@ip_restricted
+def metrics():
+    """Prometheus テキスト形式のメトリクス"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/profiles')
+def list_profiles():
+    """利用可能なレンダリングプロファイルと実測エンコードfpsを取得"""
+    return jsonify({"status": "success", "profiles": get_profile_summary()}), 200
+
+
 @app.route('/list')
 @ip_restricted
 def list_files():
-    """レンダリング済みファイルの一覧を取得"""
+    """
+    レンダリング済みファイルの一覧を取得（カタログから返し、ファイルシステムは走査しない）
+
+    クエリパラメータ:
+        limit: 1ページの件数（既定100、最大1000）
+        cursor: 前回レスポンスの next_cursor
+        sort: created / size / duration / last_download（既定 created）
+        order: asc / desc（既定 desc）
+        profile: レンダリングプロファイルで絞り込み
+        created_after / created_before: 作成時刻（UNIX時間）で絞り込み
+    """
+    args = request.args
     try:
-        files = []
-        for item in UPLOAD_FOLDER.iterdir():
-            if item.is_dir():
-                output_file = item / "output.mp4"
-                if output_file.exists():
-                    files.append({
-                        "unique_id": item.name,
-                        "download_url": f"/download/{item.name}",
-                        "size": output_file.stat().st_size,
-                        "created": output_file.stat().st_ctime
-                    })
-        
-        return jsonify({"status": "success", "files": files}), 200
-    
+        items, next_cursor = catalog.query(
+            limit=args.get('limit', 100, type=int),
+            cursor=args.get('cursor'),
+            sort=args.get('sort', 'created'),
+            order=args.get('order', 'desc'),
+            profile=args.get('profile'),
+            created_after=args.get('created_after', type=float),
+            created_before=args.get('created_before', type=float),
+        )
+    except CatalogQueryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to list files: {str(e)}"}), 500
 
+    files = []
+    for item in items:
+        files.append({
+            "unique_id": item['id'],
+            "download_url": f"/download/{item['id']}",
+            "size": item['size'],
+            "created": item['created'],
+            "duration": item['duration'],
+            "profile": item['profile'],
+            "last_download": item['last_download']
+        })
+
+    return jsonify({"status": "success", "files": files, "next_cursor": next_cursor}), 200
+
+
+# endpoints for render agents / レンダリングエージェント用エンドポイント
+def agent_auth(view_func):
+    """RENDER_AGENT_TOKEN が設定されていれば X-Agent-Token で、無ければIPで認証"""
+    @wraps(view_func)
+    def _wrapped(*args, **kwargs):
+        if RENDER_MODE != "coordinator":
+            return jsonify({"status": "error", "message": "Server is not running in coordinator mode"}), 404
+        if RENDER_AGENT_TOKEN:
+            token = request.headers.get("X-Agent-Token", "")
+            if not hmac.compare_digest(token, RENDER_AGENT_TOKEN):
+                return jsonify({"status": "error", "message": "Invalid agent token"}), 403
+        elif get_client_ip() not in ALLOWED_IPS | {"127.0.0.1", "::1"}:
+            return jsonify({"status": "error", "message": "Forbidden from this IP"}), 403
+        return view_func(*args, **kwargs)
+    return _wrapped
+
+
+@app.route('/agent/claim', methods=['POST'])
+@agent_auth
+def agent_claim():
+    """割り当て待ちのジョブを取得（ロングポーリング。ジョブが無ければ204）"""
+    body = request.get_json(silent=True) or {}
+    agent_id = body.get('agent_id')
+    if not agent_id:
+        return jsonify({"status": "error", "message": "agent_id is required"}), 400
+    wait = min(float(body.get('wait', 20)), 60)
+    job = farm.claim(agent_id, timeout=wait)
+    if job is None:
+        return "", 204
+    uid = job['job_id']
+    job.update({
+        'input_url': f"/agent/jobs/{uid}/input",
+        'progress_url': f"/agent/jobs/{uid}/progress",
+        'result_url': f"/agent/jobs/{uid}/result",
+        'fail_url': f"/agent/jobs/{uid}/fail",
+    })
+    return jsonify({"status": "success", "job": job}), 200
+
+
+@app.route('/agent/jobs/<unique_id>/input')
+@agent_auth
+def agent_input(unique_id):
+    """ジョブの入力（cloud_rendering.mlt と data/）を tar で送信"""
+    agent_id = request.headers.get('X-Agent-Id', '')
+    extract_dir = UPLOAD_FOLDER / unique_id
+    if not farm.heartbeat(unique_id, agent_id) or not extract_dir.is_dir():
+        return jsonify({"status": "error", "message": "Job is not assigned to this agent"}), 409
+    exclude = ("output.mp4", "output.mp4.*.part")
+    return Response(iter_leased_input(unique_id, agent_id, iter_tar_stream(extract_dir, exclude)),
+                    mimetype="application/x-tar")
+
+
+def iter_leased_input(unique_id, agent_id, chunks):
+    """入力の送信中もリースを更新する（大きな素材の転送中に別のエージェントへ再割り当てされないように）"""
+    last_heartbeat = time.time()
+    for chunk in chunks:
+        yield chunk
+        if time.time() - last_heartbeat >= 10:
+            if not farm.heartbeat(unique_id, agent_id):
+                # 再割り当て・キャンセル済み。正常終了に見えないよう接続ごと中断し、エージェント側で失敗させる
+                raise RuntimeError(f"Lease of {unique_id} lost by agent {agent_id}, input stream aborted")
+            last_heartbeat = time.time()
+
+
+@app.route('/agent/jobs/<unique_id>/progress', methods=['POST'])
+@agent_auth
+def agent_progress(unique_id):
+    """進捗報告。continue が false ならエージェントはレンダリングを中断する"""
+    body = request.get_json(silent=True) or {}
+    current = body.get('current')
+    keep_going = farm.heartbeat(unique_id, body.get('agent_id', ''),
+                                int(current) if current is not None else None)
+    return jsonify({"status": "success", "continue": keep_going}), 200
+
+
+@app.route('/agent/jobs/<unique_id>/result', methods=['PUT'])
+@agent_auth
+def agent_result(unique_id):
+    """レンダリング結果（output.mp4）を受信してジョブを完了"""
+    agent_id = request.headers.get('X-Agent-Id', '')
+    if not farm.heartbeat(unique_id, agent_id):
+        return jsonify({"status": "error", "message": "Job is not assigned to this agent"}), 409
+
+    output_file = UPLOAD_FOLDER / unique_id / "output.mp4"
+    # 再割り当て前後のエージェントが同時に送っても混ざらないよう、一時ファイルはエージェントごとに分ける
+    agent_key = hashlib.sha1(agent_id.encode("utf-8")).hexdigest()[:12]
+    part_file = output_file.with_name(f"output.mp4.{agent_key}.part")
+    try:
+        with part_file.open('wb') as f:
+            chunk_size = 10 * 1024 * 1024  # 10MBずつ
+            last_heartbeat = time.time()
+            while True:
+                chunk = request.stream.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                # 大きな出力の受信中にリースが切れないよう報告を継続（失っていたら受信を中止）
+                if time.time() - last_heartbeat >= 10:
+                    if not farm.heartbeat(unique_id, agent_id):
+                        part_file.unlink(missing_ok=True)
+                        return jsonify({"status": "error", "message": "Lease lost during result upload"}), 409
+                    last_heartbeat = time.time()
+    except Exception as e:
+        part_file.unlink(missing_ok=True)
+        farm.complete(unique_id, agent_id, False, f"Result upload failed: {e}")
+        return jsonify({"status": "error", "message": f"Error saving result: {str(e)}"}), 500
+
+    # リースの確認と output.mp4 への置き換えをコーディネーターのロック内でまとめて行う
+    try:
+        accepted = farm.complete(unique_id, agent_id, True,
+                                 finalize=lambda: os.replace(part_file, output_file))
+    except OSError as e:
+        part_file.unlink(missing_ok=True)
+        return jsonify({"status": "error", "message": f"Error saving result: {str(e)}"}), 500
+    if not accepted:
+        part_file.unlink(missing_ok=True)
+        return jsonify({"status": "error", "message": "Job is not assigned to this agent"}), 409
+    return jsonify({"status": "success"}), 200
+
+
+@app.route('/agent/jobs/<unique_id>/fail', methods=['POST'])
+@agent_auth
+def agent_fail(unique_id):
+    """エージェント側の失敗報告（試行回数が残っていれば別のエージェントに再割り当て）"""
+    body = request.get_json(silent=True) or {}
+    accepted = farm.complete(unique_id, body.get('agent_id', ''), False, body.get('error'))
+    return jsonify({"status": "success", "accepted": accepted}), 200
 
 
 if __name__ == "__main__":
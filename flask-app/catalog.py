@@ -0,0 +1,172 @@
+"""
+レンダリング済みファイルのカタログ / Indexed render catalog
+
+ジョブ完了時に SQLite へ記録し、/list はファイルシステムを走査せずに
+カーソル方式のページング・絞り込み・並び替えを行う。
+"""
+
+from pathlib import Path
+import base64
+import json
+import sqlite3
+import threading
+
+SORT_COLUMNS = {
+    "created": "created",
+    "size": "size",
+    "duration": "COALESCE(duration, 0)",
+    "last_download": "COALESCE(last_download, 0)",
+}
+MAX_PAGE_SIZE = 1000
+
+
+class CatalogQueryError(ValueError):
+    """/list のクエリパラメータが不正な場合の例外"""
+    pass
+
+
+def _encode_cursor(sort_value, uid):
+    raw = json.dumps([sort_value, uid]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    try:
+        sort_value, uid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return sort_value, uid
+    except Exception as e:
+        raise CatalogQueryError(f"Invalid cursor: {cursor}") from e
+
+
+class RenderCatalog:
+    """完了したレンダリングの一覧を保持するクラス"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS renders (
+                    id TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    duration REAL,
+                    profile TEXT,
+                    last_download REAL,
+                    job_key TEXT
+                )"""
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(renders)")}
+            if "job_key" not in columns:
+                self._conn.execute("ALTER TABLE renders ADD COLUMN job_key TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renders_created ON renders(created, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renders_size ON renders(size, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renders_profile ON renders(profile, created)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renders_job_key ON renders(job_key)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_renders_last_download ON renders(COALESCE(last_download, 0), id)"
+            )
+
+    def record(self, uid, size, created, duration=None, profile=None, job_key=None):
+        """ジョブ完了時に登録（同じIDは上書き）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO renders (id, size, created, duration, profile, job_key) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET size=excluded.size, created=excluded.created,
+                   duration=excluded.duration, profile=excluded.profile, job_key=excluded.job_key""",
+                (uid, size, created, duration, profile, job_key),
+            )
+
+    def find_by_key(self, job_key):
+        """同じジョブキーで完了済みのジョブIDを新しい順に返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM renders WHERE job_key = ? ORDER BY created DESC", (job_key,)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def touch_download(self, uid, when):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE renders SET last_download = ? WHERE id = ?", (when, uid))
+
+    def remove(self, uid):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM renders WHERE id = ?", (uid,))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+
+    def query(self, limit=100, cursor=None, sort="created", order="desc", profile=None,
+              created_after=None, created_before=None):
+        """
+        カーソル方式で一覧を取得
+
+        Returns:
+            (items, next_cursor)。次ページが無ければ next_cursor は None
+        """
+        if sort not in SORT_COLUMNS:
+            raise CatalogQueryError(f"Unknown sort key: {sort} (choose from {', '.join(SORT_COLUMNS)})")
+        if order not in ("asc", "desc"):
+            raise CatalogQueryError(f"Unknown order: {order}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        sort_expr = SORT_COLUMNS[sort]
+        where = []
+        params = []
+        if profile:
+            where.append("profile = ?")
+            params.append(profile)
+        if created_after is not None:
+            where.append("created >= ?")
+            params.append(float(created_after))
+        if created_before is not None:
+            where.append("created < ?")
+            params.append(float(created_before))
+        if cursor:
+            sort_value, last_id = _decode_cursor(cursor)
+            op = "<" if order == "desc" else ">"
+            where.append(f"({sort_expr}, id) {op} (?, ?)")
+            params.extend([sort_value, last_id])
+
+        sql = "SELECT id, size, created, duration, profile, last_download, " \
+              f"{sort_expr} AS sort_value FROM renders"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        direction = "DESC" if order == "desc" else "ASC"
+        sql += f" ORDER BY {sort_expr} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [
+            {key: row[key] for key in ("id", "size", "created", "duration", "profile", "last_download")}
+            for row in rows
+        ]
+        next_cursor = _encode_cursor(rows[-1]["sort_value"], rows[-1]["id"]) if has_more and rows else None
+        return items, next_cursor
+
+    def backfill(self, upload_root: Path, output_name="output.mp4"):
+        """カタログが空の場合のみ、既存の出力ファイルを一度だけ取り込む"""
+        if self.count() > 0:
+            return 0
+        added = 0
+        for item in upload_root.iterdir():
+            if item.name.startswith(".") or not item.is_dir():
+                continue
+            output_file = item / output_name
+            try:
+                st = output_file.stat()
+            except OSError:
+                continue
+            self.record(item.name, st.st_size, st.st_mtime)
+            added += 1
+        if added:
+            print(f"Catalog: imported {added} existing renders")
+        return added
@@ -0,0 +1,207 @@
+"""
+レンダリングのチェックポイント / Checkpointed renders that survive a server restart
+
+gunicorn の再起動（max_requests によるワーカーの入れ替え、デプロイ、クラッシュ）でワーカーが終了すると、
+レンダリング中のジョブは失われ、再投入しても0フレーム目からやり直しになっていた。
+
+キューに登録した時点でジョブのディレクトリに render_journal.json（ジャーナル）を書き、
+起動時に未完了のジャーナルを見つけたらジョブを再キューする（待機中のジョブも失われない）。
+
+セグメント単位のレンダリング（segments.py）では、各セグメントを segments/<番号>.mp4 として保存し、
+セグメントが1つ完了するたびに完了したフレーム範囲をジャーナルに追記する。
+再開したジョブは完了済みのセグメントを飛ばし、進捗（progress_dict）もそこから数える。
+1回の melt でレンダリングするジョブ（分割しない場合）は再キューされるが、0フレーム目からやり直しになる。
+
+ジャーナルに保存するもの:
+- 再キューに必要なジョブ情報（プロファイル・クライアントIP・キュー登録時刻・素材のハッシュなど）
+- セグメントの分割（開始・終了フレーム）。再開時に分割が変わっていたら（設定変更など）完了済みの記録は使わない
+- 完了したセグメント（番号・フレーム範囲・バイト数）。ファイルが無い・サイズが違うものは再レンダリング
+- レンダリング中の melt の PID（新しいセッションで起動するため、ワーカーが終了しても残ることがある。再開前に停止する）
+"""
+
+from pathlib import Path
+import json
+import os
+import signal
+import time
+
+from render_watchdog import KILL_GRACE_SECONDS, _pid_alive
+
+# 0 ならチェックポイントを使わない（再起動したジョブは失われる）
+CHECKPOINTS_ENABLED = os.getenv("RENDER_CHECKPOINTS", "1").lower() not in ("0", "false", "no", "off")
+JOURNAL_NAME = "render_journal.json"
+JOURNAL_FORMAT_VERSION = 1
+# 再開時に引き継ぐジョブ情報（job_meta のキー）
+RESUMABLE_META_KEYS = ("profile", "client_ip", "queued_at", "member_hashes", "upload_bytes", "retries",
+                       "preflight", "estimated_seconds", "extracted", "preview_requested",
+                       "progressive_requested", "original_filename")
+
+
+class RenderJournal:
+    """1ジョブ分のジャーナル（<ジョブのディレクトリ>/render_journal.json）"""
+
+    def __init__(self, job_dir: Path):
+        self.job_dir = Path(job_dir)
+        self.path = self.job_dir / JOURNAL_NAME
+        self.data = self._read() or {}
+
+    def _read(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Checkpoint: ignoring unreadable journal {self.path}: {e}")
+            return None
+        if data.get("format") != JOURNAL_FORMAT_VERSION:
+            return None
+        return data
+
+    def _write(self):
+        # 書き込み途中で終了しても前回の内容が残るよう、一時ファイルから置き換える
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    @property
+    def exists(self):
+        return bool(self.data)
+
+    @property
+    def job(self):
+        return self.data.get("job", {})
+
+    @property
+    def started(self):
+        """レンダリングを開始済みか（キュー登録時に書いただけのジャーナルは False）"""
+        return "plan" in self.data
+
+    @property
+    def total_frames(self):
+        """分割したレンダリングの総フレーム数（分割していなければ 0）"""
+        plan = self.data.get("plan") or [[0, 0]]
+        return plan[-1][1]
+
+    @property
+    def running_pid(self):
+        return self.data.get("running_pid")
+
+    def save_job(self, meta: dict):
+        """再キューに必要なジョブ情報を記録（キュー登録時・展開後）"""
+        self.data.update({
+            "format": JOURNAL_FORMAT_VERSION,
+            "uid": self.job_dir.name,
+            "job": {key: meta[key] for key in RESUMABLE_META_KEYS if key in meta},
+        })
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        self._write()
+
+    def begin(self, meta: dict, segments=None):
+        """
+        レンダリングの開始を記録。前回と同じ分割なら完了済みのセグメントを引き継ぐ
+        （segments が None なら1回の melt でのレンダリング。再開時は最初から）
+
+        Returns:
+            引き継いだ完了済みセグメントの数
+        """
+        plan = [[segment.start, segment.end] for segment in segments] if segments is not None else None
+        completed = self.data.get("completed", {}) if plan and self.data.get("plan") == plan else {}
+        self.data = {
+            "format": JOURNAL_FORMAT_VERSION,
+            "uid": self.job_dir.name,
+            "started_at": self.data.get("started_at", time.time()),
+            "job": {key: meta[key] for key in RESUMABLE_META_KEYS if key in meta},
+            "plan": plan,
+            "completed": completed,
+            "running_pid": None,
+        }
+        self._write()
+        return len(completed)
+
+    def is_completed(self, segment, segment_file: Path):
+        """セグメントが前回までに完了しているか（ファイルが残っていてサイズも一致するもの）"""
+        entry = self.data.get("completed", {}).get(str(segment.index))
+        if entry is None or [entry["start"], entry["end"]] != [segment.start, segment.end]:
+            return False
+        try:
+            return segment_file.stat().st_size == entry["bytes"]
+        except OSError:
+            return False
+
+    def completed_frames(self):
+        return sum(entry["end"] - entry["start"] for entry in self.data.get("completed", {}).values())
+
+    def record(self, segment, segment_file: Path):
+        """セグメントの完了を記録（セグメントのファイルを置いた後に呼ぶ）"""
+        self.data.setdefault("completed", {})[str(segment.index)] = {
+            "start": segment.start,
+            "end": segment.end,
+            "bytes": segment_file.stat().st_size,
+        }
+        self.data["running_pid"] = None
+        self._write()
+
+    def set_running(self, pid):
+        """レンダリング中の melt の PID（再起動後に残っていれば停止する）"""
+        self.data["running_pid"] = pid
+        self._write()
+
+    def discard(self):
+        """完了・失敗したジョブのジャーナルを削除（再起動しても再開しない）"""
+        self.data = {}
+        self.path.unlink(missing_ok=True)
+
+
+def find_journals(upload_root: Path):
+    """未完了のジャーナルを持つジョブ（キュー登録時刻の順）"""
+    journals = []
+    for journal_file in Path(upload_root).glob(f"*/{JOURNAL_NAME}"):
+        if journal_file.parent.name.startswith("."):
+            continue
+        journal = RenderJournal(journal_file.parent)
+        if journal.exists:
+            journals.append(journal)
+        else:
+            # 読めない・古い形式のジャーナルは再開できない
+            journal.discard()
+    journals.sort(key=lambda journal: journal.job.get("queued_at") or 0)
+    return journals
+
+
+def _cmdline(pid):
+    try:
+        return Path(f"/proc/{pid}/cmdline").read_bytes().replace(b"\0", b" ").decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+
+def stop_orphaned_melt(pid, marker: str, grace=KILL_GRACE_SECONDS):
+    """
+    前のワーカーが起動した melt が残っていれば、プロセスグループごと停止する
+
+    PID が再利用されている場合に別のプロセスを止めないよう、コマンドラインに marker（MLTファイルのパス）を
+    含むものだけを対象にする（/proc が無い環境では何もしない）。
+
+    Returns:
+        停止した場合 True
+    """
+    cmdline = _cmdline(pid)
+    if not cmdline or marker not in cmdline:
+        return False
+    print(f"Checkpoint: stopping orphaned melt (pid {pid})")
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return False
+    deadline = time.time() + grace
+    while time.time() < deadline and _pid_alive(pid) and _cmdline(pid):
+        # 終了済みでまだ回収されていない（ゾンビの）プロセスはコマンドラインが空になる
+        time.sleep(0.2)
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    return True
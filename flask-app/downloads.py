@@ -0,0 +1,245 @@
+"""
+レンダリング結果の配信 / Range-capable downloads
+
+- Range / If-Range に対応し、中断したダウンロードを再開できる
+- DOWNLOAD_OFFLOAD で前段プロキシ（nginx の X-Accel-Redirect / Apache の X-Sendfile）に配信を委譲
+- それ以外は gunicorn の wsgi.file_wrapper 経由で os.sendfile を使い、ワーカースレッドでのコピーを避ける
+- 断片化MP4でレンダリング中のファイルは、書き終わったボックスまでをチャンク転送で送り続ける
+  （1本ごとに gunicorn のスレッドを完了まで占有するため、同時に送る数は GROWING_DOWNLOAD_LIMIT まで）
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import quote
+import os
+import re
+import struct
+import threading
+import time
+
+from flask import Response, request
+
+# "" / "x-accel" / "x-sendfile"
+DOWNLOAD_OFFLOAD = os.getenv("DOWNLOAD_OFFLOAD", "").lower()
+# X-Accel-Redirect 用の internal location（nginx 側で UPLOAD_FOLDER に alias する）
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/protected-rendering/")
+
+BLOCK_SIZE = 1024 * 1024
+GROWING_POLL_SECONDS = 1.0
+# レンダリング中のファイルを同時に送る数の上限（残りのスレッドを /status などのために空けておく）
+GROWING_DOWNLOAD_LIMIT = max(1, int(os.getenv("GROWING_DOWNLOAD_LIMIT", "2")))
+_growing_slots = threading.BoundedSemaphore(GROWING_DOWNLOAD_LIMIT)
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def make_etag(stat_result) -> str:
+    return f'"{stat_result.st_size:x}-{int(stat_result.st_mtime):x}"'
+
+
+def parse_range(range_header, size):
+    """
+    単一の bytes Range を (start, end) に変換（end は含む）。
+    ヘッダーが無い・複数範囲の場合は None、満たせない範囲は ValueError。
+    """
+    if not range_header:
+        return None
+    m = _RANGE_PATTERN.match(range_header.strip())
+    if not m:
+        # 複数範囲や不明な単位は全体送信にフォールバック
+        return None
+    first, last = m.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # 末尾 N バイト
+        length = int(last)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(if_range, etag, mtime):
+    """If-Range が現在のファイルと一致する場合のみ部分送信を許可"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) >= int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def _iter_file_range(file_obj, length):
+    """gunicorn 以外（開発サーバ）向け：指定バイト数だけ読み出して返す"""
+    try:
+        remaining = length
+        while remaining > 0:
+            data = file_obj.read(min(BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file_obj.close()
+
+
+def _content_disposition(download_name):
+    return f"attachment; filename=\"{download_name}\"; filename*=UTF-8''{quote(download_name)}"
+
+
+def send_media_file(file_path: Path, download_name: str, upload_root: Path, mimetype="video/mp4"):
+    """
+    file_path を Range 対応で送信する
+
+    Args:
+        file_path: 送信するファイル
+        download_name: Content-Disposition に載せるファイル名
+        upload_root: X-Accel-Redirect 用に相対パスを求める基準ディレクトリ
+    """
+    stat_result = file_path.stat()
+    size = stat_result.st_size
+    etag = make_etag(stat_result)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Content-Disposition": _content_disposition(download_name),
+    }
+
+    # 前段プロキシへ委譲（Range 処理もプロキシ側で行われる）
+    if DOWNLOAD_OFFLOAD == "x-accel":
+        relative = file_path.resolve().relative_to(upload_root.resolve()).as_posix()
+        headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative)
+        return Response(b"", headers=headers, mimetype=mimetype)
+    if DOWNLOAD_OFFLOAD == "x-sendfile":
+        headers["X-Sendfile"] = str(file_path.resolve())
+        return Response(b"", headers=headers, mimetype=mimetype)
+
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers=headers)
+
+    status = 200
+    start, end = 0, size - 1
+    if _if_range_matches(request.headers.get("If-Range"), etag, stat_result.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size > 0 else 0
+    headers["Content-Length"] = str(length)
+
+    file_obj = open(file_path, "rb")
+    file_obj.seek(start)
+
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        # gunicorn は現在のファイル位置から Content-Length 分を os.sendfile で送る
+        body = file_wrapper(file_obj, BLOCK_SIZE)
+    else:
+        body = _iter_file_range(file_obj, length)
+
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+
+def complete_boxes_end(f, position, size):
+    """
+    position から始まるMP4トップレベルボックスのうち、size までに書き終わっているものの終端を返す
+    （断片化MP4では ftyp / moov / moof+mdat が1つずつ完成した状態で追記される）
+    """
+    while position + 8 <= size:
+        f.seek(position)
+        box_size, _ = struct.unpack(">I4s", f.read(8))
+        if box_size == 1:
+            if position + 16 > size:
+                break
+            box_size = struct.unpack(">Q", f.read(8))[0]
+        if box_size < 8 or position + box_size > size:
+            # size 0（ファイル末尾まで）や書き込み途中のボックス
+            break
+        position += box_size
+    return position
+
+
+class GrowingDownloadAborted(Exception):
+    """レンダリングが成功しなかったため、送信途中のダウンロードを中断する"""
+    pass
+
+
+def iter_growing_mp4(file_path: Path, is_finished, succeeded=None, poll_interval=GROWING_POLL_SECONDS):
+    """
+    レンダリング中の断片化MP4を、完成したボックスまで少しずつ返すジェネレーター
+
+    Args:
+        is_finished: レンダリングが終わったら True を返す関数（終了後は残りを全て送って終わる）
+        succeeded: 終了後に、レンダリングが成功したかを返す関数。失敗・再キューなら GrowingDownloadAborted を送出し、
+                   チャンク転送を終端させずに接続を切る（途中までのファイルを完全なダウンロードに見せない）
+    """
+    def check_succeeded():
+        if succeeded is not None and not succeeded():
+            raise GrowingDownloadAborted(f"Render of {file_path.parent.name} did not complete, download aborted")
+
+    while not file_path.exists():
+        if is_finished():
+            check_succeeded()
+            return
+        time.sleep(poll_interval)
+
+    sent = 0
+    scanned = 0
+    with open(file_path, "rb") as f:
+        while True:
+            finished = is_finished()
+            if finished:
+                check_succeeded()
+            size = os.fstat(f.fileno()).st_size
+            if finished:
+                end = size
+            else:
+                scanned = complete_boxes_end(f, scanned, size)
+                end = scanned
+            f.seek(sent)
+            while sent < end:
+                data = f.read(min(BLOCK_SIZE, end - sent))
+                if not data:
+                    break
+                sent += len(data)
+                yield data
+            if finished:
+                return
+            time.sleep(poll_interval)
+
+
+def send_growing_mp4(file_path: Path, download_name: str, is_finished, succeeded=None, mimetype="video/mp4"):
+    """
+    レンダリング中のファイルを Content-Length 無し（チャンク転送）で送信。Range は非対応
+
+    同時に送っている数が GROWING_DOWNLOAD_LIMIT に達していれば 503（Retry-After 付き）を返す
+    """
+    headers = {
+        "Accept-Ranges": "none",
+        "Cache-Control": "no-store",
+        "Content-Disposition": _content_disposition(download_name),
+        "X-Render-In-Progress": "1",
+    }
+    if request.method == "HEAD":
+        # gunicorn は HEAD でも本文を反復するため、レンダリング終了まで待たないよう空で返す
+        return Response(b"", headers=headers, mimetype=mimetype)
+    if not _growing_slots.acquire(blocking=False):
+        return Response("Too many downloads of renders in progress, retry later\n", status=503,
+                        headers={"Retry-After": "30"}, mimetype="text/plain")
+    response = Response(iter_growing_mp4(file_path, is_finished, succeeded), headers=headers, mimetype=mimetype)
+    response.call_on_close(_growing_slots.release)
+    return response
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+偽の melt / Fake melt for testing without real renders
+
+melt と同じ引数（<mlt> -progress -consumer avformat:<output> ...）を受け取り、
+MLTの総フレーム数ぶん -progress 形式の進捗を出力してから、ダミーの出力ファイルを書き込む。
+
+環境変数:
+    FAKE_MELT_FPS          進捗を進める速さ（フレーム/秒、既定 250）
+    FAKE_MELT_FRAMES       総フレーム数（省略時は MLT から取得）
+    FAKE_MELT_EXIT_CODE    終了コード（既定 0。0以外なら出力ファイルを書かない）
+    FAKE_MELT_FAIL_AT      FAKE_MELT_EXIT_CODE が0以外のとき、この進捗（%）で止めて終了する（既定 100）
+    FAKE_MELT_STARTUP_SECONDS 最初の進捗を出すまでの待ち時間（melt の起動時間の再現、既定 0）
+    FAKE_MELT_OUTPUT_BYTES ダミー出力のサイズ（既定 1MB）
+
+in=<フレーム> out=<フレーム> を指定した場合はその範囲だけを、本物の melt と同じくタイムライン上の位置で報告する。
+"""
+
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+
+def _timecode_seconds(tc):
+    try:
+        hh, mm, ss = tc.split(":")
+        return int(hh) * 3600 + int(mm) * 60 + float(ss)
+    except ValueError:
+        return 0.0
+
+
+def total_frames(mlt_file):
+    """tractor@out のタイムコード × profile の fps（取得できなければ 250）"""
+    try:
+        root = ET.parse(mlt_file).getroot()
+        profile = root.find("profile")
+        fps = int(profile.get("frame_rate_num")) / int(profile.get("frame_rate_den", "1"))
+        seconds = _timecode_seconds(root.find("tractor").get("out", ""))
+        if seconds > 0:
+            return max(1, int(round(seconds * fps)))
+    except Exception:
+        pass
+    return 250
+
+
+def main(argv):
+    mlt_file = argv[0] if argv and not argv[0].startswith("-") else None
+    output_file = None
+    if "-consumer" in argv:
+        consumer = argv[argv.index("-consumer") + 1]
+        output_file = consumer.split(":", 1)[1] if ":" in consumer else None
+
+    frames = int(os.getenv("FAKE_MELT_FRAMES", "0")) or (total_frames(mlt_file) if mlt_file else 250)
+    # melt <mlt> in=N out=M（セグメント単位のレンダリング）
+    options = dict(arg.split("=", 1) for arg in argv[1:] if "=" in arg and not arg.startswith("-"))
+    first = int(options.get("in", 0))
+    if "out" in options:
+        frames = int(options["out"]) - first + 1
+    fps = float(os.getenv("FAKE_MELT_FPS", "250"))
+    exit_code = int(os.getenv("FAKE_MELT_EXIT_CODE", "0"))
+    last_frame = frames
+    if exit_code != 0:
+        last_frame = int(frames * min(100.0, float(os.getenv("FAKE_MELT_FAIL_AT", "100"))) / 100)
+    time.sleep(float(os.getenv("FAKE_MELT_STARTUP_SECONDS", "0")))
+
+    # 本物の melt と同様、進捗は stderr に \r 区切りで上書き出力
+    started = time.time()
+    step = max(1, int(fps // 25))
+    for frame in list(range(0, last_frame, step)) + [last_frame]:
+        delay = started + frame / fps - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        percentage = int(frame * 100 / frames)
+        sys.stderr.write(f"Current Frame: {first + frame:>10}, percentage: {percentage:>10}\r")
+        sys.stderr.flush()
+    sys.stderr.write("\n")
+
+    if exit_code == 0 and output_file:
+        size = int(os.getenv("FAKE_MELT_OUTPUT_BYTES", str(1024 * 1024)))
+        with open(output_file, "wb") as f:
+            f.write(b"\0" * size)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,219 @@
+"""
+分散レンダリング（コーディネーター側） / Render farm coordinator
+
+RENDER_MODE=coordinator のとき、サーバー自身は melt を実行せず、
+レンダリングエージェント（python -m render_agent）がジョブを取りに来る（プル型）。
+
+- ディスパッチスレッドが process_file 内で submit() を呼び、エージェントの完了を待つ
+- エージェントは claim() をロングポーリングし、入力（tar）を取得して melt を実行
+- 進捗は heartbeat() で報告。一定時間報告が無いジョブは別のエージェントに再割り当て
+"""
+
+from fnmatch import fnmatch
+from pathlib import Path
+import os
+import tarfile
+import threading
+import time
+
+# エージェントからの報告がこの秒数途絶えたら、ジョブを再割り当て
+LEASE_SECONDS = float(os.getenv("FARM_LEASE_SECONDS", "120"))
+# 1ジョブあたりの最大試行回数（エージェントの失敗・報告途絶を含む）
+MAX_ATTEMPTS = int(os.getenv("FARM_MAX_ATTEMPTS", "3"))
+
+TAR_BLOCK = 512
+READ_SIZE = 4 * 1024 * 1024
+
+
+def iter_tar_stream(directory: Path, exclude_names=()):
+    """
+    ディレクトリを非圧縮 tar としてストリーム送信するジェネレーター
+    （巨大な素材もメモリに載せず、ファイルを少しずつ読みながら返す）
+
+    exclude_names にはファイル名のパターン（"output.mp4.*.part" など）も指定できる
+    """
+    for path in sorted(directory.rglob("*")):
+        if any(fnmatch(path.name, pattern) for pattern in exclude_names):
+            continue
+        if not path.is_file() or path.is_symlink():
+            continue
+        st = path.stat()
+        info = tarfile.TarInfo(path.relative_to(directory).as_posix())
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        with path.open("rb") as f:
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        padding = -st.st_size % TAR_BLOCK
+        if padding:
+            yield b"\0" * padding
+    yield b"\0" * (TAR_BLOCK * 2)
+
+
+class _FarmJob:
+    def __init__(self, uid, spec):
+        self.uid = uid
+        self.spec = spec
+        self.attempts = 0
+        self.agent_id = None
+        self.last_seen = None
+        self.done = threading.Event()
+        self.ok = False
+        self.error = None
+
+
+class FarmCoordinator:
+    """エージェントへのジョブ割り当てとリース（担当エージェント・最終報告時刻）を管理するクラス"""
+
+    def __init__(self, lease_seconds=None, max_attempts=None, on_progress=None):
+        """
+        Args:
+            on_progress: (uid, current_frame) を受け取る関数（progress_dict・テレメトリの更新）
+        """
+        self.lease_seconds = lease_seconds if lease_seconds is not None else LEASE_SECONDS
+        self.max_attempts = max_attempts if max_attempts is not None else MAX_ATTEMPTS
+        self.on_progress = on_progress or (lambda uid, current: None)
+        self._cond = threading.Condition()
+        self._pending = []   # 割り当て待ちの uid（投入順）
+        self._jobs = {}      # uid -> _FarmJob
+        self._agents = {}    # agent_id -> { 'last_seen': ..., 'job': uid or None, 'completed': n }
+
+    # ----------------------- ディスパッチ側 -----------------------
+    def submit(self, uid, spec):
+        """
+        ジョブをエージェントに渡し、完了するまで待つ
+
+        Args:
+            spec: エージェントに返すジョブ情報（profile・total_frames・source_size など）
+
+        Returns:
+            (成功したか, エラーメッセージ)
+        """
+        job = _FarmJob(uid, spec)
+        with self._cond:
+            self._jobs[uid] = job
+            self._pending.append(uid)
+            self._cond.notify_all()
+        while not job.done.wait(min(self.lease_seconds, 10)):
+            self._expire_leases()
+        with self._cond:
+            self._jobs.pop(uid, None)
+        return job.ok, job.error
+
+    # ----------------------- エージェント側 -----------------------
+    def claim(self, agent_id, timeout=20.0):
+        """割り当て待ちのジョブを1件取得（無ければ timeout 秒まで待機）。無ければ None"""
+        self._expire_leases()
+        deadline = time.time() + timeout
+        with self._cond:
+            self._touch_agent(agent_id)
+            while not self._pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            uid = self._pending.pop(0)
+            job = self._jobs[uid]
+            job.attempts += 1
+            job.agent_id = agent_id
+            job.last_seen = time.time()
+            self._agents[agent_id]['job'] = uid
+            print(f"Farm: {uid} assigned to agent {agent_id} (attempt {job.attempts})")
+            return dict(job.spec, job_id=uid, attempt=job.attempts)
+
+    def heartbeat(self, uid, agent_id, current_frame=None):
+        """進捗報告。このエージェントがリースを持っていなければ False（エージェントは中断する）"""
+        with self._cond:
+            self._touch_agent(agent_id)
+            job = self._jobs.get(uid)
+            if job is None or job.agent_id != agent_id or job.done.is_set():
+                return False
+            job.last_seen = time.time()
+        if current_frame is not None:
+            self.on_progress(uid, current_frame)
+        return True
+
+    def complete(self, uid, agent_id, ok, error=None, finalize=None):
+        """
+        エージェントからの終了報告。失敗時は試行回数が残っていれば再割り当て
+
+        Args:
+            finalize: 成功時、リースを確認した後にロック内で呼ぶ関数（受信した結果を output.mp4 に置くなど）。
+                      リースを失ったエージェントの結果が、再割り当て先の結果を上書きしないようにする。
+                      例外が出た場合はジョブを失敗扱い（再割り当て）にしてから例外を送出する
+
+        Returns:
+            報告を受け付けたか（リースを失ったエージェントからの報告は無視）
+        """
+        with self._cond:
+            self._touch_agent(agent_id)
+            self._agents[agent_id]['job'] = None
+            job = self._jobs.get(uid)
+            if job is None or job.agent_id != agent_id or job.done.is_set():
+                return False
+            job.agent_id = None
+            if ok and finalize is not None:
+                try:
+                    finalize()
+                except Exception as e:
+                    print(f"Farm: {uid} result from agent {agent_id} could not be saved: {e}")
+                    self._retry_or_fail(job, f"Result upload failed: {e}")
+                    raise
+            if ok:
+                self._agents[agent_id]['completed'] += 1
+                self._finish(job, True)
+            else:
+                print(f"Farm: {uid} failed on agent {agent_id}: {error}")
+                self._retry_or_fail(job, error)
+            return True
+
+    # ----------------------- 内部処理 -----------------------
+    def _touch_agent(self, agent_id):
+        agent = self._agents.setdefault(agent_id, {'last_seen': None, 'job': None, 'completed': 0})
+        agent['last_seen'] = time.time()
+
+    def _finish(self, job, ok, error=None):
+        job.ok = ok
+        job.error = error
+        job.done.set()
+
+    def _retry_or_fail(self, job, error):
+        if job.attempts >= self.max_attempts:
+            self._finish(job, False, error)
+        else:
+            self._pending.insert(0, job.uid)
+            self._cond.notify_all()
+
+    def _expire_leases(self):
+        """報告が途絶えたエージェントのジョブを割り当て待ちに戻す"""
+        now = time.time()
+        with self._cond:
+            for job in self._jobs.values():
+                if job.agent_id is None or job.done.is_set():
+                    continue
+                if now - job.last_seen > self.lease_seconds:
+                    print(f"Farm: lease expired for {job.uid} on agent {job.agent_id}")
+                    agent = self._agents.get(job.agent_id)
+                    if agent is not None and agent['job'] == job.uid:
+                        agent['job'] = None
+                    job.agent_id = None
+                    self._retry_or_fail(job, "Agent stopped reporting progress")
+
+    def get_stats(self):
+        """/status 用：エージェントごとの状態と割り当て待ちの件数"""
+        now = time.time()
+        with self._cond:
+            agents = {
+                agent_id: {
+                    "job": info['job'],
+                    "completed": info['completed'],
+                    "last_seen_seconds_ago": round(now - info['last_seen'], 1),
+                }
+                for agent_id, info in self._agents.items()
+            }
+            return {"pending": len(self._pending), "agents": agents}
@@ -1,9 +1,12 @@
 # Gunicorn設定ファイル
 
+import os
+
 # サーバー設定
 bind = "0.0.0.0:5000"
 workers = 1
-threads = 4
+# RENDER_MODE=coordinator ではエージェントのロングポーリングがスレッドを使うため、エージェント数に応じて増やす
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
 worker_class = "gthread"
 
 # メモリ管理
@@ -19,6 +22,9 @@ max_requests = 10000  # 無制限（0で無効化）
 timeout = 300
 keepalive = 2
 
+# ダウンロードは os.sendfile で送信（/download の Range 配信で使用）
+sendfile = True
+
 # ワーカープロセス設定
 preload_app = False
 reload = False
@@ -0,0 +1,275 @@
+"""
+アップロードされたアーカイブの展開 / Archive ingestion
+
+- extract_zip: 保存済みZIPの展開（従来経路）
+- ingest_stream: リクエストボディを受信しながら tar / zip を逐次展開（ストリーム経路）
+  ZIPはローカルファイルヘッダを先頭から順に読むため、セントラルディレクトリを待たずに展開できる。
+
+どちらの経路も書き込みと同時に各ファイルの SHA-256 を計算し、{アーカイブ内パス: ハッシュ} を返す
+（レンダリング結果キャッシュのキーに使用）。
+"""
+
+from pathlib import Path
+import hashlib
+import struct
+import tarfile
+import zipfile
+import zlib
+
+CHUNK_SIZE = 4 * 1024 * 1024  # 4MBずつ
+
+
+class IngestError(Exception):
+    """アーカイブの展開に失敗した場合の例外"""
+    pass
+
+
+def safe_member_path(extract_dir: Path, name: str) -> Path:
+    """アーカイブ内のパスを展開先配下に解決（../ や絶対パスによる脱出を拒否）"""
+    name = name.replace("\\", "/").lstrip("/")
+    target = (extract_dir / name).resolve()
+    root = extract_dir.resolve()
+    if target != root and root not in target.parents:
+        raise IngestError(f"Unsafe path in archive: {name}")
+    return target
+
+
+def _member_name(name: str) -> str:
+    return name.replace("\\", "/").lstrip("/")
+
+
+def extract_zip(zip_path: Path, extract_dir: Path):
+    """保存済みZIPを展開し、各ファイルのハッシュを返す"""
+    hashes = {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            target = safe_member_path(extract_dir, info.filename)
+            if info.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            with zip_ref.open(info) as src, target.open("wb") as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+            hashes[_member_name(info.filename)] = digest.hexdigest()
+    return hashes
+
+
+class _CountingReader:
+    """受信バイト数を数えながらストリームを読み、必要に応じて書き戻しできるラッパー"""
+
+    def __init__(self, stream, on_bytes=None):
+        self.stream = stream
+        self.on_bytes = on_bytes
+        self.bytes_read = 0
+        self._pending = b""
+
+    def read(self, size=-1):
+        if self._pending:
+            if size is None or size < 0:
+                data, self._pending = self._pending + self._read_raw(-1), b""
+            else:
+                data, self._pending = self._pending[:size], self._pending[size:]
+            return data
+        return self._read_raw(size)
+
+    def _read_raw(self, size):
+        data = self.stream.read(size if size is not None and size >= 0 else CHUNK_SIZE)
+        if data:
+            self.bytes_read += len(data)
+            if self.on_bytes:
+                self.on_bytes(len(data))
+        return data
+
+    def unread(self, data):
+        self._pending = data + self._pending
+
+    def read_exact(self, size):
+        parts = []
+        remaining = size
+        while remaining > 0:
+            data = self.read(min(remaining, CHUNK_SIZE))
+            if not data:
+                raise IngestError("Unexpected end of upload stream")
+            parts.append(data)
+            remaining -= len(data)
+        return b"".join(parts)
+
+    def drain(self):
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _ingest_tar(reader: _CountingReader, extract_dir: Path) -> dict:
+    hashes = {}
+    with tarfile.open(fileobj=reader, mode="r|*") as tar:
+        for member in tar:
+            target = safe_member_path(extract_dir, member.name)
+            if member.isdir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            if not member.isfile():
+                # シンボリックリンクやデバイスファイルは展開しない
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            src = tar.extractfile(member)
+            digest = hashlib.sha256()
+            with target.open("wb") as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+            hashes[_member_name(member.name)] = digest.hexdigest()
+    return hashes
+
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_LOCAL_HEADER_SIG = 0x04034b50
+_DATA_DESCRIPTOR_SIG = 0x08074b50
+_CENTRAL_DIR_SIGS = (0x02014b50, 0x06054b50, 0x06064b50)
+
+
+def _parse_zip64_extra(extra: bytes, size: int, compressed_size: int):
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from("<HH", extra, offset)
+        data = extra[offset + 4: offset + 4 + data_size]
+        if header_id == 0x0001:
+            values = [v[0] for v in struct.iter_unpack("<Q", data[: len(data) // 8 * 8])]
+            if size == 0xFFFFFFFF and values:
+                size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF and values:
+                compressed_size = values.pop(0)
+            return size, compressed_size, True
+        offset += 4 + data_size
+    return size, compressed_size, False
+
+
+def _read_data_descriptor(reader: _CountingReader, is_zip64: bool) -> int:
+    """データ部の後ろのデータディスクリプタを読み、CRC-32 を返す（シグネチャは省略されることがある）"""
+    first = reader.read_exact(4)
+    if struct.unpack("<I", first)[0] == _DATA_DESCRIPTOR_SIG:
+        first = reader.read_exact(4)
+    reader.read_exact(16 if is_zip64 else 8)
+    return struct.unpack("<I", first)[0]
+
+
+def _ingest_zip(reader: _CountingReader, extract_dir: Path) -> dict:
+    hashes = {}
+    while True:
+        signature_bytes = reader.read_exact(4)
+        signature = struct.unpack("<I", signature_bytes)[0]
+        if signature in _CENTRAL_DIR_SIGS:
+            # ローカルエントリは全て処理済み。残り（セントラルディレクトリ）は読み捨て
+            reader.drain()
+            return hashes
+        if signature != _LOCAL_HEADER_SIG:
+            raise IngestError(f"Invalid zip local header signature: {signature:#x}")
+
+        header = _LOCAL_HEADER.unpack(signature_bytes + reader.read_exact(_LOCAL_HEADER.size - 4))
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_len, extra_len) = header
+        name_bytes = reader.read_exact(name_len)
+        extra = reader.read_exact(extra_len)
+        name = name_bytes.decode("utf-8" if flags & 0x800 else "cp437")
+        size, compressed_size, is_zip64 = _parse_zip64_extra(extra, size, compressed_size)
+        has_descriptor = bool(flags & 0x08)
+
+        if flags & 0x01:
+            raise IngestError(f"Encrypted zip members are not supported: {name}")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise IngestError(f"Unsupported zip compression method {method}: {name}")
+
+        target = safe_member_path(extract_dir, name)
+        if name.endswith("/"):
+            target.mkdir(parents=True, exist_ok=True)
+            if not has_descriptor:
+                # ディレクトリエントリにもデータ部がある場合に備えて読み捨て
+                if compressed_size:
+                    reader.read_exact(compressed_size)
+            elif method == zipfile.ZIP_STORED:
+                # ストリーミングで書かれたZIPはディレクトリエントリにもデータディスクリプタが付く（データ部は空）
+                _read_data_descriptor(reader, is_zip64)
+            else:
+                raise IngestError(f"Compressed zip directory entries with data descriptors cannot be streamed: {name}")
+            continue
+        if has_descriptor and method == zipfile.ZIP_STORED:
+            raise IngestError(f"Stored zip members with data descriptors cannot be streamed: {name}")
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        actual_crc = 0
+        digest = hashlib.sha256()
+        with target.open("wb") as dst:
+            if method == zipfile.ZIP_STORED:
+                remaining = compressed_size
+                while remaining > 0:
+                    chunk = reader.read(min(remaining, CHUNK_SIZE))
+                    if not chunk:
+                        raise IngestError("Unexpected end of upload stream")
+                    remaining -= len(chunk)
+                    actual_crc = zlib.crc32(chunk, actual_crc)
+                    digest.update(chunk)
+                    dst.write(chunk)
+            else:
+                decompressor = zlib.decompressobj(-15)
+                remaining = None if has_descriptor else compressed_size
+                while not decompressor.eof:
+                    want = CHUNK_SIZE if remaining is None else min(remaining, CHUNK_SIZE)
+                    if want == 0:
+                        break
+                    chunk = reader.read(want)
+                    if not chunk:
+                        raise IngestError("Unexpected end of upload stream")
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    data = decompressor.decompress(chunk)
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    digest.update(data)
+                    dst.write(data)
+                tail = decompressor.flush()
+                actual_crc = zlib.crc32(tail, actual_crc)
+                digest.update(tail)
+                dst.write(tail)
+                if decompressor.unused_data:
+                    reader.unread(decompressor.unused_data)
+
+        if has_descriptor:
+            crc = _read_data_descriptor(reader, is_zip64)
+
+        if crc != actual_crc:
+            raise IngestError(f"CRC mismatch for zip member: {name}")
+        hashes[_member_name(name)] = digest.hexdigest()
+
+
+def ingest_stream(stream, extract_dir: Path, archive_format: str = "zip", on_bytes=None):
+    """
+    リクエストボディを受信しながらアーカイブを展開する
+
+    Args:
+        stream: read(size) を持つ入力ストリーム（request.stream）
+        extract_dir: 展開先ディレクトリ
+        archive_format: "zip" または "tar"（tar.gz 等の圧縮tarも可）
+        on_bytes: 受信バイト数を通知するコールバック
+
+    Returns:
+        (受信バイト数, {アーカイブ内パス: SHA-256})
+    """
+    extract_dir.mkdir(parents=True, exist_ok=True)
+    reader = _CountingReader(stream, on_bytes)
+    try:
+        if archive_format == "tar":
+            hashes = _ingest_tar(reader, extract_dir)
+            reader.drain()
+        elif archive_format == "zip":
+            hashes = _ingest_zip(reader, extract_dir)
+        else:
+            raise IngestError(f"Unsupported archive format: {archive_format}")
+    except (tarfile.TarError, zlib.error, struct.error, UnicodeDecodeError) as e:
+        raise IngestError(str(e)) from e
+    return reader.bytes_read, hashes
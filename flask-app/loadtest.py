@@ -0,0 +1,460 @@
+"""
+負荷試験 / Load test for the render server
+
+scenario=status（既定）:
+遅いアップロードを多数同時に流しながら /status/<id> の応答時間を計測し、
+アップロードが無いときと比べて悪化しないことを確認する（標準ライブラリのみ使用）。
+
+    # 専用アップロード受信サーバー（UPLOAD_RECEIVER_PORT）経由
+    python loadtest.py --server http://127.0.0.1:5000 --upload-url http://127.0.0.1:5001/upload
+    # 比較用：gunicorn の /upload 経由（スレッドが埋まり /status が遅くなる）
+    python loadtest.py --server http://127.0.0.1:5000 --upload-url http://127.0.0.1:5000/upload
+
+scenario=queue:
+N 人のアップロード（クライアントごとに別の X-Forwarded-For）と M 個の /status ポーリングを同時に流し、
+/status の p50/p99、/upload のスループット、クライアント間の待ち時間の公平性を報告する。
+--spawn を付けると偽の melt（fake_melt.py）を使うサーバーをこのマシンで起動する（オフラインで完結）。
+
+    python loadtest.py --scenario queue --spawn --uploaders 4 --jobs-per-uploader 5 --pollers 8
+"""
+
+from pathlib import Path
+from urllib.parse import urlsplit
+import argparse
+import io
+import itertools
+import json
+import os
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+
+FPS = 25
+SAMPLE_MLT_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<mlt LC_NUMERIC="C" version="7.0.0" root="/tmp" producer="main_bin">
+  <profile description="HD 1080p 25 fps" width="1920" height="1080" progressive="1"
+           sample_aspect_num="1" sample_aspect_den="1" display_aspect_num="16" display_aspect_den="9"
+           frame_rate_num="25" frame_rate_den="1" colorspace="709"/>
+  <producer id="black" in="00:00:00.000" out="{out}">
+    <property name="length">{frames}</property>
+    <property name="resource">0</property>
+    <property name="mlt_service">color</property>
+  </producer>
+  <playlist id="playlist0">
+    <entry producer="black" in="00:00:00.000" out="{out}"/>
+  </playlist>
+  <tractor id="tractor0" in="00:00:00.000" out="{out}">
+    <track producer="playlist0"/>
+  </tractor>
+</mlt>
+"""
+
+
+def sample_mlt(seconds=5.0):
+    """seconds 秒の黒画面だけのプロジェクト"""
+    frames = max(1, int(round(seconds * FPS)))
+    last = (frames - 1) / FPS
+    out = f"{int(last // 3600):02}:{int(last % 3600 // 60):02}:{last % 60:06.3f}"
+    return SAMPLE_MLT_TEMPLATE.format(out=out, frames=frames)
+
+
+SAMPLE_MLT = sample_mlt()
+
+
+def build_archive(size_bytes, seed=b"", mlt=SAMPLE_MLT):
+    """cloud_rendering.mlt とパディング用の data/ ファイルを含む、指定サイズ程度のZIP（無圧縮）"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("cloud_rendering.mlt", mlt)
+        zf.writestr("data/padding.bin", seed + b"\0" * max(0, size_bytes - len(seed)))
+    return buffer.getvalue()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """応答時間（秒）のリストをミリ秒の要約にする"""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+    }
+
+
+def upload(url, body, headers=None, rate_bytes_per_sec=None, stop=None, timeout=600):
+    """
+    ソケットで直接アップロード（rate_bytes_per_sec 指定時は少しずつ送信して遅い回線を再現）
+
+    Returns:
+        (HTTPステータス, JSON本文 or None, 所要秒数)
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    head = [f"POST {parts.path or '/'} HTTP/1.1", f"Host: {host}:{port}",
+            "Content-Type: application/octet-stream", f"Content-Length: {len(body)}",
+            "Connection: close"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    started = time.time()
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        view = memoryview(body)
+        chunk = 64 * 1024
+        sent = 0
+        while sent < len(body):
+            if stop is not None and stop.is_set():
+                return None, None, time.time() - started
+            sock.sendall(view[sent:sent + chunk])
+            sent += min(chunk, len(body) - sent)
+            if rate_bytes_per_sec:
+                delay = started + sent / rate_bytes_per_sec - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        response = b""
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+    elapsed = time.time() - started
+    status_line, _, rest = response.partition(b"\r\n")
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        return None, None, elapsed
+    payload = rest.partition(b"\r\n\r\n")[2]
+    try:
+        return status, json.loads(payload), elapsed
+    except ValueError:
+        return status, None, elapsed
+
+
+def poll_status(server, unique_id, duration, interval, timeout=30):
+    """duration 秒間 /status/<id> を取得し続け、応答時間（秒）とエラー数を返す"""
+    latencies = []
+    errors = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        started = time.time()
+        try:
+            with urllib.request.urlopen(f"{server}/status/{unique_id}", timeout=timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            e.read()  # 404（unknown）も応答としては計測対象
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.time() - started)
+        time.sleep(max(0.0, interval - (time.time() - started)))
+    return latencies, errors
+
+
+def run_status_scenario(args):
+    """遅いアップロードの最中に /status の応答時間が悪化しないかを確認"""
+    # 計測対象のジョブを1件作る（小さなアップロード）
+    status, body, _ = upload(args.upload_url, build_archive(1024), {"X-Render-Profile": "draft"})
+    unique_id = (body or {}).get("unique_id") or "loadtest-unknown"
+    print(f"Status target: {unique_id} (upload status {status})")
+
+    print(f"Baseline: polling /status for {args.duration:.0f}s")
+    baseline, baseline_errors = poll_status(args.server, unique_id, args.duration, args.interval)
+
+    archive = build_archive(int(args.upload_mb * 1024 * 1024))
+    stop = threading.Event()
+    results = []
+
+    def uploader(index):
+        try:
+            results.append(upload(args.upload_url, archive, {"X-Filename": f"load{index}.zip"},
+                                  args.rate_kbps * 1024, stop))
+        except OSError as e:
+            results.append((None, {"error": str(e)}, 0))
+
+    threads = [threading.Thread(target=uploader, args=(i,), daemon=True) for i in range(args.uploads)]
+    for t in threads:
+        t.start()
+    time.sleep(1.0)  # 全アップロードが送信中になるまで待つ
+    print(f"Loaded: {args.uploads} uploads in flight, polling /status for {args.duration:.0f}s")
+    loaded, loaded_errors = poll_status(args.server, unique_id, args.duration, args.interval)
+    in_flight = sum(1 for t in threads if t.is_alive())
+    stop.set()
+    for t in threads:
+        t.join(timeout=30)
+
+    report = {
+        "upload_url": args.upload_url,
+        "uploads": args.uploads,
+        "uploads_in_flight_at_end": in_flight,
+        "baseline": dict(summarize(baseline), errors=baseline_errors),
+        "loaded": dict(summarize(loaded), errors=loaded_errors),
+    }
+    print(json.dumps(report, indent=2))
+
+    base_p99 = percentile(baseline, 99) or 0
+    load_p99 = percentile(loaded, 99)
+    flat = load_p99 is not None and loaded_errors == 0 and load_p99 <= base_p99 * args.max_ratio + 0.05
+    print("RESULT: status latency stayed flat" if flat else "RESULT: status latency degraded under upload load")
+    return 0 if flat else 1
+
+
+def jain_index(values):
+    """Jain の公平性指数（1.0 = 完全に公平、1/n = 1人が独占）"""
+    values = [v for v in values if v is not None]
+    if not values or not any(values):
+        return None
+    return round(sum(values) ** 2 / (len(values) * sum(v * v for v in values)), 3)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(work_dir: Path, fps, slots, startup_seconds=0.0, exit_code=0):
+    """
+    偽の melt を使うサーバーをこのマシンで起動する（gunicorn があれば gunicorn、無ければ Flask の開発サーバー）
+
+    Returns:
+        (プロセス, ベースURL)
+    """
+    app_dir = Path(__file__).resolve().parent
+    port = _free_port()
+    env = dict(
+        os.environ,
+        RENDER_UPLOAD_FOLDER=str(work_dir / "rendering"),
+        RENDER_SLOTS=str(slots),
+        MELT_PATH=f"{shlex.quote(sys.executable)} {shlex.quote(str(app_dir / 'fake_melt.py'))}",
+        MELT_XVFB="0",
+        UPLOAD_RECEIVER_PORT="0",
+        FAKE_MELT_FPS=str(fps),
+        FAKE_MELT_STARTUP_SECONDS=str(startup_seconds),
+        FAKE_MELT_EXIT_CODE=str(exit_code),
+        FAKE_MELT_OUTPUT_BYTES="65536",
+    )
+    if shutil.which("gunicorn"):
+        cmd = ["gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        cmd = [sys.executable, "-c",
+               f"import app; app.start_worker(); app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(work_dir / "server.log", "wb")
+    proc = subprocess.Popen(cmd, cwd=app_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    server = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}; see {work_dir / 'server.log'}")
+        try:
+            urllib.request.urlopen(f"{server}/status/loadtest-ready", timeout=1).read()
+        except urllib.error.HTTPError:
+            return proc, server  # 404 でも応答すれば起動済み
+        except OSError:
+            time.sleep(0.2)
+            continue
+        return proc, server
+    proc.kill()
+    raise RuntimeError("Server did not start within 30s")
+
+
+def run_queue_scenario(args):
+    """
+    N 人のアップロードと M 個のポーリングを同時に流し、/status の応答時間・アップロードのスループット・
+    クライアント間の公平性を計測する
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix="loadtest-"))
+    proc = None
+    if args.spawn:
+        proc, server = spawn_server(work_dir, args.melt_fps, args.slots, args.melt_startup)
+        upload_url = f"{server}/upload"
+        print(f"Spawned server at {server} (fake melt at {args.melt_fps:g} fps, {args.slots} slot(s))")
+    else:
+        server, upload_url = args.server, args.upload_url or f"{args.server}/upload"
+
+    lock = threading.Lock()
+    jobs = {}          # uid -> 記録
+    uploads = []       # (HTTPステータス, 秒数, バイト数)
+    status_latencies = []
+    status_errors = [0]
+    uploads_done = threading.Event()
+    total_jobs = args.uploaders * args.jobs_per_uploader
+
+    def uploader(index):
+        # クライアントごとに別の IP として扱わせる（スケジューラの公平性はクライアントIP単位）
+        client = f"10.0.0.{index + 1}"
+        heavy = index < args.heavy_uploaders
+        seconds = args.job_seconds * (args.heavy_multiplier if heavy else 1)
+        for number in range(args.jobs_per_uploader):
+            body = build_archive(int(args.upload_kb * 1024), f"{index}-{number}-{time.time()}".encode(),
+                                 sample_mlt(seconds))
+            try:
+                status, payload, elapsed = upload(upload_url, body, {
+                    "X-Forwarded-For": client, "X-Render-Profile": "draft",
+                    "X-Filename": f"client{index}-{number}.zip"})
+            except OSError:
+                status, payload, elapsed = None, None, 0.0
+            with lock:
+                uploads.append((status, elapsed, len(body)))
+                uid = (payload or {}).get("unique_id")
+                if status == 200 and uid:
+                    jobs[uid] = {"client": index, "heavy": heavy, "submitted": time.time(),
+                                 "started": None, "finished": None}
+
+    def poller(offset):
+        for turn in itertools.count(offset):
+            if time.time() > deadline:
+                return
+            with lock:
+                pending = [uid for uid, job in jobs.items() if job["finished"] is None]
+            if not pending:
+                if uploads_done.is_set():
+                    return
+                time.sleep(0.05)
+                continue
+            uid = pending[turn % len(pending)]
+            started = time.time()
+            try:
+                with urllib.request.urlopen(f"{server}/status/{uid}", timeout=30) as resp:
+                    state = json.loads(resp.read()).get("status")
+            except Exception:
+                with lock:
+                    status_errors[0] += 1
+                continue
+            now = time.time()
+            with lock:
+                status_latencies.append(now - started)
+                job = jobs[uid]
+                if state == "processing" and job["started"] is None:
+                    job["started"] = now
+                elif state == "completed" and job["finished"] is None:
+                    job["started"] = job["started"] or now
+                    job["finished"] = now
+            time.sleep(args.interval)
+
+    print(f"Queue scenario: {args.uploaders} uploaders x {args.jobs_per_uploader} jobs, {args.pollers} pollers")
+    deadline = time.time() + args.timeout
+    try:
+        started = time.time()
+        upload_threads = [threading.Thread(target=uploader, args=(i,), daemon=True) for i in range(args.uploaders)]
+        poll_threads = [threading.Thread(target=poller, args=(i,), daemon=True) for i in range(args.pollers)]
+        for t in upload_threads + poll_threads:
+            t.start()
+        for t in upload_threads:
+            t.join()
+        upload_wall = time.time() - started
+        uploads_done.set()
+        for t in poll_threads:
+            t.join(timeout=max(0.0, deadline - time.time()) + 5)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok_uploads = [(elapsed, size) for status, elapsed, size in uploads if status == 200]
+    per_client = []
+    for index in range(args.uploaders):
+        mine = [job for job in jobs.values() if job["client"] == index]
+        waits = [job["started"] - job["submitted"] for job in mine if job["started"]]
+        turnarounds = [job["finished"] - job["submitted"] for job in mine if job["finished"]]
+        per_client.append({
+            "client": index,
+            "heavy": index < args.heavy_uploaders,
+            "jobs": len(mine),
+            "completed": len(turnarounds),
+            "mean_wait_s": round(statistics.mean(waits), 2) if waits else None,
+            "mean_turnaround_s": round(statistics.mean(turnarounds), 2) if turnarounds else None,
+        })
+    light_waits = [c["mean_wait_s"] for c in per_client if not c["heavy"]]
+    completed = sum(c["completed"] for c in per_client)
+
+    report = {
+        "server": server,
+        "status": dict(summarize(status_latencies), errors=status_errors[0]),
+        "upload": {
+            "attempted": len(uploads),
+            "accepted": len(ok_uploads),
+            "wall_seconds": round(upload_wall, 2),
+            "uploads_per_second": round(len(ok_uploads) / upload_wall, 2) if upload_wall else None,
+            "mb_per_second": round(sum(size for _, size in ok_uploads) / (1024 ** 2) / upload_wall, 2)
+            if upload_wall else None,
+            "latency": summarize([elapsed for elapsed, _ in ok_uploads]),
+        },
+        "queue": {
+            "jobs": total_jobs,
+            "completed": completed,
+            # 軽いクライアントどうしの待ち時間の公平性（重いクライアントは別扱い）
+            "wait_fairness": jain_index(light_waits),
+            "clients": per_client,
+        },
+    }
+    print(json.dumps(report, indent=2))
+    passed = completed == total_jobs and status_errors[0] == 0
+    print("RESULT: all jobs completed" if passed else f"RESULT: {completed}/{total_jobs} jobs completed")
+    return 0 if passed else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests for the render server")
+    parser.add_argument("--scenario", choices=("status", "queue"), default="status",
+                        help="status: /status latency under slow uploads; queue: uploaders + pollers + fairness")
+    parser.add_argument("--server", default="http://127.0.0.1:5000", help="Flask server base URL")
+    parser.add_argument("--upload-url", default=None,
+                        help="Upload endpoint under test (status default: http://127.0.0.1:5001/upload, "
+                             "queue default: <server>/upload)")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between /status polls")
+    # scenario=status
+    parser.add_argument("--uploads", type=int, default=20, help="Concurrent uploads")
+    parser.add_argument("--upload-mb", type=float, default=32, help="Size of each upload (MB)")
+    parser.add_argument("--rate-kbps", type=float, default=1024, help="Per-upload send rate (KB/s)")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds to measure in each phase")
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="Fail if loaded p99 exceeds baseline p99 by this factor (plus 50ms)")
+    # scenario=queue
+    parser.add_argument("--uploaders", type=int, default=4, help="Simulated clients uploading jobs")
+    parser.add_argument("--jobs-per-uploader", type=int, default=5, help="Jobs each client uploads")
+    parser.add_argument("--pollers", type=int, default=8, help="Concurrent /status pollers")
+    parser.add_argument("--upload-kb", type=float, default=256, help="Size of each job upload (KB)")
+    parser.add_argument("--job-seconds", type=float, default=5.0, help="Timeline length of each job")
+    parser.add_argument("--heavy-uploaders", type=int, default=0,
+                        help="The first N clients upload longer jobs (fairness check)")
+    parser.add_argument("--heavy-multiplier", type=float, default=10.0, help="Length factor for heavy clients")
+    parser.add_argument("--timeout", type=float, default=300, help="Give up after this many seconds")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start a local server with the fake melt (fully offline)")
+    parser.add_argument("--slots", type=int, default=2, help="RENDER_SLOTS for --spawn")
+    parser.add_argument("--melt-fps", type=float, default=250, help="Fake melt speed for --spawn (frames/s)")
+    parser.add_argument("--melt-startup", type=float, default=0.0, help="Fake melt startup delay for --spawn")
+    parser.add_argument("--keep", action="store_true", help="Keep the --spawn work directory (server.log)")
+    args = parser.parse_args()
+
+    if args.scenario == "queue":
+        return run_queue_scenario(args)
+    args.upload_url = args.upload_url or "http://127.0.0.1:5001/upload"
+    return run_status_scenario(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+melt -progress 出力の解析 / Parsing of melt -progress output
+
+サーバー（app.py）とレンダリングエージェント（render_agent.py）で共用する。
+"""
+
+import os
+import re
+
+# melt -progress の出力は "Current Frame:   123, percentage:   4" を \r 区切りで上書き表示する
+PROGRESS_PATTERN = re.compile(r"(?:Current (?:Frame|Position)|Position|Frame):\s*(\d+)")
+LINE_SPLIT_PATTERN = re.compile(rb"[\r\n]+")
+
+
+def iter_melt_output(stream, chunk_size=65536):
+    """melt の出力を \r / \n どちらの区切りでも1行ずつ返す"""
+    buffer = b""
+    fd = stream.fileno()
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        parts = LINE_SPLIT_PATTERN.split(buffer)
+        buffer = parts.pop()
+        for part in parts:
+            if part:
+                yield part.decode('utf-8', errors='replace')
+    if buffer:
+        yield buffer.decode('utf-8', errors='replace')
+
+
+def parse_progress(line):
+    """進捗行ならフレーム番号、それ以外はNone"""
+    m = PROGRESS_PATTERN.search(line)
+    return int(m.group(1)) if m else None
@@ -0,0 +1,299 @@
+"""
+レンダリングのテレメトリ / Render telemetry in Prometheus text format
+
+外部依存を増やさないよう、Counter / Gauge / Histogram の最小実装と
+/proc からの melt プロセス統計取得をまとめたモジュール。
+"""
+
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+
+
+def _format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        if not self.label_names and self.metric_type in ("counter", "gauge"):
+            # ラベル無しのメトリクスは最初から0で出力する
+            self._values[()] = 0
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def remove(self, **labels):
+        with _lock:
+            self._values.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with _lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    DEFAULT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, float("inf"))
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float("inf"):
+            self.buckets += (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        names = self.label_names + ("le",)
+        with _lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state["counts"]):
+                    labels = _format_labels(names, key + (_format_value(float(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+                lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録先。render() で Prometheus テキスト形式を返す"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, func):
+        """スクレイプ直前に呼ばれる関数を登録（キュー長などの算出用）"""
+        self._collectors.append(func)
+
+    def render(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+upload_bytes_total = REGISTRY.register(Counter(
+    "render_upload_bytes_total", "Bytes received on /upload"))
+jobs_total = REGISTRY.register(Counter(
+    "render_jobs_total", "Finished render jobs", ("profile", "status")))
+job_duration_seconds = REGISTRY.register(Histogram(
+    "render_job_duration_seconds", "Wall time of melt rendering per job", ("profile",)))
+queue_wait_seconds = REGISTRY.register(Histogram(
+    "render_queue_wait_seconds", "Time a job spent waiting in the queue"))
+extract_seconds = REGISTRY.register(Histogram(
+    "render_extract_seconds", "Time spent extracting uploaded archives",
+    buckets=(0.5, 1, 5, 15, 30, 60, 120, 300, 600)))
+queue_length = REGISTRY.register(Gauge(
+    "render_queue_length", "Jobs waiting in the queue"))
+job_fps = REGISTRY.register(Gauge(
+    "render_job_fps", "Current encode speed of a running job in frames per second", ("job_id", "profile")))
+job_eta_seconds = REGISTRY.register(Gauge(
+    "render_job_eta_seconds", "Estimated seconds until a running job finishes", ("job_id",)))
+melt_cpu_seconds = REGISTRY.register(Gauge(
+    "render_melt_cpu_seconds", "CPU seconds consumed by the melt process tree", ("job_id",)))
+melt_rss_bytes = REGISTRY.register(Gauge(
+    "render_melt_rss_bytes", "Resident memory of the melt process tree", ("job_id",)))
+storage_reclaimed_bytes_total = REGISTRY.register(Counter(
+    "render_storage_reclaimed_bytes_total", "Bytes deleted by the storage manager"))
+storage_usage_bytes = REGISTRY.register(Gauge(
+    "render_storage_usage_bytes", "Bytes used under the rendering folder at the last sweep"))
+melt_startup_seconds = REGISTRY.register(Histogram(
+    "render_melt_startup_seconds", "Time from launching melt to its first progress line", ("display",),
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30)))
+
+_RUNNING_JOB_GAUGES = (job_eta_seconds, melt_cpu_seconds, melt_rss_bytes)
+
+
+def clear_job_gauges(job_id, profile):
+    """ジョブ終了時にジョブ単位のゲージを削除（ラベル数の増加を防ぐ）"""
+    job_fps.remove(job_id=job_id, profile=profile)
+    for gauge in _RUNNING_JOB_GAUGES:
+        gauge.remove(job_id=job_id)
+
+
+# ----------------------- /proc からのプロセス統計 -----------------------
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _child_pids(pid):
+    children = []
+    task_dir = f"/proc/{pid}/task"
+    try:
+        for tid in os.listdir(task_dir):
+            with open(f"{task_dir}/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_stats(root_pid):
+    """
+    root_pid 以下のプロセスツリーの (cpu_seconds, rss_bytes) を返す。
+    xvfb-run 経由で起動した melt も子プロセスとして集計される。
+    /proc が無い環境では (None, None)。
+    """
+    if not os.path.isdir(f"/proc/{root_pid}"):
+        return None, None
+
+    cpu_ticks = 0
+    rss_pages = 0
+    pending = [root_pid]
+    seen = set()
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm に空白や括弧が含まれる可能性があるため最後の ')' 以降を分割
+        fields = stat[stat.rfind(")") + 2:].split()
+        # fields[0] は state（stat の3番目）。utime=14, stime=15, rss=24 番目
+        cpu_ticks += int(fields[11]) + int(fields[12])
+        rss_pages += int(fields[21])
+        pending.extend(_child_pids(pid))
+
+    return cpu_ticks / _CLK_TCK, rss_pages * _PAGE_SIZE
+
+
+class JobTelemetry:
+    """1ジョブ分のレンダリング速度・ETA・リソース使用量を追跡"""
+
+    SAMPLE_INTERVAL = 1.0
+
+    def __init__(self, job_id, profile, total_frames):
+        self.job_id = job_id
+        self.profile = profile
+        self.total_frames = total_frames
+        self.started_at = time.time()
+        self.fps = 0.0
+        self.eta_seconds = None
+        self.cpu_seconds = None
+        self.rss_bytes = None
+        self.startup_seconds = None
+        self._last_sample_time = self.started_at
+        self._last_sample_frame = 0
+
+    def update(self, current_frame, pid=None):
+        """進捗フレームを反映。SAMPLE_INTERVAL 毎にfps/ETA/CPU/RSSを再計算し True を返す"""
+        now = time.time()
+        elapsed = now - self._last_sample_time
+        if elapsed < self.SAMPLE_INTERVAL:
+            return False
+
+        instant_fps = (current_frame - self._last_sample_frame) / elapsed
+        # 移動平均で揺れを抑える
+        self.fps = instant_fps if self.fps == 0 else 0.7 * self.fps + 0.3 * instant_fps
+        self._last_sample_time = now
+        self._last_sample_frame = current_frame
+
+        if self.fps > 0 and self.total_frames:
+            self.eta_seconds = max(0.0, (self.total_frames - current_frame) / self.fps)
+
+        if pid is not None:
+            cpu, rss = process_tree_stats(pid)
+            if cpu is not None:
+                self.cpu_seconds = cpu
+                self.rss_bytes = rss
+
+        job_fps.set(round(self.fps, 2), job_id=self.job_id, profile=self.profile)
+        if self.eta_seconds is not None:
+            job_eta_seconds.set(round(self.eta_seconds, 1), job_id=self.job_id)
+        if self.cpu_seconds is not None:
+            melt_cpu_seconds.set(round(self.cpu_seconds, 2), job_id=self.job_id)
+            melt_rss_bytes.set(self.rss_bytes, job_id=self.job_id)
+        return True
+
+    def skip_to(self, current_frame):
+        """キャッシュやチェックポイントで飛ばしたフレームを速度の計算に含めない"""
+        self._last_sample_time = time.time()
+        self._last_sample_frame = current_frame
+
+    def record_startup(self, seconds, display_mode):
+        """melt 起動から最初の進捗までの時間を記録（display_mode: "pool" / "xvfb-run" / "none"）"""
+        self.startup_seconds = seconds
+        melt_startup_seconds.observe(seconds, display=display_mode)
+
+    def as_dict(self):
+        return {
+            "fps": round(self.fps, 2),
+            "eta_seconds": round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            "melt_cpu_seconds": round(self.cpu_seconds, 2) if self.cpu_seconds is not None else None,
+            "melt_rss_bytes": self.rss_bytes,
+            "startup_seconds": round(self.startup_seconds, 2) if self.startup_seconds is not None else None,
+            "elapsed_seconds": round(time.time() - self.started_at, 1),
+        }
@@ -0,0 +1,164 @@
+"""
+アップロード直後の事前検査 / Preflight validation of uploaded archives
+
+壊れたジョブ（cloud_rendering.mlt が無い・XML が読めない・data/ の素材がアーカイブに無い）は、
+これまでキューで順番を待って展開した後に初めて失敗していた。
+アップロード完了時点で以下だけを読み、レンダリング枠を使う前に拒否する。
+
+- ZIP のセントラルディレクトリ（メンバー一覧。素材本体は読まない）
+- cloud_rendering.mlt
+
+検査結果（総フレーム数・解像度・fps・フィルター数）はコスト見積もりにもそのまま使う。
+"""
+
+from pathlib import Path, PurePosixPath
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+
+MLT_NAME = "cloud_rendering.mlt"
+# 数値:パス（timewarp の速度指定。例: 2.000000:data/clip.mp4）
+_SPEED_PREFIX = re.compile(r"^-?\d+(?:\.\d+)?:(.+)$")
+_WINDOWS_DRIVE = re.compile(r"^[A-Za-z]:[\\/]")
+
+
+class PreflightError(Exception):
+    """事前検査で拒否する場合の例外（errors に理由の一覧を持つ）"""
+
+    def __init__(self, errors, report=None):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.report = report or {}
+
+
+def _normalize(name: str) -> str:
+    """アーカイブ内パスを比較用に正規化（区切り文字・先頭の ./ と /）"""
+    name = name.replace("\\", "/")
+    parts = [part for part in PurePosixPath(name).parts if part not in (".", "/")]
+    return "/".join(parts)
+
+
+def resource_path(value: str):
+    """
+    resource 値がファイルパスなら（速度指定を除いた）パスを返し、そうでなければ None
+    （mltpy.packager の書き換え対象と同じ判定）
+    """
+    text = value.strip().strip('"')
+    if not text or "://" in text:
+        return None
+    match = _SPEED_PREFIX.match(text)
+    if match:
+        text = match.group(1)
+    if any(sep in text for sep in ("/", "\\")) or PurePosixPath(text.replace("\\", "/")).suffix:
+        return text
+    return None
+
+
+def _is_absolute(path: str) -> bool:
+    return path.startswith(("/", "\\")) or bool(_WINDOWS_DRIVE.match(path))
+
+
+def _timecode_frames(value, fps):
+    """in/out 属性（HH:MM:SS.mmm またはフレーム数）をフレーム数に変換。変換できなければ None"""
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        hh, mm, ss = value.split(":")
+        seconds = int(hh) * 3600 + int(mm) * 60 + float(ss)
+    except ValueError:
+        return None
+    return int(round(seconds * fps)) if fps > 0 else None
+
+
+def inspect_mlt(mlt_bytes: bytes, members):
+    """
+    MLT を解析し、producer / chain の resource をアーカイブのメンバーと照合する
+
+    Args:
+        members: アーカイブ内のファイルパスの集合
+
+    Returns:
+        検査結果の dict（errors が空でなければ拒否対象、warnings は /status に表示するだけ）
+    """
+    report = {"errors": [], "warnings": [], "resources": 0, "missing": []}
+    try:
+        root = ET.fromstring(mlt_bytes)
+    except ET.ParseError as e:
+        report["errors"].append(f"{MLT_NAME} is not valid XML: {e}")
+        return report
+
+    # プロファイル
+    profile = root.find("profile")
+    fps = 0.0
+    if profile is None:
+        report["errors"].append(f"{MLT_NAME} has no <profile>")
+    else:
+        try:
+            report["width"] = int(profile.get("width"))
+            report["height"] = int(profile.get("height"))
+            fps_den = int(profile.get("frame_rate_den", "1"))
+            fps = int(profile.get("frame_rate_num", "0")) / fps_den if fps_den else 0.0
+        except (TypeError, ValueError):
+            report["errors"].append(f"{MLT_NAME} has an invalid <profile>")
+        report["fps"] = fps
+
+    # 総フレーム数（最後の tractor がメインのタイムライン）
+    tractors = root.findall("tractor")
+    total_frames = _timecode_frames(tractors[-1].get("out"), fps) if tractors else None
+    if not total_frames:
+        report["warnings"].append("Could not determine the timeline length; progress will be approximate")
+    report["total_frames"] = total_frames or 0
+    report["filter_count"] = sum(1 for _ in root.iter("filter"))
+
+    # 素材の照合
+    member_set = {_normalize(name) for name in members}
+    for elem in list(root.iter("producer")) + list(root.iter("chain")):
+        for prop in elem.findall("property"):
+            if prop.get("name") != "resource" or not prop.text:
+                continue
+            path = resource_path(prop.text)
+            if path is None:
+                continue
+            report["resources"] += 1
+            if _is_absolute(path):
+                # クライアントの絶対パスはサーバーに存在しないことが多いが、共有素材の可能性もあるので警告のみ
+                report["warnings"].append(f"Resource uses an absolute path: {path}")
+            elif _normalize(path) not in member_set:
+                report["missing"].append(path)
+
+    if report["missing"]:
+        shown = ", ".join(report["missing"][:5])
+        more = f" (+{len(report['missing']) - 5} more)" if len(report["missing"]) > 5 else ""
+        report["errors"].append(f"{len(report['missing'])} resource(s) missing from the archive: {shown}{more}")
+    return report
+
+
+def inspect_zip(zip_path: Path):
+    """保存済みZIPのセントラルディレクトリと MLT だけを読んで検査"""
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
+            mlt_names = [name for name in names if _normalize(name) == MLT_NAME]
+            if not mlt_names:
+                return {"errors": [f"{MLT_NAME} is missing from the archive"], "warnings": []}
+            mlt_bytes = zf.read(mlt_names[0])
+    except (zipfile.BadZipFile, OSError) as e:
+        return {"errors": [f"Invalid zip archive: {e}"], "warnings": []}
+    return inspect_mlt(mlt_bytes, names)
+
+
+def inspect_directory(extract_dir: Path, members):
+    """ストリーム展開済みのジョブを検査（members は展開時に記録したアーカイブ内パス）"""
+    mlt_file = extract_dir / MLT_NAME
+    if not mlt_file.exists():
+        return {"errors": [f"{MLT_NAME} is missing from the archive"], "warnings": []}
+    return inspect_mlt(mlt_file.read_bytes(), members)
+
+
+def check(report):
+    """errors があれば PreflightError を送出し、無ければ report を返す"""
+    if report["errors"]:
+        raise PreflightError(report["errors"], report)
+    return report
@@ -0,0 +1,238 @@
+"""
+レンダリングエージェント / Pull-based render worker agent
+
+コーディネーター（RENDER_MODE=coordinator の app.py）からジョブを取得して melt を実行する。
+
+    python -m render_agent --server http://coordinator:5000
+
+1. /agent/claim をロングポーリングしてジョブを取得
+2. 入力（tar）を受信しながら作業ディレクトリに展開
+3. melt を実行し、進捗を1秒ごとに報告（melt の出力が無い間も報告してリースを維持。中断を指示されたら停止）
+4. output.mp4 をアップロード。失敗時は /fail に報告（別のエージェントに再割り当てされる）
+
+1台のマシンで試す場合は --melt に偽の melt（fake_melt.py）を指定し、--no-xvfb を付ける。
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from ingest import ingest_stream
+from melt_progress import iter_melt_output, parse_progress
+from render_profiles import build_consumer_args
+from render_watchdog import RenderWatchdog, cleanup_stale_xvfb, kill_process_group
+from xvfb_pool import XVFB_POOL_ENABLED, XvfbPool, melt_launch
+
+PROGRESS_INTERVAL = 1.0  # 進捗報告の間隔（秒）
+
+
+class AgentError(Exception):
+    """コーディネーターとの通信に失敗した場合の例外"""
+    pass
+
+
+class RenderAgent:
+    """コーディネーターからジョブを取得してレンダリングするクラス"""
+
+    def __init__(self, server, agent_id, work_dir: Path, melt_command, use_xvfb=True, token="", wait=20):
+        self.server = server.rstrip("/")
+        self.agent_id = agent_id
+        self.work_dir = work_dir
+        self.melt_command = shlex.split(melt_command)
+        self.use_xvfb = use_xvfb
+        self.token = token
+        self.wait = wait
+        # melt が止まったら停止して失敗として報告（コーディネーターが別のエージェントに再割り当て）
+        self.watchdog = RenderWatchdog()
+        # エージェントは1枠なので常駐 Xvfb も1つ
+        self.xvfb_pool = XvfbPool(1) if use_xvfb and XVFB_POOL_ENABLED else None
+
+    # ----------------------- HTTP -----------------------
+    def _request(self, path, data=None, method=None, headers=None, timeout=None):
+        headers = dict(headers or {})
+        headers["X-Agent-Id"] = self.agent_id
+        if self.token:
+            headers["X-Agent-Token"] = self.token
+        req = urllib.request.Request(self.server + path, data=data, method=method, headers=headers)
+        try:
+            return urllib.request.urlopen(req, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            raise AgentError(f"{method or 'GET'} {path} failed: {e.code} {e.read()[:200]!r}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise AgentError(f"{method or 'GET'} {path} failed: {e}") from e
+
+    def _post_json(self, path, payload, timeout=30):
+        body = json.dumps(dict(payload, agent_id=self.agent_id)).encode("utf-8")
+        with self._request(path, body, "POST", {"Content-Type": "application/json"}, timeout) as resp:
+            raw = resp.read()
+            return json.loads(raw) if raw else None
+
+    # ----------------------- メインループ -----------------------
+    def run(self, max_jobs=None):
+        """ジョブを取得・処理し続ける（max_jobs 件処理したら終了）"""
+        print(f"Agent {self.agent_id}: polling {self.server}")
+        if self.use_xvfb:
+            cleanup_stale_xvfb()
+        if self.xvfb_pool is not None:
+            try:
+                self.xvfb_pool.start()
+            except Exception as e:
+                print(f"Agent {self.agent_id}: Xvfb pool unavailable, using xvfb-run: {e}")
+                self.xvfb_pool.stop()
+                self.xvfb_pool = None
+        done = 0
+        while max_jobs is None or done < max_jobs:
+            try:
+                response = self._post_json("/agent/claim", {"wait": self.wait}, timeout=self.wait + 30)
+            except AgentError as e:
+                print(f"Agent {self.agent_id}: {e}")
+                time.sleep(5)
+                continue
+            if not response:
+                continue  # 204: ジョブ無し
+            self.process(response["job"])
+            done += 1
+
+    def process(self, job):
+        uid = job["job_id"]
+        job_dir = self.work_dir / uid
+        print(f"Agent {self.agent_id}: job {uid} (profile: {job['profile']}, attempt {job.get('attempt')})")
+        try:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            with self._request(job["input_url"], timeout=60) as resp:
+                received, _ = ingest_stream(resp, job_dir, "tar")
+            print(f"Agent {self.agent_id}: received {received} bytes of input")
+
+            output_file = job_dir / "output.mp4"
+            exit_code = self.render(job, job_dir / "cloud_rendering.mlt", output_file)
+            if exit_code is None:
+                print(f"Agent {self.agent_id}: job {uid} was reassigned, stopped")
+                return
+            if exit_code != 0 or not output_file.exists():
+                raise AgentError(f"melt exited with code {exit_code}")
+
+            size = output_file.stat().st_size
+            with output_file.open("rb") as f:
+                headers = {"Content-Type": "application/octet-stream", "Content-Length": str(size)}
+                with self._request(job["result_url"], f, "PUT", headers, timeout=300):
+                    pass
+            print(f"Agent {self.agent_id}: job {uid} uploaded ({size} bytes)")
+        except Exception as e:
+            print(f"Agent {self.agent_id}: job {uid} failed: {e}")
+            try:
+                self._post_json(job["fail_url"], {"error": str(e)})
+            except AgentError as report_error:
+                print(f"Agent {self.agent_id}: failed to report failure: {report_error}")
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def render(self, job, mlt_file, output_file):
+        """
+        melt を実行して進捗を報告
+
+        Returns:
+            終了コード。コーディネーターに中断を指示された場合は None
+        """
+        source_size = tuple(job["source_size"]) if job.get("source_size") else None
+        consumer_args = build_consumer_args(job["profile"], output_file, source_size)
+        cmd = self.melt_command + [str(mlt_file), "-progress"] + consumer_args
+        env, display = None, None
+        if self.use_xvfb:
+            cmd, env, display = melt_launch(self.xvfb_pool, cmd)
+        launched = time.time()
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    start_new_session=True, env=env)
+        except Exception:
+            if display is not None:
+                self.xvfb_pool.release(display)
+            raise
+        self.watchdog.watch(job["job_id"], proc, job.get("total_frames") or 0)
+
+        # 進捗の報告（リースの更新）は別スレッドで一定間隔に行う。
+        # 大きなプロジェクトの読み込み中など melt が何も出力しない間にリースが切れないように
+        state = {"current": 0, "cancelled": False}
+        stop = threading.Event()
+        reporter = threading.Thread(target=self._report_progress, args=(job, proc, state, stop), daemon=True)
+        reporter.start()
+        started = False
+        try:
+            for line in iter_melt_output(proc.stdout):
+                frame = parse_progress(line)
+                if frame is not None:
+                    if not started:
+                        started = True
+                        print(f"Agent {self.agent_id}: melt started in {time.time() - launched:.2f}s "
+                              f"({display.name if display else 'xvfb-run' if self.use_xvfb else 'no display'})")
+                    state["current"] = frame
+                    self.watchdog.progress(job["job_id"], frame)
+            exit_code = proc.wait()
+        finally:
+            stop.set()
+            reporter.join()
+            if proc.poll() is None:
+                kill_process_group(proc)
+                proc.wait()
+            stalled = self.watchdog.unwatch(job["job_id"])
+            if display is not None:
+                self.xvfb_pool.release(display)
+        if state["cancelled"]:
+            return None
+        if stalled:
+            raise AgentError(f"melt stopped by watchdog: {stalled}")
+        return exit_code
+
+    def _report_progress(self, job, proc, state, stop):
+        """PROGRESS_INTERVAL ごとに進捗を報告。コーディネーターに中断を指示されたら melt を停止"""
+        while not stop.wait(PROGRESS_INTERVAL):
+            try:
+                reply = self._post_json(job["progress_url"], {"current": state["current"]}, timeout=10)
+            except AgentError as e:
+                # 一時的な通信障害ではレンダリングを続ける（リース切れになれば再割り当てされる）
+                print(f"Agent {self.agent_id}: progress report failed: {e}")
+                continue
+            if reply and not reply.get("continue", True):
+                state["cancelled"] = True
+                kill_process_group(proc)
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render farm worker agent")
+    parser.add_argument("--server", default=os.getenv("RENDER_COORDINATOR_URL", "http://127.0.0.1:5000"),
+                        help="Coordinator base URL")
+    parser.add_argument("--agent-id", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Unique agent name")
+    parser.add_argument("--token", default=os.getenv("RENDER_AGENT_TOKEN", ""),
+                        help="Shared token (RENDER_AGENT_TOKEN on the coordinator)")
+    parser.add_argument("--work-dir", type=Path, default=None,
+                        help="Scratch directory for job inputs (default: a temp dir)")
+    parser.add_argument("--melt", default=os.getenv("MELT_PATH", "/usr/bin/melt"),
+                        help="melt command (e.g. 'python fake_melt.py' for testing)")
+    parser.add_argument("--no-xvfb", action="store_true", help="Run melt without xvfb-run")
+    parser.add_argument("--wait", type=float, default=20, help="Long-poll timeout in seconds")
+    parser.add_argument("--max-jobs", type=int, default=None, help="Exit after this many jobs")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="render-agent-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    agent = RenderAgent(args.server, args.agent_id, work_dir, args.melt,
+                        use_xvfb=not args.no_xvfb, token=args.token, wait=args.wait)
+    try:
+        agent.run(args.max_jobs)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
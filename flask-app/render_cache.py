@@ -0,0 +1,118 @@
+"""
+レンダリング結果キャッシュ / Render result cache
+
+正規化した cloud_rendering.mlt・data/ 配下の各ファイルのハッシュ・レンダリングプロファイルから
+決定的なジョブキーを計算し、同じキーの output.mp4 が既にあれば再レンダリングせずに返す。
+同時にキューに入った同一ジョブは、先行ジョブのレンダリング完了を待って結果を共有する。
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import threading
+import xml.etree.ElementTree as ET
+
+from render_profiles import RENDER_PROFILES
+
+# 利用者の環境ごとに変わるが出力には影響しない属性（元プロジェクトのディレクトリ）
+_VOLATILE_ROOT_ATTRIBUTES = ("root",)
+
+
+def normalize_mlt(mlt_file: Path) -> bytes:
+    """MLTを正規化（属性順・空白・環境依存の root 属性の差を吸収）したバイト列を返す"""
+    root = ET.parse(mlt_file).getroot()
+    for name in _VOLATILE_ROOT_ATTRIBUTES:
+        root.attrib.pop(name, None)
+    return ET.canonicalize(ET.tostring(root, encoding="unicode"), strip_text=True).encode("utf-8")
+
+
+def compute_job_key(mlt_file: Path, member_hashes: dict, profile_name: str, options: dict = None) -> str:
+    """
+    ジョブキーを計算
+
+    Args:
+        mlt_file: 展開済みの cloud_rendering.mlt
+        member_hashes: {アーカイブ内パス: SHA-256}（data/ 配下のみ使用）
+        profile_name: レンダリングプロファイル名
+        options: 出力形式に影響するジョブごとの指定（断片化MP4など）。無ければキーに含めない
+    """
+    digest = hashlib.sha256()
+    digest.update(b"mlt\0")
+    digest.update(normalize_mlt(mlt_file))
+    digest.update(b"\0data\0")
+    for name in sorted(member_hashes):
+        if name.startswith("data/"):
+            digest.update(f"{name}\0{member_hashes[name]}\0".encode("utf-8"))
+    digest.update(b"profile\0")
+    profile = {"name": profile_name, "settings": RENDER_PROFILES.get(profile_name)}
+    if options:
+        profile["options"] = options
+    digest.update(json.dumps(profile, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def link_output(source: Path, target: Path):
+    """キャッシュ済みの出力をハードリンクで共有（別ボリュームならコピー）"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class RenderCache:
+    """
+    ジョブキーとレンダリング結果の対応を管理するクラス。
+
+    acquire(key, uid) は完了済みの同一ジョブを探し、
+    同じキーのレンダリングが進行中ならその完了を待つ。
+    """
+
+    def __init__(self, find_cached_output):
+        """
+        Args:
+            find_cached_output: key を受け取り、既存の output.mp4 の Path（無ければ None）を返す関数
+        """
+        self.find_cached_output = find_cached_output
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> (leader uid, threading.Event)
+
+    def acquire(self, key: str, uid: str):
+        """
+        レンダリング前に呼ぶ。
+
+        Returns:
+            (cached_output, leader_uid)
+            cached_output が Path ならキャッシュヒット（レンダリング不要）。
+            None なら呼び出し側がレンダリングし、終了後に release(key) を呼ぶ。
+            leader_uid は結果を共有した先行ジョブのID（待機しなかった場合は None）。
+        """
+        while True:
+            with self._lock:
+                cached = self.find_cached_output(key)
+                if cached is not None:
+                    return cached, None
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    self._inflight[key] = (uid, threading.Event())
+                    return None, None
+                leader_uid, event = inflight
+
+            print(f"Render cache: {uid} waits for identical job {leader_uid}")
+            event.wait()
+            with self._lock:
+                cached = self.find_cached_output(key)
+            if cached is not None:
+                return cached, leader_uid
+            # 先行ジョブが失敗した場合は自分がレンダリングを引き継ぐ
+
+    def release(self, key: str):
+        """レンダリング終了（成功・失敗問わず）を待機中のジョブに通知"""
+        with self._lock:
+            inflight = self._inflight.pop(key, None)
+        if inflight is not None:
+            inflight[1].set()
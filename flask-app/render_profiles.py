@@ -0,0 +1,162 @@
+"""
+レンダリングプロファイル / Named render profiles
+
+アップロード時に X-Render-Profile ヘッダー（またはアーカイブ内の render.json）で
+選択できる melt avformat コンシューマーの設定群。
+"""
+
+import os
+import threading
+
+# プロファイル定義
+#   vcodec / preset / crf or vb : 映像エンコード設定
+#   scale                       : プロジェクト解像度に対する倍率（1.0 = 等倍）
+#   threads                     : real_time=-N のN（0ならCPUコア数）
+#   acodec / ab / ar            : 音声エンコード設定
+RENDER_PROFILES = {
+    "draft": {
+        "vcodec": "libx264",
+        "preset": "ultrafast",
+        "crf": 30,
+        "scale": 0.5,
+        "threads": 0,
+        "acodec": "aac",
+        "ab": "96k",
+        "ar": 44100,
+    },
+    "final": {
+        "vcodec": "libx264",
+        "preset": "medium",
+        "crf": 18,
+        "scale": 1.0,
+        "threads": 0,
+        "acodec": "aac",
+        "ab": "192k",
+        "ar": 48000,
+    },
+}
+
+DEFAULT_RENDER_PROFILE = os.getenv("DEFAULT_RENDER_PROFILE", "final")
+
+# プレビュー用（X-Preview 指定時、本レンダリングの前に出力）。アップロード時には選択できない
+#   max_height : 出力の高さの上限（プロジェクト解像度から縮小）
+PREVIEW_PROFILE_NAME = "preview"
+PREVIEW_PROFILE = {
+    "vcodec": "libx264",
+    "preset": "ultrafast",
+    "crf": 32,
+    "scale": 1.0,
+    "max_height": int(os.getenv("PREVIEW_MAX_HEIGHT", "360")),
+    "threads": 0,
+    "acodec": "aac",
+    "ab": "96k",
+    "ar": 44100,
+}
+
+# プロファイルごとのエンコード実績（fpsチューニング用）
+_stats_lock = threading.Lock()
+profile_stats = {}  # name -> { 'jobs': 0, 'frames': 0, 'seconds': 0.0, 'units': 0.0 }
+
+
+def resolve_profile_name(name):
+    """プロファイル名を正規化。空ならデフォルト、未知ならNone"""
+    if not name:
+        return DEFAULT_RENDER_PROFILE
+    name = name.strip().lower()
+    return name if name in RENDER_PROFILES else None
+
+
+def _even(value: float) -> int:
+    """H.264 は偶数解像度が必要なので切り下げて偶数化"""
+    return max(2, int(value) // 2 * 2)
+
+
+# 断片化MP4（moov を先頭に置き、キーフレームごとに moof+mdat を追記）。レンダリング中から配信できる
+PROGRESSIVE_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+
+
+def build_consumer_args(profile_name, output_file, source_size=None, progressive=False):
+    """
+    melt に渡す -consumer 以降の引数リストを生成
+
+    Args:
+        profile_name: RENDER_PROFILES のキー
+        output_file: 出力ファイルパス
+        source_size: プロジェクトの (width, height)。scale != 1.0 の場合に使用
+        progressive: True なら断片化MP4で出力
+    """
+    profile = PREVIEW_PROFILE if profile_name == PREVIEW_PROFILE_NAME else RENDER_PROFILES[profile_name]
+
+    args = ["-consumer", f"avformat:{output_file}"]
+    args.append(f"vcodec={profile['vcodec']}")
+    if profile.get("preset"):
+        args.append(f"preset={profile['preset']}")
+    if profile.get("vb"):
+        args.append(f"vb={profile['vb']}")
+    elif profile.get("crf") is not None:
+        args.append(f"crf={profile['crf']}")
+
+    scale = profile.get("scale", 1.0)
+    if source_size and profile.get("max_height"):
+        scale = min(scale, profile["max_height"] / source_size[1])
+    if source_size and scale != 1.0:
+        width, height = source_size
+        args.append(f"width={_even(width * scale)}")
+        args.append(f"height={_even(height * scale)}")
+
+    threads = profile.get("threads", 0) or os.cpu_count() or 1
+    args.append(f"real_time=-{threads}")
+
+    if progressive:
+        args.append(f"movflags={PROGRESSIVE_MOVFLAGS}")
+
+    args.append(f"acodec={profile['acodec']}")
+    if profile.get("ab"):
+        args.append(f"ab={profile['ab']}")
+    if profile.get("ar"):
+        args.append(f"ar={profile['ar']}")
+
+    return args
+
+
+def record_encode(profile_name, frames, seconds, cost_units=None):
+    """
+    レンダリング完了時にフレーム数と所要時間を記録
+
+    Args:
+        cost_units: スケジューラのコスト単位（scheduler.job_cost_units）。処理速度の学習に使用
+    """
+    if seconds <= 0 or frames <= 0:
+        return
+    with _stats_lock:
+        stats = profile_stats.setdefault(profile_name, {"jobs": 0, "frames": 0, "seconds": 0.0, "units": 0.0})
+        stats["jobs"] += 1
+        stats["frames"] += frames
+        stats["seconds"] += seconds
+        if cost_units:
+            stats["units"] = stats.get("units", 0.0) + cost_units
+            stats["unit_seconds"] = stats.get("unit_seconds", 0.0) + seconds
+
+
+def get_units_per_second(profile_name):
+    """プロファイルの実績処理速度（コスト単位/秒）。実績が無ければNone"""
+    with _stats_lock:
+        stats = profile_stats.get(profile_name)
+        if not stats or not stats.get("unit_seconds"):
+            return None
+        return stats["units"] / stats["unit_seconds"]
+
+
+def get_profile_summary():
+    """プロファイル設定と実測エンコードfpsを返す"""
+    summary = {}
+    with _stats_lock:
+        for name, profile in RENDER_PROFILES.items():
+            stats = profile_stats.get(name, {"jobs": 0, "frames": 0, "seconds": 0.0, "units": 0.0})
+            fps = stats["frames"] / stats["seconds"] if stats["seconds"] > 0 else None
+            summary[name] = {
+                "settings": profile,
+                "jobs": stats["jobs"],
+                "encode_fps": round(fps, 2) if fps is not None else None,
+            }
+    return summary
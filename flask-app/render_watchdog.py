@@ -0,0 +1,168 @@
+"""
+melt プロセスの監視 / Watchdog for melt processes
+
+melt が素材の不具合や xvfb-run のロック待ちで止まると、出力を読むループが永久に待ち続け、
+キュー全体が止まってしまう。監視スレッドがジョブごとの最終進捗時刻を確認し、
+- 一定時間（RENDER_STALL_SECONDS）フレームが進まない
+- 総フレーム数から求めた制限時間（RENDER_TIMEOUT_GRACE_SECONDS + 総フレーム数 / RENDER_MIN_FPS）を超えた
+場合にプロセスグループごと停止する。再キューは呼び出し側（app.py / render_agent.py）が行う。
+
+また、強制終了で残った Xvfb のロックファイル・ソケットと xvfb-run の一時ディレクトリを掃除する。
+"""
+
+from pathlib import Path
+import os
+import shutil
+import signal
+import threading
+import time
+
+STALL_SECONDS = float(os.getenv("RENDER_STALL_SECONDS", "300"))
+MIN_FPS = float(os.getenv("RENDER_MIN_FPS", "1.0"))
+TIMEOUT_GRACE_SECONDS = float(os.getenv("RENDER_TIMEOUT_GRACE_SECONDS", "600"))
+# 監視で停止したジョブを再キューする回数
+MAX_RETRIES = int(os.getenv("RENDER_MAX_RETRIES", "2"))
+
+CHECK_INTERVAL = 5.0
+KILL_GRACE_SECONDS = 10.0  # SIGTERM から SIGKILL までの猶予
+TMP_DIR = Path("/tmp")
+
+
+class RenderStalled(Exception):
+    """監視スレッドが melt を停止した場合の例外"""
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def kill_process_group(proc, grace=KILL_GRACE_SECONDS):
+    """start_new_session=True で起動したプロセスをグループごと停止（xvfb-run・Xvfb・melt）"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.time() + grace
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        time.sleep(0.2)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def cleanup_stale_xvfb(tmp_dir: Path = TMP_DIR, remove_run_dirs=False):
+    """
+    プロセスが既に存在しない Xvfb のロックファイル（/tmp/.X<n>-lock）とソケットを削除
+
+    Args:
+        remove_run_dirs: True なら xvfb-run の一時ディレクトリ（/tmp/xvfb-run.*）も削除
+                         （レンダリング中のジョブが無いときだけ指定する）
+
+    Returns:
+        削除したパスの数
+    """
+    removed = 0
+    for lock in tmp_dir.glob(".X*-lock"):
+        display = lock.name[2:-5]
+        try:
+            pid = int(lock.read_text().strip())
+        except (OSError, ValueError):
+            continue
+        if _pid_alive(pid):
+            continue
+        for path in (lock, tmp_dir / ".X11-unix" / f"X{display}"):
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        print(f"Watchdog: removed stale Xvfb display :{display} (pid {pid})")
+    if remove_run_dirs:
+        for run_dir in tmp_dir.glob("xvfb-run.*"):
+            shutil.rmtree(run_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class _Watched:
+    def __init__(self, proc, total_frames):
+        self.proc = proc
+        self.started_at = time.time()
+        self.last_progress_at = self.started_at
+        self.last_frame = -1
+        self.timeout = TIMEOUT_GRACE_SECONDS + (total_frames / MIN_FPS if MIN_FPS > 0 else 0)
+        self.reason = None
+
+
+class RenderWatchdog:
+    """実行中の melt を監視するクラス（監視スレッドは最初の watch() で起動）"""
+
+    def __init__(self, stall_seconds=None, interval=CHECK_INTERVAL):
+        self.stall_seconds = stall_seconds if stall_seconds is not None else STALL_SECONDS
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._jobs = {}  # key -> _Watched
+        self._thread = None
+        self.kills_total = 0
+
+    def watch(self, key, proc, total_frames):
+        """監視を開始（proc は start_new_session=True で起動しておく）"""
+        with self._lock:
+            self._jobs[key] = _Watched(proc, total_frames)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def progress(self, key, frame):
+        """フレームが進んだことを記録"""
+        with self._lock:
+            watched = self._jobs.get(key)
+            if watched is not None and frame != watched.last_frame:
+                watched.last_frame = frame
+                watched.last_progress_at = time.time()
+
+    def unwatch(self, key):
+        """
+        監視を終了
+
+        Returns:
+            監視スレッドが停止させた場合はその理由、それ以外は None
+        """
+        with self._lock:
+            watched = self._jobs.pop(key, None)
+            idle = not self._jobs
+        if watched is not None and watched.reason:
+            # 強制終了した Xvfb の残骸を掃除
+            cleanup_stale_xvfb(remove_run_dirs=idle)
+        return watched.reason if watched is not None else None
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                targets = []
+                for key, watched in self._jobs.items():
+                    if watched.reason or watched.proc.poll() is not None:
+                        continue
+                    if now - watched.last_progress_at > self.stall_seconds:
+                        watched.reason = f"no progress for {now - watched.last_progress_at:.0f}s"
+                    elif now - watched.started_at > watched.timeout:
+                        watched.reason = f"exceeded time limit of {watched.timeout:.0f}s"
+                    else:
+                        continue
+                    targets.append((key, watched))
+            for key, watched in targets:
+                print(f"Watchdog: killing {key}: {watched.reason}")
+                self.kills_total += 1
+                kill_process_group(watched.proc)
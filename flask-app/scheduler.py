@@ -0,0 +1,185 @@
+"""
+コスト考慮型スケジューラ / Cost-aware job scheduler
+
+FIFO の job_queue の代わりに、投入時に見積もったレンダリング時間が短いジョブを優先する。
+- 待ち時間に応じて優先度を上げ（エイジング）、長いジョブが飢餓状態にならないようにする
+- クライアントIPごとに最近使ったレンダリング時間を加算し、特定クライアントの独占を防ぐ
+- 見積もりから各ジョブの開始・終了予定時刻を算出する
+"""
+
+import heapq
+import math
+import os
+import threading
+import time
+
+# エイジング：待ち時間1秒あたり何秒分優先度を上げるか
+AGING_RATE = float(os.getenv("SCHED_AGING_RATE", "0.5"))
+# 公平性：クライアントが最近使ったレンダリング時間をどれだけ加算するか
+FAIRNESS_WEIGHT = float(os.getenv("SCHED_FAIRNESS_WEIGHT", "0.5"))
+# クライアント使用量の半減期（秒）
+USAGE_HALF_LIFE = float(os.getenv("SCHED_USAGE_HALF_LIFE", "3600"))
+
+# 実績が無いプロファイルの処理速度（コスト単位/秒）
+DEFAULT_UNITS_PER_SECOND = {"draft": 120.0, "final": 40.0}
+FALLBACK_UNITS_PER_SECOND = 40.0
+
+# 1フィルターあたりのコスト増加率
+FILTER_COST = 0.05
+
+
+def job_cost_units(total_frames, width, height, scale=1.0, filter_count=0):
+    """
+    ジョブのコスト単位（フレーム数 × 出力メガピクセル × フィルター補正）。
+    プロファイルの実績処理速度（単位/秒）で割ると所要秒数の見積もりになる。
+    """
+    megapixels = max(width * height * scale * scale, 1) / 1_000_000
+    return total_frames * megapixels * (1 + FILTER_COST * filter_count)
+
+
+def estimate_seconds(cost_units, profile_name, units_per_second=None):
+    """コスト単位から所要秒数を見積もる（units_per_second は実績値。無ければ既定値）"""
+    rate = units_per_second or DEFAULT_UNITS_PER_SECOND.get(profile_name, FALLBACK_UNITS_PER_SECOND)
+    return cost_units / rate if rate > 0 else 0.0
+
+
+class _Job:
+    __slots__ = ("uid", "estimate", "client", "enqueued_at")
+
+    def __init__(self, uid, estimate, client, enqueued_at):
+        self.uid = uid
+        self.estimate = estimate
+        self.client = client
+        self.enqueued_at = enqueued_at
+
+
+class JobScheduler:
+    """
+    ジョブの待ち行列。get() は「見積もり時間 + クライアント使用量補正 - 待ち時間補正」が
+    最小のジョブを返す（スレッドセーフ）。
+    """
+
+    def __init__(self, slots=1):
+        self.slots = slots
+        self._cond = threading.Condition()
+        self._waiting = {}   # uid -> _Job
+        self._running = {}   # uid -> (_Job, started_at)
+        self._usage = {}     # client -> (used_seconds, updated_at)
+
+    # ----------------------- キュー操作 -----------------------
+    def put(self, uid, estimate_seconds=0.0, client="", enqueued_at=None):
+        """ジョブを登録（enqueued_at: 再起動後に再開するジョブは元の投入時刻を引き継ぐ）"""
+        with self._cond:
+            self._waiting[uid] = _Job(uid, estimate_seconds, client, enqueued_at or time.time())
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """次のジョブIDを取り出す（無ければ待機）。timeout 経過時は None"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._waiting:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            now = time.time()
+            job = min(self._waiting.values(), key=lambda j: (self._priority(j, now), j.enqueued_at))
+            del self._waiting[job.uid]
+            self._running[job.uid] = (job, now)
+            return job.uid
+
+    def finish(self, uid):
+        """ジョブ終了。実際に使ったレンダリング時間をクライアントの使用量に加算"""
+        with self._cond:
+            entry = self._running.pop(uid, None)
+            if entry is None:
+                return
+            job, started_at = entry
+            self._add_usage(job.client, time.time() - started_at, time.time())
+
+    def requeue(self, uid):
+        """実行中のジョブを待ち行列に戻す（投入時刻は維持）"""
+        with self._cond:
+            entry = self._running.pop(uid, None)
+            if entry is None:
+                return False
+            job, started_at = entry
+            self._add_usage(job.client, time.time() - started_at, time.time())
+            self._waiting[uid] = job
+            self._cond.notify()
+            return True
+
+    def remove(self, uid):
+        with self._cond:
+            return self._waiting.pop(uid, None) is not None
+
+    def is_waiting(self, uid):
+        with self._cond:
+            return uid in self._waiting
+
+    def qsize(self):
+        with self._cond:
+            return len(self._waiting)
+
+    # ----------------------- 優先度 -----------------------
+    def _client_usage(self, client, now):
+        used, updated_at = self._usage.get(client, (0.0, now))
+        used *= math.pow(0.5, (now - updated_at) / USAGE_HALF_LIFE)
+        # 実行中のジョブもそのクライアントの使用量として数える
+        for job, started_at in self._running.values():
+            if job.client == client:
+                used += now - started_at
+        return used
+
+    def _add_usage(self, client, seconds, now):
+        used, updated_at = self._usage.get(client, (0.0, now))
+        used *= math.pow(0.5, (now - updated_at) / USAGE_HALF_LIFE)
+        self._usage[client] = (used + seconds, now)
+
+    def _priority(self, job, now):
+        waited = now - job.enqueued_at
+        return job.estimate + FAIRNESS_WEIGHT * self._client_usage(job.client, now) - AGING_RATE * waited
+
+    # ----------------------- 予測 -----------------------
+    def predict(self, running_remaining=None):
+        """
+        現在の状態から各ジョブの開始・終了予定時刻を算出
+
+        Args:
+            running_remaining: uid -> 実行中ジョブの残り秒数（テレメトリのETA）。無ければ見積もりから算出
+
+        Returns:
+            uid -> { 'position', 'estimated_seconds', 'predicted_start', 'predicted_finish' }
+        """
+        running_remaining = running_remaining or {}
+        now = time.time()
+        with self._cond:
+            slot_free = []
+            result = {}
+            for uid, (job, started_at) in self._running.items():
+                remaining = running_remaining.get(uid)
+                if remaining is None:
+                    remaining = max(0.0, job.estimate - (now - started_at))
+                finish = now + remaining
+                result[uid] = {
+                    "position": None,
+                    "estimated_seconds": round(job.estimate, 1),
+                    "predicted_start": started_at,
+                    "predicted_finish": finish,
+                }
+                heapq.heappush(slot_free, finish)
+            while len(slot_free) < self.slots:
+                heapq.heappush(slot_free, now)
+
+            order = sorted(self._waiting.values(), key=lambda j: (self._priority(j, now), j.enqueued_at))
+            for position, job in enumerate(order):
+                start = heapq.heappop(slot_free)
+                finish = start + job.estimate
+                heapq.heappush(slot_free, finish)
+                result[job.uid] = {
+                    "position": position,
+                    "estimated_seconds": round(job.estimate, 1),
+                    "predicted_start": start,
+                    "predicted_finish": finish,
+                }
+        return result
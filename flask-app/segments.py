@@ -0,0 +1,389 @@
+"""
+セグメント単位のレンダリングキャッシュ / Segment-level render cache for incremental re-renders
+
+字幕の誤字を1か所直しただけでもプロジェクト全体を再レンダリングしていた。
+タイムラインを先頭から一定の長さ（RENDER_SEGMENT_SECONDS）ごとのセグメントに分け（カット位置には揃えない）、
+セグメントごとに「その時間に使われている要素」のハッシュをキーにして出力をキャッシュする。
+再投入時はキーが変わったセグメントだけを melt の in/out で描き直し、ffmpeg の concat（ストリームコピー）でつなぐ。
+
+セグメントのキーに含めるもの:
+- <profile> とレンダリングプロファイルの設定、セグメントの開始・終了フレーム
+- メインの tractor の各トラックで、セグメントと重なる entry（参照先の producer / chain / tractor を
+  フィルターや入れ子の参照ごと）と、その素材ファイルのハッシュ
+- tractor・プレイリストに付いたフィルター・トランジションのうちセグメントと重なるもの（in/out が無ければ常に）
+- subtitle_feed は字幕のキューごとに扱い、セグメントと重なるキューの文面だけを含める
+
+解釈できない構造があれば分割せずに1回でレンダリングし（チェックポイント用にはキー無しで分割）、誤った再利用はしない。
+各セグメントは独立にエンコードするため、音声はセグメントの境目で AAC のフレーム境界に揃い、数ミリ秒の無音が入ることがある。
+そのため既定では無効で、RENDER_SEGMENT_SECONDS を指定したときだけ使う。
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import xml.etree.ElementTree as ET
+
+# セグメントの長さ（秒）。既定の 0 は無効（従来どおり1回の melt で全体をレンダリング）。有効にするなら 60 程度
+SEGMENT_SECONDS = float(os.getenv("RENDER_SEGMENT_SECONDS", "0"))
+# セグメントがこの数より少なくなる短いプロジェクトは分割しない
+MIN_SEGMENTS = int(os.getenv("RENDER_MIN_SEGMENTS", "3"))
+# セグメントキャッシュの容量上限（超えたら最後に使われたのが古い順に削除）
+SEGMENT_CACHE_MAX_BYTES = int(float(os.getenv("SEGMENT_CACHE_MAX_GB", "20")) * 1024 ** 3)
+FFMPEG_COMMAND = os.getenv("FFMPEG_PATH", "ffmpeg")
+# キーの計算方法を変えたら上げる
+SEGMENT_FORMAT_VERSION = 1
+
+SERVICE_TAGS = ("producer", "chain", "playlist", "tractor")
+_VOLATILE_ROOT_ATTRIBUTES = ("root",)
+_CLOCK_PATTERN = re.compile(r"^(\d+):(\d{2}):(\d{2}(?:[.,]\d+)?)$")
+_SRT_TIMING = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{1,3})")
+
+
+def _canonical(elem, drop_properties=()) -> bytes:
+    """要素を正規化したバイト列（属性順・空白の差を吸収）。drop_properties の property は除く"""
+    if drop_properties:
+        elem = _copy_without(elem, drop_properties)
+    return ET.canonicalize(ET.tostring(elem, encoding="unicode"), strip_text=True).encode("utf-8")
+
+
+def _copy_without(elem, drop_properties):
+    copied = ET.Element(elem.tag, elem.attrib)
+    copied.text = elem.text
+    for child in elem:
+        if child.tag == "property" and child.get("name") in drop_properties:
+            continue
+        copied.append(child)
+    return copied
+
+
+def to_frames(value, fps):
+    """in/out などの値（フレーム数 または HH:MM:SS.mmm）をフレーム数に。解釈できなければ None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.lstrip("-").isdigit():
+        return int(value)
+    match = _CLOCK_PATTERN.match(value)
+    if not match or fps <= 0:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(round((int(hours) * 3600 + int(minutes) * 60 + float(seconds.replace(",", "."))) * fps))
+
+
+class _Unsupported(Exception):
+    """セグメント単位のキーを計算できない構造"""
+
+
+class _Item:
+    """タイムライン上の区間 [start, end) と、その区間のレンダリング結果に影響する内容のハッシュ"""
+
+    __slots__ = ("start", "end", "digest")
+
+    def __init__(self, start, end, digest):
+        self.start = start
+        self.end = end
+        self.digest = digest
+
+
+class TimelineIndex:
+    """MLT のメインの tractor をたどり、セグメントのキーを計算するクラス"""
+
+    def __init__(self, root, fps, base_dir: Path, member_hashes: dict):
+        self.root = root
+        self.fps = fps
+        self.base_dir = base_dir
+        self.member_hashes = member_hashes or {}
+        self.by_id = {elem.get("id"): elem for elem in root if elem.tag in SERVICE_TAGS and elem.get("id")}
+        self._fingerprints = {}
+        self.items = []     # 区間を持つ要素
+        self.global_digest = hashlib.sha256()  # 常に効く要素（<profile>、in/out の無いフィルターなど）
+        self._index()
+
+    # ----------------------- 参照先のハッシュ -----------------------
+    def _resource_digest(self, value):
+        """素材ファイルの内容ハッシュ（アップロード時の SHA-256。無ければサイズと更新時刻）"""
+        value = value.strip()
+        name = value.replace("\\", "/")
+        if name in self.member_hashes:
+            return self.member_hashes[name]
+        path = (self.base_dir / name) if not os.path.isabs(name) else Path(name)
+        try:
+            st = path.stat()
+            return f"{st.st_size}:{st.st_mtime_ns}"
+        except OSError:
+            return value
+
+    def fingerprint(self, elem_id, _stack=()):
+        """id の要素（参照している entry・track の先も含む）と素材のハッシュ"""
+        if elem_id in self._fingerprints:
+            return self._fingerprints[elem_id]
+        elem = self.by_id.get(elem_id)
+        if elem is None:
+            return f"missing:{elem_id}"
+        if elem_id in _stack:
+            raise _Unsupported(f"circular reference at {elem_id}")
+        digest = hashlib.sha256(_canonical(elem))
+        for node in elem.iter():
+            ref = node.get("producer") if node.tag in ("entry", "track") else None
+            if ref:
+                digest.update(f"\0ref\0{ref}\0{self.fingerprint(ref, _stack + (elem_id,))}".encode("utf-8"))
+            if node.tag == "property" and "resource" in (node.get("name") or "") and node.text:
+                digest.update(f"\0file\0{self._resource_digest(node.text)}".encode("utf-8"))
+        self._fingerprints[elem_id] = digest.hexdigest()
+        return self._fingerprints[elem_id]
+
+    # ----------------------- タイムラインの索引 -----------------------
+    def _range(self, elem):
+        """要素の in/out（タイムライン上のフレーム、[start, end)）。in/out が無ければ None"""
+        start, end = to_frames(elem.get("in"), self.fps), to_frames(elem.get("out"), self.fps)
+        if elem.get("in") is None and elem.get("out") is None:
+            return None
+        if (elem.get("in") is not None and start is None) or (elem.get("out") is not None and end is None):
+            raise _Unsupported(f"unreadable in/out on {elem.tag}")
+        return start or 0, end + 1 if end is not None else 1 << 62
+
+    def _add_filter(self, elem, label):
+        """フィルター・トランジション（in/out があればその区間、無ければ常に）"""
+        service = elem.find("property[@name='mlt_service']")
+        if service is not None and service.text == "subtitle_feed":
+            self._add_subtitles(elem, label)
+            return
+        frames = self._range(elem)
+        digest = hashlib.sha256(label.encode("utf-8") + _canonical(elem)).hexdigest()
+        if frames is None:
+            self.global_digest.update(digest.encode("ascii"))
+        else:
+            self.items.append(_Item(frames[0], frames[1], digest))
+
+    def _add_subtitles(self, elem, label):
+        """subtitle_feed は文面以外の設定を常に、字幕のキューはそれぞれの表示区間に含める"""
+        self.global_digest.update(label.encode("utf-8") + _canonical(elem, drop_properties=("text",)))
+        text = elem.find("property[@name='text']")
+        payload = (text.text or "") if text is not None else ""
+        for block in re.split(r"\n\s*\n", payload.replace("\r\n", "\n")):
+            if not block.strip():
+                continue
+            match = _SRT_TIMING.search(block)
+            if match is None:
+                # 時刻の無いブロックは区間が分からないので常に効くものとして扱う
+                self.global_digest.update(block.encode("utf-8"))
+                continue
+            h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(group) for group in match.groups())
+            start = int((h1 * 3600 + m1 * 60 + s1 + ms1 / 1000) * self.fps)
+            end = int((h2 * 3600 + m2 * 60 + s2 + ms2 / 1000) * self.fps) + 1
+            # キューの番号は表示に影響しないので文面と時刻だけ
+            cue = block[match.start():].strip()
+            self.items.append(_Item(start, max(end, start + 1),
+                                    hashlib.sha256(f"{label}\0{cue}".encode("utf-8")).hexdigest()))
+
+    def _add_playlist(self, playlist, label):
+        """プレイリストの entry / blank を順にたどり、entry ごとに区間を作る"""
+        self.global_digest.update(label.encode("utf-8") + _canonical(
+            ET.Element("playlist", playlist.attrib)))
+        position = 0
+        for child in playlist:
+            if child.tag == "blank":
+                length = to_frames(child.get("length"), self.fps)
+                if length is None:
+                    raise _Unsupported("unreadable blank length")
+                position += length
+            elif child.tag == "entry":
+                start, end = to_frames(child.get("in"), self.fps), to_frames(child.get("out"), self.fps)
+                if start is None or end is None:
+                    raise _Unsupported("entry without in/out")
+                length = end - start + 1
+                digest = hashlib.sha256(
+                    f"{label}\0{position}\0".encode("utf-8") + _canonical(child)
+                    + self.fingerprint(child.get("producer")).encode("ascii")).hexdigest()
+                self.items.append(_Item(position, position + length, digest))
+                position += length
+            elif child.tag == "filter":
+                self._add_filter(child, f"{label}/filter")
+            else:
+                self.global_digest.update(label.encode("utf-8") + _canonical(child))
+
+    def _index(self):
+        for elem in self.root:
+            if elem.tag not in SERVICE_TAGS:
+                # <profile> など
+                self.global_digest.update(_canonical(elem))
+        tractors = [elem for elem in self.root if elem.tag == "tractor"]
+        if not tractors:
+            raise _Unsupported("no tractor")
+        main = tractors[-1]
+        if to_frames(main.get("in"), self.fps) not in (None, 0):
+            raise _Unsupported("main tractor does not start at 0")
+        attrs = {key: value for key, value in self.root.attrib.items() if key not in _VOLATILE_ROOT_ATTRIBUTES}
+        self.global_digest.update(json.dumps(attrs, sort_keys=True).encode("utf-8"))
+        self.global_digest.update(_canonical(ET.Element("tractor", main.attrib)))
+
+        for number, child in enumerate(main):
+            label = f"tractor/{number}"
+            if child.tag == "track":
+                self.global_digest.update(label.encode("utf-8") + _canonical(child))
+                target = self.by_id.get(child.get("producer"))
+                if target is not None and target.tag == "playlist":
+                    self._add_playlist(target, label)
+                else:
+                    # プレイリスト以外のトラックは全体に効く
+                    self.global_digest.update(self.fingerprint(child.get("producer")).encode("utf-8"))
+            elif child.tag in ("filter", "transition"):
+                self._add_filter(child, label)
+            else:
+                self.global_digest.update(label.encode("utf-8") + _canonical(child))
+
+    def segment_key(self, start, end, profile_fingerprint):
+        """[start, end) のセグメントのキー"""
+        digest = hashlib.sha256(f"v{SEGMENT_FORMAT_VERSION}\0{start}\0{end}\0".encode("ascii"))
+        digest.update(profile_fingerprint.encode("utf-8"))
+        digest.update(self.global_digest.digest())
+        for item in self.items:
+            if item.start < end and item.end > start:
+                digest.update(item.digest.encode("ascii"))
+        return digest.hexdigest()
+
+
+class Segment:
+    def __init__(self, index, start, end, key):
+        self.index = index
+        self.start = start
+        self.end = end  # 含まない
+        self.key = key  # None ならキャッシュしない
+
+    @property
+    def frames(self):
+        return self.end - self.start
+
+    @property
+    def file_name(self):
+        return f"{self.index:05d}.mp4"
+
+
+def plan_segments(mlt_file: Path, total_frames: int, fps: float, member_hashes: dict,
+                  profile_fingerprint: str, segment_seconds: float = None, keyless_fallback: bool = False):
+    """
+    セグメントへの分割とキーを返す。分割しない（無効・短い・解釈できない）場合は None
+
+    Args:
+        profile_fingerprint: 出力に影響するレンダリング設定（プロファイル名・設定・出力解像度）の文字列
+        keyless_fallback: True なら解釈できない構造でも分割し、キーを None にする
+                          （キャッシュは使わず、チェックポイントのためだけに分割する）
+    """
+    segment_seconds = SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+    if segment_seconds <= 0 or not fps or total_frames <= 0:
+        return None
+    length = max(1, int(round(segment_seconds * fps)))
+    if total_frames < length * MIN_SEGMENTS:
+        return None
+    try:
+        index = TimelineIndex(ET.parse(mlt_file).getroot(), fps, Path(mlt_file).parent, member_hashes)
+    except (_Unsupported, ET.ParseError) as e:
+        if not keyless_fallback:
+            print(f"Segments: rendering {Path(mlt_file).parent.name} in one pass ({e})")
+            return None
+        print(f"Segments: not caching {Path(mlt_file).parent.name} ({e})")
+        index = None
+    segments = []
+    for number, start in enumerate(range(0, total_frames, length)):
+        end = min(total_frames, start + length)
+        key = index.segment_key(start, end, profile_fingerprint) if index is not None else None
+        segments.append(Segment(number, start, end, key))
+    return segments
+
+
+def stitch_segments(paths, output_file: Path, ffmpeg=None):
+    """セグメントの mp4 を ffmpeg の concat デマルチプレクサで再エンコードせずに連結"""
+    list_file = output_file.with_name(output_file.stem + ".segments.txt")
+    partial = output_file.with_name(output_file.stem + ".partial" + output_file.suffix)
+    list_file.write_text("".join(f"file '{Path(path).resolve().as_posix()}'\n" for path in paths),
+                         encoding="utf-8")
+    try:
+        result = subprocess.run([
+            ffmpeg or FFMPEG_COMMAND, "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file),
+            "-c", "copy", "-movflags", "+faststart", str(partial)
+        ], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg concat failed: {result.stderr.strip()[-500:]}")
+        # ダウンロード中の利用者に書き込み途中の output.mp4 を見せない
+        os.replace(partial, output_file)
+    finally:
+        list_file.unlink(missing_ok=True)
+        partial.unlink(missing_ok=True)
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_COMMAND) is not None
+
+
+class SegmentCache:
+    """
+    セグメントのキー -> mp4 を保存するディレクトリ（ジョブのセグメントとハードリンクで共有）
+
+    容量が上限を超えたら、最後に使われた（ヒットまたは保存した）のが古い順に削除する。
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes if max_bytes is not None else SEGMENT_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.directory / f"{key}.mp4"
+
+    def lookup(self, key):
+        """キャッシュ済みのセグメント（無ければ None）。ヒットしたものは最終使用時刻を更新"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, source: Path):
+        """レンダリングしたセグメントを登録（ハードリンク。別ボリュームならコピー）"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        target = self._path(key)
+        tmp = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(source, tmp)
+            except OSError:
+                shutil.copy2(source, tmp)
+            os.replace(tmp, target)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.trim()
+
+    def trim(self):
+        """容量の上限まで古いものから削除し、削除したバイト数を返す"""
+        with self._lock:
+            try:
+                entries = [(entry.stat(), entry) for entry in self.directory.glob("*.mp4")]
+            except OSError:
+                return 0
+            usage = sum(st.st_size for st, _ in entries)
+            freed = 0
+            for st, entry in sorted(entries, key=lambda item: item[0].st_mtime):
+                if usage - freed <= self.max_bytes:
+                    break
+                try:
+                    entry.unlink()
+                    freed += st.st_size
+                except OSError:
+                    pass
+            return freed
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
@@ -0,0 +1,270 @@
+"""
+レンダリング用ボリュームの容量管理 / Disk lifecycle manager for UPLOAD_FOLDER
+
+- 展開が終わった <id>.zip を即座に削除
+- レンダリング完了後、一定時間経過したジョブの入力素材（output.mp4・preview.mp4 以外）を削除
+- 使用量がクォータを超えたら、最終ダウンロードが古い順（LRU）に出力を削除
+- バックグラウンドのスイーパーが定期的に上記を実行し、回収したバイト数を記録
+"""
+
+from pathlib import Path
+import json
+import os
+import shutil
+import threading
+import time
+
+from metrics import storage_reclaimed_bytes_total, storage_usage_bytes
+
+STATE_FILE_NAME = ".storage_state.json"
+OUTPUT_FILE_NAMES = ("output.mp4", "preview.mp4")
+
+
+def _default_quota(root: Path) -> int:
+    """環境変数が無い場合はボリューム容量の90%をクォータとする"""
+    gb = os.getenv("RENDER_STORAGE_QUOTA_GB")
+    if gb:
+        return int(float(gb) * 1024 ** 3)
+    return int(shutil.disk_usage(root).total * 0.9)
+
+
+def path_size(path: Path, exclude_names=()) -> int:
+    """
+    ファイルまたはディレクトリ配下の合計バイト数（キャッシュ共有のハードリンクは1回だけ数える）
+
+    Args:
+        exclude_names: 数えないディレクトリ名
+    """
+    try:
+        if path.is_file():
+            return path.stat().st_size
+    except OSError:
+        return 0
+    total = 0
+    seen_inodes = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [name for name in dirnames if name not in exclude_names]
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen_inodes:
+                    continue
+                seen_inodes.add((st.st_dev, st.st_ino))
+            total += st.st_size
+    return total
+
+
+def reclaimable_size(path: Path) -> int:
+    """
+    path を削除したときに実際に空くバイト数
+    （キャッシュヒットの output.mp4 など、path の外からもハードリンクされているファイルは数えない）
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not path.is_dir():
+        return st.st_size if st.st_nlink <= 1 else 0
+    inodes = {}  # (dev, ino) -> [size, nlink, path 内のリンク数]
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            entry = inodes.setdefault((st.st_dev, st.st_ino), [st.st_size, st.st_nlink, 0])
+            entry[2] += 1
+    return sum(size for size, nlink, links in inodes.values() if links >= nlink)
+
+
+class StorageManager:
+    """UPLOAD_FOLDER 配下のジョブファイルのライフサイクルを管理するクラス"""
+
+    def __init__(self, root: Path, quota_bytes: int = None, input_retention_seconds: float = None,
+                 sweep_interval: float = None, is_active=None, on_evict=None, exclude_names=()):
+        """
+        Args:
+            root: UPLOAD_FOLDER
+            quota_bytes: 使用量の上限（省略時は RENDER_STORAGE_QUOTA_GB またはボリュームの90%）
+            input_retention_seconds: レンダリング完了後に入力素材を残す秒数
+            sweep_interval: スイーパーの実行間隔（秒）
+            is_active: uid を受け取り、待機中・処理中なら True を返す関数（削除対象から除外）
+            on_evict: 出力を削除したときに uid を受け取る関数（カタログからの削除など）
+            exclude_names: 使用量に数えないディレクトリ（セグメントキャッシュなど、独自の容量上限を持つもの）
+        """
+        self.root = root
+        self.quota_bytes = quota_bytes if quota_bytes is not None else _default_quota(root)
+        self.input_retention_seconds = (
+            input_retention_seconds if input_retention_seconds is not None
+            else float(os.getenv("RENDER_INPUT_RETENTION_HOURS", "24")) * 3600
+        )
+        self.sweep_interval = (
+            sweep_interval if sweep_interval is not None
+            else float(os.getenv("RENDER_SWEEP_INTERVAL_SECONDS", "300"))
+        )
+        self.is_active = is_active or (lambda uid: False)
+        self.on_evict = on_evict or (lambda uid: None)
+        self.exclude_names = tuple(exclude_names)
+
+        self._lock = threading.Lock()
+        self._state_path = root / STATE_FILE_NAME
+        self._jobs = self._load_state()  # uid -> { 'finished_at': ..., 'last_download': ..., 'inputs_removed': bool }
+        self._thread = None
+        self.stats = {
+            "quota_bytes": self.quota_bytes,
+            "usage_bytes": None,
+            "reclaimed_bytes_total": 0,
+            "last_sweep_at": None,
+            "last_sweep_reclaimed_bytes": 0,
+            "evicted_outputs_total": 0,
+        }
+
+    # ----------------------- イベント -----------------------
+    def on_extracted(self, uid: str):
+        """展開完了：元の zip を削除"""
+        zip_path = self.root / f"{uid}.zip"
+        self._reclaim(zip_path)
+
+    def on_render_finished(self, uid: str):
+        with self._lock:
+            self._jobs.setdefault(uid, {})["finished_at"] = time.time()
+            self._save_state()
+
+    def on_download(self, uid: str):
+        with self._lock:
+            self._jobs.setdefault(uid, {})["last_download"] = time.time()
+            self._save_state()
+
+    # ----------------------- スイーパー -----------------------
+    def start(self):
+        """スイーパースレッドを起動（重複起動を防ぐ）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._thread.start()
+        print(f"Storage sweeper started (quota: {self.quota_bytes / 1024 ** 3:.1f}GB)")
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Storage sweeper error: {e}")
+            time.sleep(self.sweep_interval)
+
+    def sweep(self) -> int:
+        """1回分の掃除を行い、回収したバイト数を返す"""
+        reclaimed = 0
+        now = time.time()
+
+        for entry in list(self.root.iterdir()):
+            name = entry.name
+            if name.startswith("."):
+                continue
+            uid = name[:-4] if name.endswith(".zip") else name
+            if self.is_active(uid):
+                continue
+
+            # 展開済み（ディレクトリがある）ジョブの zip が残っていれば削除
+            if entry.is_file() and name.endswith(".zip") and (self.root / uid).is_dir():
+                reclaimed += self._reclaim(entry)
+                continue
+
+            # レンダリング完了から一定時間経過したジョブの入力素材を削除
+            if entry.is_dir():
+                info = self._jobs.get(uid, {})
+                finished_at = info.get("finished_at")
+                if finished_at and not info.get("inputs_removed") and now - finished_at >= self.input_retention_seconds:
+                    reclaimed += self._remove_inputs(entry)
+                    with self._lock:
+                        self._jobs.setdefault(uid, {})["inputs_removed"] = True
+
+        usage = path_size(self.root, self.exclude_names)
+        if usage > self.quota_bytes:
+            evicted = self._evict_outputs(usage - self.quota_bytes)
+            reclaimed += evicted
+            usage -= evicted
+
+        with self._lock:
+            self._save_state()
+            self.stats["usage_bytes"] = usage
+            self.stats["last_sweep_at"] = now
+            self.stats["last_sweep_reclaimed_bytes"] = reclaimed
+        storage_usage_bytes.set(usage)
+        if reclaimed:
+            print(f"Storage sweep reclaimed {reclaimed / 1024 ** 2:.1f}MB (usage: {usage / 1024 ** 3:.2f}GB)")
+        return reclaimed
+
+    def _evict_outputs(self, bytes_needed: int) -> int:
+        """最終ダウンロード（無ければ完了時刻）が古い順にジョブディレクトリを削除"""
+        candidates = []
+        for entry in self.root.iterdir():
+            if not entry.is_dir() or entry.name.startswith(".") or self.is_active(entry.name):
+                continue
+            info = self._jobs.get(entry.name, {})
+            last_used = info.get("last_download") or info.get("finished_at")
+            if last_used is None:
+                try:
+                    last_used = entry.stat().st_mtime
+                except OSError:
+                    continue
+            candidates.append((last_used, entry))
+
+        freed = 0
+        for _, entry in sorted(candidates, key=lambda c: c[0]):
+            if freed >= bytes_needed:
+                break
+            freed += self._reclaim(entry)
+            with self._lock:
+                self._jobs.pop(entry.name, None)
+                self.stats["evicted_outputs_total"] += 1
+            self.on_evict(entry.name)
+            print(f"Storage: evicted {entry.name}")
+        return freed
+
+    def _remove_inputs(self, job_dir: Path) -> int:
+        freed = 0
+        for child in job_dir.iterdir():
+            if child.name not in OUTPUT_FILE_NAMES:
+                freed += self._reclaim(child)
+        return freed
+
+    def _reclaim(self, path: Path) -> int:
+        """path を削除して回収したバイト数を返す（他からハードリンクされて残るファイルは含めない）"""
+        if not path.exists():
+            return 0
+        size = reclaimable_size(path)
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except OSError as e:
+            print(f"Storage: failed to remove {path}: {e}")
+            return 0
+        with self._lock:
+            self.stats["reclaimed_bytes_total"] += size
+        storage_reclaimed_bytes_total.inc(size)
+        return size
+
+    # ----------------------- 状態の永続化 -----------------------
+    def _load_state(self):
+        try:
+            return json.loads(self._state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp = self._state_path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(self._jobs), encoding="utf-8")
+            os.replace(tmp, self._state_path)
+        except OSError as e:
+            print(f"Storage: failed to save state: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# flask-app のモジュール（ingest など）をパッケージ化せずに import できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
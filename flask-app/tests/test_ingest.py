@@ -0,0 +1,135 @@
+"""
+ストリーム経路のZIP展開（ingest._ingest_zip）のテスト
+
+zipfile で作ったアーカイブを ingest_stream に流し、extract_zip と同じ内容・ハッシュになることを確認する。
+"""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+from ingest import IngestError, extract_zip, ingest_stream
+
+MEMBERS = {
+    "project.mlt": b"<mlt>" + b"<producer/>" * 2000 + b"</mlt>",
+    "media/clip.mp4": os.urandom(300_000),
+    "media/サムネイル.png": b"\x89PNG" + bytes(range(256)) * 100,
+    "empty.txt": b"",
+}
+
+
+class _NonSeekable(io.RawIOBase):
+    """シークできない出力先（zipfile がデータディスクリプタ付きで書き出す）"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def _build_zip(streaming=False, zip64=False, members=MEMBERS, compression=zipfile.ZIP_DEFLATED):
+    output = _NonSeekable() if streaming else io.BytesIO()
+    with zipfile.ZipFile(output, "w", compression=compression) as zf:
+        zf.writestr(zipfile.ZipInfo("media/"), b"")
+        for name, data in members.items():
+            info = zipfile.ZipInfo(name)
+            info.compress_type = compression
+            with zf.open(info, "w", force_zip64=zip64) as dst:
+                dst.write(data)
+    return (output.buffer if streaming else output).getvalue()
+
+
+def _local_flags(archive):
+    """各ローカルファイルヘッダの汎用フラグ"""
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        return [info.flag_bits for info in zf.infolist()]
+
+
+class _ChunkedStream:
+    """request.stream のように少しずつ返すストリーム"""
+
+    def __init__(self, data, chunk=7_777):
+        self.data = io.BytesIO(data)
+        self.chunk = chunk
+
+    def read(self, size=-1):
+        return self.data.read(self.chunk if size is None or size < 0 else min(size, self.chunk))
+
+
+def _ingest(archive, extract_dir):
+    return ingest_stream(_ChunkedStream(archive), extract_dir, "zip")
+
+
+def _assert_matches_extract_zip(archive, tmp_path):
+    received, hashes = _ingest(archive, tmp_path / "stream")
+    zip_path = tmp_path / "upload.zip"
+    zip_path.write_bytes(archive)
+    expected = extract_zip(zip_path, tmp_path / "saved")
+
+    assert received == len(archive)
+    assert hashes == expected
+    assert set(hashes) == set(MEMBERS)
+    for name, data in MEMBERS.items():
+        assert (tmp_path / "stream" / name).read_bytes() == data
+    assert (tmp_path / "stream" / "media").is_dir()
+
+
+def test_plain_zip_matches_extract_zip(tmp_path):
+    archive = _build_zip()
+    assert not any(flags & 0x08 for flags in _local_flags(archive))
+    _assert_matches_extract_zip(archive, tmp_path)
+
+
+def test_data_descriptors(tmp_path):
+    archive = _build_zip(streaming=True)
+    assert all(flags & 0x08 for flags in _local_flags(archive)[1:])
+    _assert_matches_extract_zip(archive, tmp_path)
+
+
+@pytest.mark.parametrize("streaming", [False, True], ids=["sizes_in_extra", "zip64_descriptor"])
+def test_zip64(tmp_path, streaming):
+    archive = _build_zip(streaming=streaming, zip64=True)
+    # ローカルヘッダに zip64 拡張フィールド（ID 0x0001）が入っていること
+    assert b"\x01\x00\x10\x00" in archive
+    _assert_matches_extract_zip(archive, tmp_path)
+
+
+def test_stored_members(tmp_path):
+    archive = _build_zip(compression=zipfile.ZIP_STORED)
+    _assert_matches_extract_zip(archive, tmp_path)
+
+
+def test_stored_members_with_data_descriptors_are_rejected(tmp_path):
+    archive = _build_zip(streaming=True, compression=zipfile.ZIP_STORED)
+    with pytest.raises(IngestError, match="data descriptors"):
+        _ingest(archive, tmp_path / "stream")
+
+
+@pytest.mark.parametrize("name", ["../evil.txt", "media/../../evil.txt", "/etc/../../evil.txt"])
+def test_rejects_paths_outside_extract_dir(tmp_path, name):
+    archive = _build_zip(members={"project.mlt": b"<mlt/>", name: b"x"})
+    extract_dir = tmp_path / "jobs" / "job"
+    with pytest.raises(IngestError, match="Unsafe path"):
+        _ingest(archive, extract_dir)
+    assert not (tmp_path / "jobs" / "evil.txt").exists()
+    assert not (tmp_path / "evil.txt").exists()
+
+
+def test_crc_mismatch(tmp_path):
+    archive = bytearray(_build_zip(compression=zipfile.ZIP_STORED, members={"project.mlt": b"<mlt/>"}))
+    offset = archive.index(b"<mlt/>")
+    archive[offset] ^= 0xFF
+    with pytest.raises(IngestError, match="CRC mismatch"):
+        _ingest(bytes(archive), tmp_path / "stream")
+
+
+def test_truncated_upload(tmp_path):
+    archive = _build_zip(streaming=True)
+    with pytest.raises(IngestError):
+        _ingest(archive[: len(archive) // 2], tmp_path / "stream")
@@ -0,0 +1,204 @@
+"""
+専用アップロード受信サーバー / Dedicated non-blocking upload receiver
+
+gunicorn（gthread, threads=4）の /upload は1アップロードにつき1スレッドを占有するため、
+遅い大容量アップロードが4本あると /status やダウンロードが応答しなくなる。
+このモジュールは asyncio で別ポートを待ち受け、多数の同時アップロードを1スレッドで受信する。
+
+- Content-Length からファイルを事前確保（posix_fallocate）して断片化を防ぐ
+- 受信データは大きなバッファにまとめ、書き込みはスレッドプールで行う（イベントループを止めない）
+- 受信完了後のジョブ登録は app.py から渡されたコールバックで行う（/upload と同じ処理）
+
+    POST /upload  ヘッダーは /upload と同じ（X-Filename, X-Render-Profile）。Content-Length 必須
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import json
+import os
+import threading
+import time
+
+UPLOAD_RECEIVER_PORT = int(os.getenv("UPLOAD_RECEIVER_PORT", "5001"))
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024   # この量がたまったらまとめて書き込む
+READ_SIZE = 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+HEADER_TIMEOUT = 30
+# 受信が途絶えてからこの秒数で接続を切る
+IDLE_TIMEOUT = float(os.getenv("UPLOAD_RECEIVER_IDLE_TIMEOUT", "300"))
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+            422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+class UploadRejected(Exception):
+    """アップロードを受け付けない場合の例外（status と JSON 本文を持つ）"""
+
+    def __init__(self, status, body):
+        super().__init__(body.get("message"))
+        self.status = status
+        self.body = body
+
+
+class UploadReceiver:
+    """asyncio でアップロードを受信するサーバー（バックグラウンドスレッドで動作）"""
+
+    def __init__(self, begin_upload, finish_upload, abort_upload, host="0.0.0.0", port=None,
+                 max_content_length=None):
+        """
+        Args:
+            begin_upload: (headers, client_ip, content_length) -> (unique_id, 保存先Path)。
+                          受け付けない場合は UploadRejected を送出
+            finish_upload: (unique_id, upload_bytes, upload_seconds) -> (status, JSON本文)
+            abort_upload: (unique_id) -> None（受信失敗時の後始末）
+            max_content_length: 受け付ける最大サイズ（バイト）
+        """
+        self.begin_upload = begin_upload
+        self.finish_upload = finish_upload
+        self.abort_upload = abort_upload
+        self.host = host
+        self.port = port if port is not None else UPLOAD_RECEIVER_PORT
+        self.max_content_length = max_content_length
+        self._writer_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload-writer")
+        self._thread = None
+        self.active_uploads = 0
+
+    def start(self):
+        """受信スレッドを起動（重複起動を防ぐ）"""
+        if self._thread is not None:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait(5)
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES))
+        print(f"Upload receiver listening on {self.host}:{self.port}")
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+
+    # ----------------------- HTTP処理 -----------------------
+    async def _handle(self, reader, writer):
+        try:
+            status, body = await self._handle_request(reader, writer)
+        except UploadRejected as e:
+            status, body = e.status, e.body
+        except asyncio.LimitOverrunError:
+            status, body = 400, {"status": "error", "message": "Request header too large"}
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"Upload receiver: connection dropped: {e!r}")
+            writer.close()
+            return
+        except Exception as e:
+            status, body = 500, {"status": "error", "message": f"Error saving file: {str(e)}"}
+        await self._respond(writer, status, body)
+
+    async def _read_headers(self, reader):
+        raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+        lines = raw.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise UploadRejected(400, {"status": "error", "message": "Malformed request line"})
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, path.split("?", 1)[0], headers
+
+    async def _handle_request(self, reader, writer):
+        method, path, headers = await self._read_headers(reader)
+        if path != "/upload":
+            raise UploadRejected(404, {"status": "error", "message": "Not found"})
+        if method not in ("POST", "PUT"):
+            raise UploadRejected(405, {"status": "error", "message": "Use POST /upload"})
+        if headers.get("transfer-encoding", "").lower() == "chunked" or "content-length" not in headers:
+            raise UploadRejected(411, {"status": "error", "message": "Content-Length is required"})
+        try:
+            content_length = int(headers["content-length"])
+        except ValueError:
+            raise UploadRejected(400, {"status": "error", "message": "Invalid Content-Length"})
+        if self.max_content_length is not None and content_length > self.max_content_length:
+            raise UploadRejected(413, {"status": "error", "message": "File too large"})
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        peer = writer.get_extra_info("peername")
+        client_ip = headers.get("x-forwarded-for", "").split(",")[0].strip() or (peer[0] if peer else "")
+        unique_id, filepath = self.begin_upload(headers, client_ip, content_length)
+
+        upload_start = time.time()
+        self.active_uploads += 1
+        try:
+            received = await self._receive_to_file(reader, filepath, content_length)
+        except BaseException:
+            self.abort_upload(unique_id)
+            raise
+        finally:
+            self.active_uploads -= 1
+        upload_seconds = time.time() - upload_start
+        # 事前検査（zip のセントラルディレクトリと MLT の解析）と見積もりは時間がかかるので、
+        # イベントループを止めないよう別スレッドで実行（受信中の他のアップロードを待たせない）
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.finish_upload, unique_id, received, upload_seconds)
+
+    async def _receive_to_file(self, reader, filepath: Path, content_length):
+        """Content-Length バイトを受信してファイルに書き込む"""
+        loop = asyncio.get_running_loop()
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if content_length and hasattr(os, "posix_fallocate"):
+                try:
+                    await loop.run_in_executor(self._writer_pool, os.posix_fallocate, fd, 0, content_length)
+                except OSError as e:
+                    print(f"Upload receiver: preallocation skipped: {e}")
+
+            buffer = bytearray()
+            received = 0
+            while received < content_length:
+                chunk = await asyncio.wait_for(
+                    reader.read(min(READ_SIZE, content_length - received)), IDLE_TIMEOUT)
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", content_length - received)
+                buffer += chunk
+                received += len(chunk)
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    data, buffer = bytes(buffer), bytearray()
+                    await loop.run_in_executor(self._writer_pool, _write_all, fd, data)
+            if buffer:
+                await loop.run_in_executor(self._writer_pool, _write_all, fd, bytes(buffer))
+            return received
+        finally:
+            os.close(fd)
+
+    async def _respond(self, writer, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n")
+        try:
+            writer.write(head.encode("latin-1") + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
@@ -0,0 +1,176 @@
+"""
+常駐 Xvfb ディスプレイのプール / Pool of long-lived Xvfb displays
+
+`xvfb-run -a melt ...` はジョブごとに X サーバーを起動するため数秒の起動時間がかかり、
+同時レンダリングでは `-a` の空きディスプレイ探索が競合しやすい。
+レンダリング枠ごとに Xvfb を1つ常駐させ、melt は DISPLAY を設定して直接起動する。
+
+- acquire() の時点でディスプレイの状態（プロセス生存・X11 ソケットへの接続）を確認し、異常なら再起動
+- 使用中のディスプレイは他のジョブに渡さない（1ディスプレイ = 1レンダリング枠）
+- XVFB_POOL=0 で従来の xvfb-run -a に戻す
+"""
+
+import atexit
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+from render_watchdog import TMP_DIR, kill_process_group
+
+XVFB_POOL_ENABLED = os.getenv("XVFB_POOL", "1").lower() not in ("0", "false", "no", "off")
+XVFB_DISPLAY_BASE = int(os.getenv("XVFB_DISPLAY_BASE", "99"))
+XVFB_SCREEN = os.getenv("XVFB_SCREEN", "1280x1024x24")
+XVFB_COMMAND = os.getenv("XVFB_PATH", "Xvfb")
+
+START_TIMEOUT = 10.0  # Xvfb がソケットを作るまで待つ秒数
+MAX_DISPLAY_SEARCH = 100
+
+
+def _socket_path(number, tmp_dir=TMP_DIR):
+    return tmp_dir / ".X11-unix" / f"X{number}"
+
+
+def _display_in_use(number, tmp_dir=TMP_DIR):
+    return (tmp_dir / f".X{number}-lock").exists() or _socket_path(number, tmp_dir).exists()
+
+
+class XvfbDisplay:
+    """常駐する Xvfb 1つ分"""
+
+    def __init__(self, number, screen=XVFB_SCREEN, command=XVFB_COMMAND):
+        self.number = number
+        self.screen = screen
+        self.command = command
+        self.proc = None
+        self.restarts = 0
+        self.jobs = 0
+
+    @property
+    def name(self):
+        return f":{self.number}"
+
+    def start(self):
+        """Xvfb を起動し、X11 ソケットに接続できるまで待つ"""
+        self.proc = subprocess.Popen(
+            [self.command, self.name, "-screen", "0", self.screen, "-nolisten", "tcp", "-noreset"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.healthy():
+                return
+            if self.proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Xvfb {self.name} did not start")
+
+    def stop(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                kill_process_group(self.proc, grace=2.0)
+            self.proc.wait()
+            # 異常終了した Xvfb が残したロックとソケットを削除（同じ番号で再起動できるように）
+            for path in (TMP_DIR / f".X{self.number}-lock", _socket_path(self.number)):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+        self.proc = None
+
+    def healthy(self):
+        """プロセスが生きていて X11 ソケットが接続を受け付けるか"""
+        if self.proc is None or self.proc.poll() is not None:
+            return False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(1.0)
+                sock.connect(str(_socket_path(self.number)))
+            return True
+        except OSError:
+            return False
+
+    def restart(self):
+        print(f"Xvfb pool: restarting display {self.name}")
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+
+class XvfbPool:
+    """レンダリング枠ごとに Xvfb を常駐させるプール"""
+
+    def __init__(self, size, display_base=None, screen=XVFB_SCREEN, command=XVFB_COMMAND):
+        self.size = size
+        self.display_base = display_base if display_base is not None else XVFB_DISPLAY_BASE
+        self.screen = screen
+        self.command = command
+        self.displays = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """空いているディスプレイ番号で Xvfb を size 個起動（重複起動を防ぐ）"""
+        with self._lock:
+            if self._started:
+                return
+            number = self.display_base
+            while len(self.displays) < self.size and number < self.display_base + MAX_DISPLAY_SEARCH:
+                if not _display_in_use(number):
+                    display = XvfbDisplay(number, self.screen, self.command)
+                    display.start()
+                    self.displays.append(display)
+                    self._idle.put(display)
+                number += 1
+            if len(self.displays) < self.size:
+                raise RuntimeError(f"Xvfb pool: only {len(self.displays)} of {self.size} displays available")
+            self._started = True
+            atexit.register(self.stop)
+        print(f"Xvfb pool: {', '.join(d.name for d in self.displays)}")
+
+    def stop(self):
+        for display in self.displays:
+            display.stop()
+
+    def acquire(self, timeout=None):
+        """空いているディスプレイを取得（異常なら再起動してから渡す）"""
+        display = self._idle.get(timeout=timeout)
+        try:
+            if not display.healthy():
+                display.restart()
+        except Exception:
+            self._idle.put(display)
+            raise
+        display.jobs += 1
+        return display
+
+    def release(self, display):
+        self._idle.put(display)
+
+    def get_stats(self):
+        return {
+            "displays": [
+                {"display": d.name, "healthy": d.healthy(), "jobs": d.jobs, "restarts": d.restarts}
+                for d in self.displays
+            ],
+            "idle": self._idle.qsize(),
+        }
+
+
+def melt_launch(pool, cmd, timeout=None):
+    """
+    melt の起動コマンドと環境変数を用意する
+
+    pool があれば空きディスプレイを確保して DISPLAY を設定し、無ければ xvfb-run -a を前置する。
+
+    Returns:
+        (cmd, env, display)。display は melt 終了後に pool.release() へ返す（xvfb-run 時は None）
+    """
+    if pool is None:
+        return ["xvfb-run", "-a"] + list(cmd), None, None
+    display = pool.acquire(timeout=timeout)
+    return list(cmd), dict(os.environ, DISPLAY=display.name), display
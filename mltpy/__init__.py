@@ -21,6 +21,7 @@ Basic usage:
 
 from .editor import MLTEditor
 from .packager import MLTDataPackager
+from .downloader import RangeDownloader
 from .media import MediaUtils
 from .cli import CLIParser
 from .exceptions import (
@@ -38,6 +39,7 @@ __email__ = "your.email@example.com"
 __all__ = [
     "MLTEditor",
     "MLTDataPackager",
+    "RangeDownloader",
     "MediaUtils", 
     "CLIParser",
     "CLIApp",
@@ -0,0 +1,230 @@
+"""
+mltpy.benchmark - MLTEditor のベンチマーク / Benchmark suite for MLTEditor
+
+合成MLT（mltpy.corpus）を規模別に生成し、MLTEditor の主な処理の所要時間とピークメモリを計測する。
+結果は JSON に保存し、別のコミットで取った結果と --compare で比較できる。
+
+    python -m mltpy.benchmark                                   # 1k / 10k / 100k、結果は mltpy-bench.json
+    python -m mltpy.benchmark --scales 1000 10000 --repeat 5 --output after.json --compare before.json
+
+- 時間: 各処理を repeat 回、毎回読み込み直したエディターで実行（読み込み自体は計測に含めない）
+- メモリ: 別の1回を tracemalloc 付きで実行した Python ヒープのピーク（時間の計測には tracemalloc を使わない）と、
+  プロセスの最大RSS（lxml のツリーは C 側で確保されるため tracemalloc には現れない）
+- 処理ごとに新しいプロセスで計測し、前の処理のメモリやキャッシュの影響を受けないようにする
+"""
+
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import gc
+import io
+import json
+import multiprocessing
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from lxml import etree
+
+from .corpus import CorpusSpec, write_corpus
+from .editor import MLTEditor
+
+OPERATIONS = (
+    "_load_mlt",
+    "extract_srt_data",
+    "wrap_srt_lines",
+    "wrap_dynamictext_lines",
+    "modify_qtcrop_color",
+    "save",
+)
+DEFAULT_SCALES = (1000, 10000, 100000)
+RESULT_FORMAT_VERSION = 1
+
+
+def _max_rss_bytes() -> Optional[int]:
+    """プロセスの最大RSS（resource モジュールの無い Windows では None）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _run_operation(editor: MLTEditor, operation: str, out_dir: Path):
+    if operation == "save":
+        editor.save(out_dir / "saved.mlt")
+    else:
+        getattr(editor, operation)()
+
+
+def measure(mlt_path: Path, operation: str, repeat: int, out_dir: Path) -> Dict:
+    """mlt_path に対して operation を計測する（エディターの出力メッセージは捨てる）"""
+    runs: List[float] = []
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            editor = MLTEditor(mlt_path)
+            gc.collect()
+            started = time.perf_counter()
+            _run_operation(editor, operation, out_dir)
+            runs.append(time.perf_counter() - started)
+            del editor
+
+        editor = MLTEditor(mlt_path)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            _run_operation(editor, operation, out_dir)
+            _, python_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        "runs_s": [round(value, 6) for value in runs],
+        "median_s": round(statistics.median(runs), 6),
+        "min_s": round(min(runs), 6),
+        "python_peak_bytes": python_peak,
+        "max_rss_bytes": _max_rss_bytes(),
+    }
+
+
+def _measure_task(args):
+    mlt_path, operation, repeat, out_dir = args
+    return measure(Path(mlt_path), operation, repeat, Path(out_dir))
+
+
+def _git_revision() -> Dict:
+    """計測したコードのコミット（git が無い・リポジトリ外なら None）"""
+    root = Path(__file__).resolve().parent.parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "mltpy"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def run_suite(scales, operations=OPERATIONS, repeat: int = 3, corpus_dir: Optional[Path] = None,
+              seed: int = 0, isolate: bool = True) -> Dict:
+    """
+    規模ごとに合成MLTを用意して各処理を計測し、結果の dict を返す
+
+    Args:
+        corpus_dir: 合成MLTの保存先（同じ規模・seed のファイルがあれば再利用）。省略時は一時ディレクトリ
+        isolate: True なら処理ごとに新しいプロセスで計測
+    """
+    temp = None
+    if corpus_dir is None:
+        temp = tempfile.TemporaryDirectory(prefix="mltpy-bench-")
+        corpus_dir = Path(temp.name)
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    out_dir = Path(tempfile.mkdtemp(prefix="mltpy-bench-out-"))
+
+    report = {
+        "format": RESULT_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **_git_revision(),
+        "python": platform.python_version(),
+        "lxml": ".".join(str(part) for part in etree.LXML_VERSION),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": [],
+    }
+    # spawn: fork だと親が読み込んだツリーの分まで最大RSSに含まれる
+    pool = multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) if isolate else None
+    try:
+        for scale in scales:
+            spec = CorpusSpec.for_scale(scale, seed=seed)
+            mlt_path = corpus_dir / f"corpus_{scale}_s{seed}.mlt"
+            if not mlt_path.exists():
+                started = time.perf_counter()
+                write_corpus(mlt_path, spec)
+                print(f"Generated {mlt_path.name} ({mlt_path.stat().st_size / (1024 ** 2):.1f}MB) "
+                      f"in {time.perf_counter() - started:.1f}s")
+            for operation in operations:
+                task = (str(mlt_path), operation, repeat, str(out_dir))
+                result = pool.apply(_measure_task, (task,)) if pool else _measure_task(task)
+                report["results"].append(dict(scale=scale, operation=operation, **result,
+                                              corpus_bytes=mlt_path.stat().st_size, spec=spec.as_dict()))
+                rss = result["max_rss_bytes"]
+                print(f"  {scale:>7}  {operation:<24} {result['median_s'] * 1000:>10.1f} ms"
+                      f"  heap {result['python_peak_bytes'] / (1024 ** 2):>7.1f} MB"
+                      + (f"  rss {rss / (1024 ** 2):>7.1f} MB" if rss else ""))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if temp is not None:
+            temp.cleanup()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return report
+
+
+def compare(current: Dict, baseline: Dict) -> List[Dict]:
+    """同じ規模・処理どうしの中央値とピークメモリの比（current / baseline）"""
+    previous = {(row["scale"], row["operation"]): row for row in baseline.get("results", [])}
+    rows = []
+    for row in current["results"]:
+        base = previous.get((row["scale"], row["operation"]))
+        if base is None:
+            continue
+        rows.append({
+            "scale": row["scale"],
+            "operation": row["operation"],
+            "baseline_s": base["median_s"],
+            "current_s": row["median_s"],
+            "time_ratio": round(row["median_s"] / base["median_s"], 3) if base["median_s"] else None,
+            "memory_ratio": (round(row["python_peak_bytes"] / base["python_peak_bytes"], 3)
+                             if base.get("python_peak_bytes") else None),
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MLTEditor on synthetic Shotcut projects")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="Corpus sizes (clips / subtitle cues)")
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS), choices=OPERATIONS,
+                        help="Operations to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per operation")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--corpus-dir", type=Path, default=None, help="Keep generated corpora here and reuse them")
+    parser.add_argument("--output", type=Path, default=Path("mltpy-bench.json"), help="Result JSON")
+    parser.add_argument("--compare", type=Path, default=None, help="Baseline result JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="With --compare, exit 1 if any time ratio exceeds this (e.g. 1.2)")
+    parser.add_argument("--in-process", action="store_true", help="Measure everything in this process")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.scales, args.operations, args.repeat, args.corpus_dir, args.seed,
+                       isolate=not args.in_process)
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Results written to {args.output}")
+
+    if args.compare is None:
+        return 0
+    rows = compare(report, json.loads(args.compare.read_text(encoding="utf-8")))
+    print(f"{'scale':>7}  {'operation':<24} {'before ms':>10} {'after ms':>10} {'time':>7} {'memory':>7}")
+    for row in rows:
+        print(f"{row['scale']:>7}  {row['operation']:<24} {row['baseline_s'] * 1000:>10.1f} "
+              f"{row['current_s'] * 1000:>10.1f} {row['time_ratio'] or 0:>6.2f}x {row['memory_ratio'] or 0:>6.2f}x")
+    if args.max_regression is not None:
+        worst = max((row["time_ratio"] or 0 for row in rows), default=0)
+        if worst > args.max_regression:
+            print(f"RESULT: slowest operation is {worst:.2f}x the baseline (limit {args.max_regression:.2f}x)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,9 @@
 
 import argparse
+import sys
 from mltpy.editor import MLTEditor
 from mltpy import MLTDataPackager
+from mltpy.profiling import profiler
 
 class CLIParser:
     @staticmethod
@@ -92,6 +94,64 @@ class CLIParser:
             help='Render on cloud / クラウドでレンダリングする (Test version)'
         )
 
+        parser.add_argument(
+            '--render-profile',
+            type=str,
+            default=None,
+            help='Cloud render profile such as draft or final (default: server default) / '
+                 'クラウドレンダリングのプロファイル（draft, final など。省略時はサーバ既定）'
+        )
+
+        parser.add_argument(
+            '--preview',
+            action='store_true',
+            help='Render a low-resolution preview before the full cloud render / '
+                 '本レンダリングの前に低解像度のプレビューを出力する'
+        )
+
+        parser.add_argument(
+            '--progressive',
+            action='store_true',
+            help='Write a fragmented MP4 that can be downloaded while it renders / '
+                 'レンダリング中からダウンロードできる断片化MP4で出力する'
+        )
+
+        parser.add_argument(
+            '--trim-media',
+            action='store_true',
+            help='Upload only the used ranges of video files (needs ffmpeg and ffprobe) / '
+                 '動画素材のうちタイムラインで使う範囲だけを切り出してアップロード（ffmpeg と ffprobe が必要）'
+        )
+
+        parser.add_argument(
+            '--trim-handle',
+            type=float,
+            default=1.0,
+            help='Seconds kept before and after each used range with --trim-media (default: 1.0) / '
+                 '--trim-media で使用範囲の前後に残す秒数（デフォルト: 1.0）'
+        )
+
+        parser.add_argument(
+            '--proxy',
+            action='store_true',
+            help='Upload low-resolution proxies instead of the original media for a draft render / '
+                 'ドラフト用に素材を低解像度のプロキシに差し替えてアップロード'
+        )
+
+        parser.add_argument(
+            '--proxy-height',
+            type=int,
+            default=540,
+            help='Project height used with --proxy (default: 540) / --proxy 時のプロジェクトの高さ（デフォルト: 540）'
+        )
+
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Record per-stage timings, cProfile output and peak memory to <project>.profile.json/.txt / '
+                 '処理段階ごとの時間・cProfile・ピークメモリを <プロジェクト名>.profile.json/.txt に記録する'
+        )
+
         return parser.parse_args(args)
 
 class CLIApp:
@@ -99,6 +159,10 @@ class CLIApp:
         self.args = args
     
     def run(self):
+        with profiler.session(self.args.input_path, enabled=self.args.profile):
+            self._run()
+
+    def _run(self):
         editor = MLTEditor(self.args.input_path)
 
         if self.args.wrap_subtitles:
@@ -114,14 +178,24 @@ class CLIApp:
             editor.modify_qtcrop_color()
 
         if self.args.cloud_render:
-            packager = MLTDataPackager(self.args.input_path)
-            zip_path = packager.prepare_zip()  # data.zip を生成
-            status, text = packager.upload()  # アップロード
+            # 編集済みのツリーをそのままパッケージ（保存・再読み込みしない）
+            packager = MLTDataPackager(editor)
+            zip_path = packager.prepare_zip(trim=self.args.trim_media, trim_handle=self.args.trim_handle,
+                                            proxy=self.args.proxy, proxy_height=self.args.proxy_height)  # data.zip を生成
+            status, text = packager.upload(render_profile=self.args.render_profile, preview=self.args.preview,
+                                           progressive=self.args.progressive)  # アップロード
             print(zip_path, status, text)
         else:
             editor.save()
 
 def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    # サブコマンド: mltpy watch ...（保存のたびに差分で再適用）
+    if args and args[0] == "watch":
+        from mltpy.watch import main as watch_main
+        return watch_main(args[1:])
+
     parsed_args = CLIParser.parse_arguments(args)
     app = CLIApp(parsed_args)
     app.run()
@@ -0,0 +1,191 @@
+"""
+mltpy.corpus - ベンチマーク用の合成MLT / Synthetic Shotcut-style MLT documents for benchmarks
+
+Shotcut が書き出すものと同じ構造（producer / chain / playlist / tractor と各種フィルター）の
+MLT を、要素数を指定して生成する。素材ファイルは作らない（resource は存在しないパス）。
+
+    from mltpy.corpus import CorpusSpec, write_corpus
+    write_corpus("bench_10k.mlt", CorpusSpec.for_scale(10_000))
+"""
+
+from pathlib import Path
+from typing import List, Union
+from xml.sax.saxutils import escape
+import random
+
+FPS = 25
+# 字幕・テキストの文面に使う単語（折り返しが発生するよう長めの行を作る）
+WORDS = ("the quick brown fox jumps over a lazy dog while the camera slowly pans across "
+         "an empty street at dawn and somebody in the distance calls out a name").split()
+
+
+def _timecode(frames: int) -> str:
+    seconds, frame = divmod(frames, FPS)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}.{frame * 1000 // FPS:03}"
+
+
+def _srt_time(ms: int) -> str:
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{ms:03}"
+
+
+class CorpusSpec:
+    """生成する MLT の要素数"""
+
+    def __init__(self, producers: int = 500, chains: int = 500, playlists: int = 4,
+                 subtitle_filters: int = 1, cues_per_subtitle: int = 1000,
+                 dynamictext_filters: int = 250, qtcrop_filters: int = 250,
+                 line_length: int = 120, seed: int = 0):
+        self.producers = producers
+        self.chains = chains
+        self.playlists = max(1, playlists)
+        self.subtitle_filters = subtitle_filters
+        self.cues_per_subtitle = cues_per_subtitle
+        self.dynamictext_filters = dynamictext_filters
+        self.qtcrop_filters = qtcrop_filters
+        self.line_length = line_length
+        self.seed = seed
+
+    @classmethod
+    def for_scale(cls, scale: int, seed: int = 0) -> "CorpusSpec":
+        """
+        規模 scale（クリップ数＝字幕の総キュー数）の標準的な構成。
+        クリップの半分は画像の producer、半分は動画の chain。
+        dynamictext と qtcrop はそれぞれクリップの1/4に付ける。
+        """
+        subtitle_filters = 1 + scale // 10000
+        return cls(
+            producers=scale // 2,
+            chains=scale - scale // 2,
+            playlists=max(1, scale // 250),
+            subtitle_filters=subtitle_filters,
+            cues_per_subtitle=max(1, scale // subtitle_filters),
+            dynamictext_filters=scale // 4,
+            qtcrop_filters=scale // 4,
+            seed=seed,
+        )
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    words: List[str] = []
+    total = 0
+    while total < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        total += len(word) + 1
+    return " ".join(words)
+
+
+def _srt_payload(rng: random.Random, cues: int, line_length: int) -> str:
+    blocks = []
+    for index in range(cues):
+        start = index * 3000
+        blocks.append(f"{index + 1}\n{_srt_time(start)} --> {_srt_time(start + 2500)}\n"
+                      f"{_sentence(rng, line_length)}\n")
+    return "\n".join(blocks)
+
+
+def _property(name: str, value) -> str:
+    return f'<property name="{name}">{escape(str(value))}</property>'
+
+
+def build_corpus(spec: CorpusSpec) -> str:
+    """spec に従って MLT 文書を文字列で返す（同じ spec なら同じ内容）"""
+    rng = random.Random(spec.seed)
+    clip_frames = 5 * FPS
+    out = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<mlt LC_NUMERIC="C" version="7.22.0" title="Shotcut version 24.02.29" producer="main_bin">',
+        '  <profile description="HD 1080p 25 fps" width="1920" height="1080" progressive="1" '
+        'sample_aspect_num="1" sample_aspect_den="1" display_aspect_num="16" display_aspect_den="9" '
+        f'frame_rate_num="{FPS}" frame_rate_den="1" colorspace="709"/>',
+    ]
+
+    # クリップ（producer: 画像、chain: 動画）。dynamictext は producer、qtcrop は chain に付ける
+    ids = [f"producer{index}" for index in range(spec.producers)] + [f"chain{index}" for index in range(spec.chains)]
+    producer_ids = ids[:spec.producers] or ids
+    chain_ids = ids[spec.producers:] or ids
+    filters = {clip_id: [] for clip_id in ids}
+    for index in range(spec.dynamictext_filters if ids else 0):
+        filters[producer_ids[index % len(producer_ids)]].append(
+            f'    <filter id="filter_dt{index}" out="{_timecode(clip_frames - 1)}">'
+            + _property("mlt_service", "dynamictext")
+            + _property("argument", _sentence(rng, spec.line_length))
+            + _property("geometry", "0 810 1920 270 1")
+            + _property("family", "Noto Sans") + _property("size", 72)
+            + _property("fgcolour", "#ffffffff") + _property("bgcolour", "#00000000")
+            + _property("shotcut:filter", "dynamicText") + "</filter>")
+    for index in range(spec.qtcrop_filters if ids else 0):
+        # 半分は透明（末尾 00）にして modify_qtcrop_color の書き換え対象にする
+        color = "#00000000" if index % 2 == 0 else "#ff0000ff"
+        filters[chain_ids[index % len(chain_ids)]].append(
+            f'    <filter id="filter_qc{index}" out="{_timecode(clip_frames - 1)}">'
+            + _property("mlt_service", "qtcrop")
+            + _property("rect", "0 0 1920 1080 1") + _property("radius", 0)
+            + _property("color", color) + _property("shotcut:filter", "cropRectangle") + "</filter>")
+
+    for index, clip_id in enumerate(ids):
+        tag = "chain" if clip_id.startswith("chain") else "producer"
+        resource = (f"C:/Users/user/Videos/footage/clip{index:06}.mp4" if tag == "chain"
+                    else f"C:/Users/user/Pictures/still{index:06}.png")
+        out.append(f'  <{tag} id="{clip_id}" in="{_timecode(0)}" out="{_timecode(clip_frames - 1)}">')
+        out.append("    " + _property("length", clip_frames * 10))
+        out.append("    " + _property("eof", "pause"))
+        out.append("    " + _property("resource", resource))
+        out.append("    " + _property("mlt_service", "avformat-novalidate" if tag == "chain" else "qimage"))
+        out.append("    " + _property("shotcut:hash", f"{rng.getrandbits(128):032x}"))
+        out.append("    " + _property("shotcut:caption", Path(resource).name))
+        out.extend(filters[clip_id])
+        out.append(f"  </{tag}>")
+
+    # プレイリスト（main_bin と、クリップを順に振り分けたトラック）
+    out.append('  <playlist id="main_bin">')
+    out.append("    " + _property("xml_retain", 1))
+    for clip_id in ids:
+        out.append(f'    <entry producer="{clip_id}" in="{_timecode(0)}" out="{_timecode(clip_frames - 1)}"/>')
+    out.append("  </playlist>")
+    tracks = [[] for _ in range(spec.playlists)]
+    for index, clip_id in enumerate(ids):
+        tracks[index % spec.playlists].append(clip_id)
+    for number, track in enumerate(tracks):
+        out.append(f'  <playlist id="playlist{number}">')
+        out.append("    " + _property("shotcut:video", 1))
+        out.append("    " + _property("shotcut:name", f"V{number + 1}"))
+        for clip_id in track:
+            out.append(f'    <entry producer="{clip_id}" in="{_timecode(0)}" out="{_timecode(clip_frames - 1)}"/>')
+        out.append("  </playlist>")
+
+    # メインの tractor（字幕の subtitle_feed はここに付く）
+    length = max((len(track) for track in tracks), default=1) * clip_frames
+    out.append(f'  <tractor id="tractor0" title="Shotcut version 24.02.29" '
+               f'in="{_timecode(0)}" out="{_timecode(length - 1)}">')
+    out.append("    " + _property("shotcut", 1))
+    for number in range(spec.playlists):
+        out.append(f'    <track producer="playlist{number}"/>')
+    for number in range(1, spec.playlists):
+        out.append(f'    <transition id="transition{number}">'
+                   + _property("a_track", 0) + _property("b_track", number)
+                   + _property("mlt_service", "qtblend") + "</transition>")
+    for index in range(spec.subtitle_filters):
+        payload = _srt_payload(rng, spec.cues_per_subtitle, spec.line_length)
+        out.append(f'    <filter id="filter_sub{index}">'
+                   + _property("mlt_service", "subtitle_feed")
+                   + _property("feed", f"Track {index + 1}") + _property("lang", "eng")
+                   + f'<property name="text">{escape(payload)}</property></filter>')
+    out.append("  </tractor>")
+    out.append("</mlt>")
+    return "\n".join(out) + "\n"
+
+
+def write_corpus(path: Union[str, Path], spec: CorpusSpec) -> Path:
+    """spec の MLT を path に書き出す"""
+    path = Path(path)
+    path.write_text(build_corpus(spec), encoding="utf-8")
+    return path
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+import json
+import os
+import queue
+import threading
+import requests
+
+
+class RangeDownloader:
+    """
+    レンダリング結果を複数コネクションで並列ダウンロードするクラス。
+
+    - HEAD でサイズ・ETag・Range 対応を確認し、ファイルをブロックに分割して並列取得
+    - 途中経過は <保存先>.part と <保存先>.part.json に記録し、再実行時に続きから再開
+    - If-Range に ETag を付け、サーバ側のファイルが変わっていれば最初からやり直す
+    """
+
+    BLOCK_SIZE = 16 * 1024 * 1024  # 16MB単位で分割
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, url: str, dest_path: Path | str, connections: int = 4, timeout: int = 60):
+        self.url = url
+        self.dest_path: Path = Path(dest_path)
+        self.part_path: Path = self.dest_path.with_name(self.dest_path.name + ".part")
+        self.state_path: Path = self.dest_path.with_name(self.dest_path.name + ".part.json")
+        self.connections = max(1, connections)
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._downloaded = 0
+        self._total = 0
+        self._error: Optional[Exception] = None
+
+    def download(self, progress_callback=None) -> Path:
+        """
+        ダウンロードを実行して保存先パスを返す。
+        progress_callback(progress, downloaded_bytes, total_bytes) で進捗を通知。
+        """
+        size, etag, accept_ranges = self._probe()
+        self._total = size
+
+        if not accept_ranges or size == 0:
+            self._download_single(progress_callback)
+            return self.dest_path
+
+        blocks = self._split_blocks(size)
+        done = self._load_state(size, etag, len(blocks))
+        if not done:
+            # 新規ダウンロード：サイズ分の領域を確保
+            with self.part_path.open("wb") as f:
+                f.truncate(size)
+        elif not self.part_path.exists():
+            done = set()
+            with self.part_path.open("wb") as f:
+                f.truncate(size)
+
+        self._downloaded = sum(blocks[i][1] - blocks[i][0] + 1 for i in done)
+        if progress_callback:
+            progress_callback(self._downloaded / size * 100, self._downloaded, size)
+
+        pending: "queue.Queue[int]" = queue.Queue()
+        for index in range(len(blocks)):
+            if index not in done:
+                pending.put(index)
+
+        threads = [
+            threading.Thread(target=self._worker, args=(pending, blocks, etag, done, progress_callback), daemon=True)
+            for _ in range(min(self.connections, pending.qsize()))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if self._error is not None:
+            raise self._error
+
+        os.replace(self.part_path, self.dest_path)
+        if self.state_path.exists():
+            self.state_path.unlink()
+        return self.dest_path
+
+    # ----------------------- 内部ユーティリティ -----------------------
+    def _probe(self) -> Tuple[int, Optional[str], bool]:
+        resp = requests.head(self.url, timeout=self.timeout, allow_redirects=True)
+        resp.raise_for_status()
+        size = int(resp.headers.get("Content-Length", "0"))
+        etag = resp.headers.get("ETag")
+        accept_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return size, etag, accept_ranges
+
+    def _split_blocks(self, size: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.BLOCK_SIZE, size) - 1) for start in range(0, size, self.BLOCK_SIZE)]
+
+    def _load_state(self, size: int, etag: Optional[str], block_count: int) -> set:
+        """前回の途中経過を読み込む。サイズやETagが変わっていれば破棄"""
+        if not self.state_path.exists():
+            return set()
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return set()
+        if state.get("size") != size or state.get("etag") != etag or state.get("block_size") != self.BLOCK_SIZE:
+            return set()
+        return {i for i in state.get("done", []) if 0 <= i < block_count}
+
+    def _save_state(self, etag: Optional[str], done: set):
+        state = {"url": self.url, "size": self._total, "etag": etag, "block_size": self.BLOCK_SIZE, "done": sorted(done)}
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    def _worker(self, pending, blocks, etag, done, progress_callback):
+        session = requests.Session()
+        with self.part_path.open("r+b") as f:
+            while self._error is None:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                start, end = blocks[index]
+                try:
+                    self._fetch_block(session, f, start, end, etag, progress_callback)
+                except Exception as e:
+                    self._error = e
+                    return
+                with self._lock:
+                    done.add(index)
+                    self._save_state(etag, done)
+
+    def _fetch_block(self, session, f, start, end, etag, progress_callback):
+        headers = {"Range": f"bytes={start}-{end}"}
+        if etag:
+            headers["If-Range"] = etag
+        with session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code != 206:
+                raise RuntimeError(
+                    f"Server did not return the requested range (status {resp.status_code}); "
+                    f"the file may have changed. Delete {self.part_path} to restart."
+                )
+            position = start
+            for chunk in resp.iter_content(chunk_size=self.READ_SIZE):
+                if not chunk:
+                    continue
+                f.seek(position)
+                f.write(chunk)
+                position += len(chunk)
+                with self._lock:
+                    self._downloaded += len(chunk)
+                    downloaded = self._downloaded
+                if progress_callback:
+                    progress_callback(downloaded / self._total * 100, downloaded, self._total)
+            if position != end + 1:
+                raise RuntimeError(f"Incomplete range {start}-{end}: received {position - start} bytes")
+
+    def _download_single(self, progress_callback):
+        """Range 非対応サーバ向けの単一コネクションダウンロード"""
+        with requests.get(self.url, stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            total = int(resp.headers.get("Content-Length", "0"))
+            downloaded = 0
+            with self.part_path.open("wb") as f:
+                for chunk in resp.iter_content(chunk_size=self.READ_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if progress_callback and total:
+                        progress_callback(downloaded / total * 100, downloaded, total)
+        os.replace(self.part_path, self.dest_path)
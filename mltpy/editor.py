@@ -11,6 +11,7 @@ from typing import Optional, Dict, Tuple, Union
 import zipfile
 from translate import Translator
 
+from .profiling import timed
 from .subtitle_utils import SubtitleUtils
 from .translator import GoogleTranslator
 from .exceptions import (
@@ -45,6 +46,7 @@ class MLTEditor:
         # Load MLT file at initialization / 初期化時にMLTファイルを読み込み
         self._load_mlt()
     
+    @timed("editor.parse")
     def _load_mlt(self):
         """Load MLT file and initialize internal state / MLTファイルを読み込み、内部状態を初期化"""
         if not self.input_path.exists():
@@ -115,6 +117,7 @@ class MLTEditor:
         
         return max_id
     
+    @timed("editor.save")
     def save(self, output_path: Optional[Union[str, Path]] = None):
         """
         Save MLT file / MLTファイルを保存
@@ -133,6 +136,7 @@ class MLTEditor:
         except Exception as e:
             raise MLTOutputPathError(f"File save failed: {str(e)} / ファイル保存に失敗しました: {str(e)}", save_path) from e
 
+    @timed("editor.wrap_dynamictext_lines")
     def wrap_dynamictext_lines(self, max_length: int = 90, force_wrap: bool = False):
 
         self.set_output_path(f"dynwrapped{max_length}")
@@ -154,6 +158,7 @@ class MLTEditor:
         return wrapped_count
 
     # dynamictextを翻訳する / translate dynamictext
+    @timed("editor.translate_dynamictext")
     def translate_dynamictext(self, from_lang: str = 'en', to_lang: str = 'fr', service: str = 'Libre') -> int:
 
         self.set_output_path(f"translated{from_lang}to{to_lang}")
@@ -213,6 +218,7 @@ class MLTEditor:
         
         return srt_data_dict
 
+    @timed("editor.wrap_srt_lines")
     def wrap_srt_lines(self, max_length: int = 90, force_wrap: bool = False):
         """
         Wrap long lines of SRT subtitles in MLT file at specified length / MLTファイル内のSRT字幕データの長い行を指定文字数で改行
@@ -304,6 +310,7 @@ class MLTEditor:
         
         return saved_files
 
+    @timed("editor.modify_qtcrop_color")
     def modify_qtcrop_color(self) -> int:
         """
         qtcropフィルターのcolorプロパティで末尾が00（透明）の場合、
@@ -6,6 +6,9 @@ import time
 import requests
 from mltpy.editor import MLTEditor
 from mltpy.packager import MLTDataPackager
+from mltpy.downloader import RangeDownloader
+from mltpy.config import CLOUD_RENDER_BASE_URL
+from mltpy.profiling import profiler
 
 BG_COLOR = "#323232"   # 背景（濃いグレー）
 FG_COLOR = "#E2E2E2"   # テキスト（白）
@@ -127,6 +130,26 @@ class GUIApp:
         self.progress_frame = tk.Frame(root, bg=BG_COLOR)
         # 初期状態では非表示
         
+        # レンダリングプロファイル選択
+        profile_frame = tk.Frame(self.progress_frame, bg=BG_COLOR)
+        profile_frame.pack(anchor="w", pady=(0, 5))
+        tk.Label(profile_frame, text="Render Profile / プロファイル", fg=FG_COLOR, bg=BG_COLOR).pack(side="left", padx=(0, 10))
+
+        self.render_profile_var = tk.StringVar(value="final")
+        profile_combo = ttk.Combobox(profile_frame, textvariable=self.render_profile_var, width=15, state="readonly")
+        profile_combo['values'] = ('draft', 'final')
+        profile_combo.pack(side="left")
+
+        # 本レンダリング前のプレビュー出力
+        self.preview_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(profile_frame, text="Preview first / プレビューを先に出力", variable=self.preview_var,
+                       fg=FG_COLOR, bg=BG_COLOR, selectcolor=BG_COLOR).pack(side="left", padx=(10, 0))
+
+        # レンダリング中からダウンロードできる断片化MP4
+        self.progressive_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(profile_frame, text="Download while rendering / レンダリング中に受信", variable=self.progressive_var,
+                       fg=FG_COLOR, bg=BG_COLOR, selectcolor=BG_COLOR).pack(side="left", padx=(10, 0))
+
         # 進捗状態ラベル
         self.status_label = tk.Label(self.progress_frame, text="Status 状態: Not started 未実行", fg=FG_COLOR, bg=BG_COLOR)
         self.status_label.pack(anchor="w")
@@ -139,6 +162,10 @@ class GUIApp:
         self.progress_text = tk.Label(self.progress_frame, text="", fg=FG_COLOR, bg=BG_COLOR)
         self.progress_text.pack(anchor="w", pady=(2, 0))
         
+        # プレビューのダウンロードリンク（プレビュー完成時に表示）
+        self.preview_link = tk.Label(self.progress_frame, text="", fg=FG_COLOR, bg=BG_COLOR, cursor="hand2")
+        self.preview_link.pack(anchor="w", pady=(5, 0))
+
         # ダウンロードリンク
         self.download_link = tk.Label(self.progress_frame, text="", fg=FG_COLOR, bg=BG_COLOR, cursor="hand2")
         self.download_link.pack(anchor="w", pady=(5, 0))
@@ -147,6 +174,8 @@ class GUIApp:
         self.unique_id = None
         self.polling_thread = None
         self.is_polling = False
+        self.preview_shown = False
+        self.progressive_shown = False
         
         # 残り時間計算用の変数
         self.start_time = None
@@ -156,6 +185,20 @@ class GUIApp:
         # 初期状態で折り返しオプションを表示
         self._show_wrap_options_only()
 
+        # 隠し設定: Ctrl+Shift+P（または MLTPY_PROFILE=1）で処理時間のプロファイルを記録
+        self.profile_enabled = os.getenv("MLTPY_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+        self.root.bind_all("<Control-Shift-KeyPress-P>", self.toggle_profiling)
+        self._update_title()
+
+    def toggle_profiling(self, event=None):
+        """プロファイル記録の切り替え（結果はプロジェクトの隣に <名前>.profile.json/.txt で保存）"""
+        self.profile_enabled = not self.profile_enabled
+        self._update_title()
+        print(f"Profiling {'enabled' if self.profile_enabled else 'disabled'}")
+
+    def _update_title(self):
+        self.root.title("Shotcut MLT Toolbox" + (" [profiling]" if self.profile_enabled else ""))
+
     def on_choice_change(self):
         """ラジオボタン選択時の詳細オプション表示/非表示切り替え"""
         choice = self.wrap_choice_var.get()
@@ -236,29 +279,31 @@ class GUIApp:
     def run_local_processing(self):
         """ローカル処理（既存の機能）"""
         try:
-            editor = MLTEditor(self.input_path_var.get())
-
+            # Google翻訳の場合、クレデンシャルファイルのパスを環境変数に設定
             choice = self.wrap_choice_var.get()
-            if choice == "wrap_subtitles":
-                editor.wrap_srt_lines(max_length=self.wrap_max_length_var.get(), force_wrap=self.force_wrap_var.get())
-            elif choice == "wrap_dynamictext":
-                editor.wrap_dynamictext_lines(max_length=self.wrap_max_length_var.get(), force_wrap=self.force_wrap_var.get())
-            elif choice == "translate_dynamictext":
-                # Google翻訳の場合、クレデンシャルファイルのパスを環境変数に設定
-                if self.translate_service_var.get() == "google":
-                    credentials_path = self.credentials_path_var.get()
-                    if credentials_path:
-                        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
-                    else: 
-                        messagebox.showerror("Error:", "Credential File box is empty. クレデンシャルファイル欄が空です。")
-                        return
-                editor.translate_dynamictext(
-                    from_lang=self.translate_from_var.get(), 
-                    to_lang=self.translate_to_var.get(), 
-                    service=self.translate_service_var.get()
-                )
-
-            editor.save()
+            if choice == "translate_dynamictext" and self.translate_service_var.get() == "google":
+                credentials_path = self.credentials_path_var.get()
+                if credentials_path:
+                    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+                else: 
+                    messagebox.showerror("Error:", "Credential File box is empty. クレデンシャルファイル欄が空です。")
+                    return
+
+            with profiler.session(self.input_path_var.get(), enabled=self.profile_enabled):
+                editor = MLTEditor(self.input_path_var.get())
+
+                if choice == "wrap_subtitles":
+                    editor.wrap_srt_lines(max_length=self.wrap_max_length_var.get(), force_wrap=self.force_wrap_var.get())
+                elif choice == "wrap_dynamictext":
+                    editor.wrap_dynamictext_lines(max_length=self.wrap_max_length_var.get(), force_wrap=self.force_wrap_var.get())
+                elif choice == "translate_dynamictext":
+                    editor.translate_dynamictext(
+                        from_lang=self.translate_from_var.get(), 
+                        to_lang=self.translate_to_var.get(), 
+                        service=self.translate_service_var.get()
+                    )
+
+                editor.save()
             messagebox.showinfo("Complate 完了", "Process completed! 処理が完了しました！")
 
         except Exception as e:
@@ -284,17 +329,23 @@ class GUIApp:
             
             # packagerを使用してZIP作成とアップロード
             self.root.after(0, lambda: self.update_status("Status 状態: Zipping data.zip データをZIP化しています"))
-            packager = MLTDataPackager(self.input_path_var.get())
-            zip_path = packager.prepare_zip()  # data.zip を生成
-
-            # Status 状態: Uploading アップロード
-            self.root.after(0, lambda: self.update_status("Status 状態: Uploading アップロード"))
-
             # アップロード進捗コールバックを設定
             def upload_progress_callback(progress, uploaded_bytes, total_bytes):
                 self.root.after(0, lambda: self._update_upload_progress(progress, uploaded_bytes, total_bytes))
-            
-            status, text = packager.upload(progress_callback=upload_progress_callback)   # アップロード
+
+            with profiler.session(self.input_path_var.get(), enabled=self.profile_enabled):
+                packager = MLTDataPackager(self.input_path_var.get())
+                zip_path = packager.prepare_zip()  # data.zip を生成
+
+                # Status 状態: Uploading アップロード
+                self.root.after(0, lambda: self.update_status("Status 状態: Uploading アップロード"))
+
+                status, text = packager.upload(
+                    progress_callback=upload_progress_callback,
+                    render_profile=self.render_profile_var.get(),
+                    preview=self.preview_var.get(),
+                    progressive=self.progressive_var.get()
+                )   # アップロード
             
             print(f"ZIP path: {zip_path}, Status: {status}, Response: {text}")
             
@@ -323,6 +374,9 @@ class GUIApp:
         self.progress_bar['value'] = 0
         self.progress_text.config(text="")
         self.download_link.config(text="")
+        self.preview_link.config(text="")
+        self.preview_shown = False
+        self.progressive_shown = False
         self.unique_id = None
         self.is_polling = False
         
@@ -385,7 +439,7 @@ class GUIApp:
         """ステータスをポーリング"""
         while self.is_polling and self.unique_id:
             try:
-                url = f"http://163.58.36.32:5000/status/{self.unique_id}"
+                url = f"{CLOUD_RENDER_BASE_URL}/status/{self.unique_id}"
                 response = requests.get(url, timeout=10)
                 
                 if response.status_code == 200:
@@ -400,6 +454,17 @@ class GUIApp:
                     print(f"Status response: {data}")
                     print(f"Parsed - Status: '{status}', Progress: {progress}, Current: {current}, Total: {total}, Queue: {queue}")
                     
+                    # プレビューが完成したら本レンダリングを待たずにリンクを表示
+                    preview = data.get('preview') or {}
+                    if preview.get('status') == 'ready' and not self.preview_shown:
+                        self.preview_shown = True
+                        self.root.after(0, lambda: self._show_preview_link())
+
+                    # 断片化MP4ならレンダリング開始時点でダウンロードリンクを表示
+                    if status == 'processing' and data.get('progressive') and not self.progressive_shown:
+                        self.progressive_shown = True
+                        self.root.after(0, lambda: self._show_download_link())
+
                     # progressが100%の場合は完了として扱う
                     if progress >= 100:
                         status = 'completed'
@@ -494,14 +559,44 @@ class GUIApp:
     def _show_download_link(self):
         """ダウンロードリンクを表示"""
         if self.unique_id:
-            download_url = f"http://163.58.36.32:5000/download/{self.unique_id}"
+            download_url = f"{CLOUD_RENDER_BASE_URL}/download/{self.unique_id}"
             self.download_link.config(text=f"Download ダウンロード: {download_url}")
-            self.download_link.bind("<Button-1>", lambda e: self._open_download_link(download_url))
+            self.download_link.bind("<Button-1>", lambda e: self._start_download(download_url))
+
+    def _show_preview_link(self):
+        """プレビューのダウンロードリンクを表示"""
+        if self.unique_id:
+            preview_url = f"{CLOUD_RENDER_BASE_URL}/download/{self.unique_id}/preview"
+            self.preview_link.config(text=f"Preview プレビュー: {preview_url}")
+            self.preview_link.bind("<Button-1>", lambda e: self._start_download(preview_url, "preview"))
+
+    def _start_download(self, url, kind="output"):
+        """保存先を選んで並列・再開可能なダウンロードを開始"""
+        save_path = filedialog.asksaveasfilename(
+            title="Save rendered video / レンダリング結果を保存",
+            initialfile=f"{self.unique_id}_{kind}.mp4",
+            defaultextension=".mp4",
+            filetypes=[("MP4 files", "*.mp4")]
+        )
+        if not save_path:
+            return
 
-    def _open_download_link(self, url):
-        """ダウンロードリンクを開く"""
-        import webbrowser
-        webbrowser.open(url)
+        self.status_label.config(text="Status 状態: Downloading ダウンロード中")
+        thread = threading.Thread(target=self._download_worker, args=(url, save_path))
+        thread.daemon = True
+        thread.start()
+
+    def _download_worker(self, url, save_path):
+        """ダウンロードのワーカースレッド"""
+        def download_progress_callback(progress, downloaded_bytes, total_bytes):
+            self.root.after(0, lambda: self._update_upload_progress(progress, downloaded_bytes, total_bytes))
+
+        try:
+            RangeDownloader(url, save_path).download(progress_callback=download_progress_callback)
+            self.root.after(0, lambda: self.update_status("Status 状態: Downloaded ダウンロード完了"))
+            self.root.after(0, lambda: messagebox.showinfo("Complate 完了", f"Saved 保存しました: {save_path}"))
+        except Exception as e:
+            self.root.after(0, lambda error=e: messagebox.showerror("Error", f"ダウンロードに失敗しました（再実行で続きから再開します）: {error}"))
 
 def main():
     root = tk.Tk()
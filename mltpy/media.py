@@ -10,6 +10,7 @@ import cv2
 import numpy as np
 from typing import Optional, Tuple, Union
 
+from .profiling import timed
 from .exceptions import (
     MediaFileNotFoundError,
     MediaFileIOError, 
@@ -28,6 +29,7 @@ class MediaUtils:
     SUPPORTED_VIDEO_FORMATS = {".mp4", ".mov", ".avi", ".mkv", ".wmv", ".flv", ".webm"}
     
     @staticmethod
+    @timed("media.get_video_duration")
     def get_video_duration(video_path: Union[str, Path], speed: float = 1.0) -> str:
         """
         動画の長さを取得（00:00:00.000形式）
@@ -104,6 +106,7 @@ class MediaUtils:
         return media_path
     
     @staticmethod
+    @timed("media.get_media_size")
     def get_media_size(file_path: Union[str, Path]) -> Tuple[int, int]:
         """
         動画または静止画の幅・高さを取得
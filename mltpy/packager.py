@@ -1,40 +1,205 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict, Tuple, Optional
+from typing import Any, Dict, Tuple, Optional
+from xml.sax.saxutils import quoteattr
+import copy
+import io
+import re
+import tempfile
 import zipfile
 import shutil
 import requests
 from .config import CLOUD_RENDER_BASE_URL
+from .media import MediaUtils
+from .profiling import span
+from .proxy import (
+    DEFAULT_PROXY_HEIGHT,
+    GEOMETRY_PROPERTIES,
+    TEXT_SERVICES,
+    TEXT_SIZE_PROPERTIES,
+    ProxyGenerator,
+    scale_geometry,
+    scaled_profile_size,
+)
+from .trim import (
+    DEFAULT_HANDLE_SECONDS,
+    MIN_SAVING_RATIO,
+    MediaTrimmer,
+    frames_to_time,
+    merge_ranges,
+    time_to_frames,
+)
 import xml.etree.ElementTree as ET
 
+# トップレベルに並ぶサービス要素（到達可能性の判定対象）
+SERVICE_TAGS = ("producer", "chain", "playlist", "tractor")
+# 速度指定付きの resource（例: 2.000000:C:/path/clip.mp4）
+_SPEED_PREFIX = re.compile(r"^-?\d+(?:\.\d+)?:")
+# ZIP 内の修正版MLTの名前（サーバはこの名前でレンダリングする）
+MLT_ARCNAME = "cloud_rendering.mlt"
+
+
+def _tostring(elem) -> str:
+    """要素を末尾の空白（tail）ごと文字列にする（lxml / xml.etree の両方に対応）"""
+    if hasattr(elem, "getroottree"):
+        from lxml import etree
+        return etree.tostring(elem, encoding="unicode")
+    return ET.tostring(elem, encoding="unicode")
+
+
+class _CopyOnWriteView:
+    """
+    元の MLT ツリーを変更せずに書き換えるためのビュー。
+
+    トップレベル要素の並び（削除・挿入）と root の属性はビュー側で持ち、
+    書き換える要素だけを初回の writable() で deepcopy する。
+    MLTEditor の lxml ツリーを渡された場合も、エディタ側の内容はそのまま残る。
+    """
+
+    def __init__(self, root):
+        self.tag = root.tag
+        self.text = root.text
+        self.attrib: Dict[str, str] = dict(root.attrib)
+        self._children = list(root)
+        # id(元の要素) -> (元の要素, 複製)。lxml の要素オブジェクトは参照が無いと作り直されるため元も保持
+        self._copies: Dict[int, Tuple[Any, Any]] = {}
+        self._owned = set()  # ビューで作った要素（複製・追加）の id
+        self._positions: Optional[Dict[int, int]] = None  # id(要素) -> _children での位置
+        # id(元のトップレベル要素) -> { id(元の子孫): (元の子孫, 複製の子孫) }（writable_node 用、初回に1回だけ作る）
+        self._node_maps: Dict[int, Dict[int, Tuple[Any, Any]]] = {}
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def get(self, name, default=None):
+        return self.attrib.get(name, default)
+
+    def find(self, tag):
+        return next((child for child in self._children if child.tag == tag), None)
+
+    def iter(self):
+        for child in self._children:
+            yield from child.iter()
+
+    def _index(self, elem) -> int:
+        if self._positions is None:
+            self._positions = {id(child): i for i, child in enumerate(self._children)}
+        return self._positions[id(elem)]
+
+    def remove(self, elem):
+        del self._children[self._index(elem)]
+        self._positions = None
+
+    def insert_after(self, elem, new_elem):
+        self._children.insert(self._index(elem) + 1, new_elem)
+        self._owned.add(id(new_elem))
+        self._positions = None
+
+    def writable(self, elem):
+        """トップレベル要素の書き換え用の複製を返す（2回目以降は同じ複製）"""
+        if id(elem) in self._owned:
+            return elem
+        if id(elem) in self._copies:
+            return self._copies[id(elem)][1]
+        duplicate = copy.deepcopy(elem)
+        index = self._index(elem)
+        self._copies[id(elem)] = (elem, duplicate)
+        self._owned.add(id(duplicate))
+        self._children[index] = duplicate
+        self._positions[id(duplicate)] = index
+        return duplicate
+
+    def writable_node(self, top, node):
+        """トップレベル要素 top の子孫 node に対応する、書き換え用の要素を返す"""
+        duplicate = self.writable(top)
+        if duplicate is top:
+            return node
+        node_map = self._node_maps.get(id(top))
+        if node_map is None:
+            # 元と複製は同じ構造なので、同じ順に走査すれば対応が取れる（要素ごとに走査し直さない）
+            node_map = self._node_maps[id(top)] = {
+                id(original): (original, copied) for original, copied in zip(top.iter(), duplicate.iter())
+            }
+        return node_map[id(node)][1]
+
+    def write(self, out):
+        """XML として out（テキストストリーム）に書き出す"""
+        out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        attrs = "".join(f" {name}={quoteattr(value)}" for name, value in self.attrib.items())
+        out.write(f"<{self.tag}{attrs}>{self.text or ''}")
+        for child in self._children:
+            out.write(_tostring(child))
+        out.write(f"</{self.tag}>\n")
+
 
 class MLTDataPackager:
     """
     MLT編集済みファイルをzip化し、アップロードするクラス。
 
-    - 与えられた .mlt を解析し、全 producer/resource を data/<ファイル名> に書き換え
-    - 修正版を {stem}_pathmod.mlt として保存
-    - 上記とリソース群を data.zip に格納
+    - 与えられた .mlt を解析し、メインの tractor から参照されない producer / chain / playlist を削除
+    - trim=True では動画素材を使用範囲（＋余白）だけに切り出し、entry の in/out を書き換え
+    - proxy=True では素材を低解像度のプロキシに差し替え、<profile> の解像度も縮小（ドラフト用）
+    - 残った producer/resource を data/<ファイル名> に書き換え
+    - 修正版MLT（cloud_rendering.mlt）は中間ファイルを作らず、素材と一緒に data.zip へ直接書き込む
     - data.zip を /upload エンドポイントにPOST
+
+    .mlt のパスの代わりに MLTEditor（またはその解析済みツリー）を渡すと、
+    エディタでの編集内容を保存・再読み込みせずにそのままパッケージする。
+    書き換えはコピーオンライトで行うため、エディタのツリーは変更されない。
     """
 
-    def __init__(self, mlt_path: Path | str):
+    def __init__(self, source, mlt_path: Path | str | None = None):
+        """
+        Args:
+            source: .mlt のパス、MLTEditor、または解析済みの ElementTree / ルート要素（lxml / xml.etree）
+            mlt_path: source がツリーの場合の元ファイルのパス（相対パスの素材と data.zip の場所の基準）
+        """
+        self._live_root = None
+        if hasattr(source, "tree") and hasattr(source, "input_path"):
+            # MLTEditor
+            self._live_root = source.tree.getroot()
+            mlt_path = mlt_path or source.input_path
+        elif hasattr(source, "getroot") or hasattr(source, "tag"):
+            self._live_root = source.getroot() if hasattr(source, "getroot") else source
+            docinfo = getattr(source, "docinfo", None)
+            mlt_path = mlt_path or (docinfo.URL if docinfo is not None else None)
+            if mlt_path is None:
+                raise ValueError("mlt_path is required when packaging a parsed tree")
+        else:
+            mlt_path = source
+
         self.mlt_path: Path = Path(mlt_path).resolve()
-        if not self.mlt_path.exists():
+        if self._live_root is None and not self.mlt_path.exists():
             raise FileNotFoundError(f"MLT file not found: {self.mlt_path}")
 
         self.work_dir: Path = self.mlt_path.parent
-        self.modified_mlt_path: Path = self.work_dir / "cloud_rendering.mlt"
         self.zip_path: Path = self.work_dir / "data.zip"
 
         # 元パス -> zip内パス(data/xxx) の対応表
         self._path_mapping: Dict[Path, str] = {}
 
-    def prepare_zip(self) -> Path:
+        # 到達不能な要素の削除結果（prepare_zip 後に参照）
+        self.pruned_elements: int = 0
+        self.pruned_bytes: int = 0
+        # 使用範囲の切り出しで削減したバイト数
+        self.trimmed_bytes: int = 0
+        # 切り出したファイル -> (元素材, 開始秒, 終了秒)（プロキシのキャッシュのキーに使う）
+        self._trim_origins: Dict[Path, Tuple[Path, float, float]] = {}
+        # プロキシへの差し替えで削減したバイト数
+        self.proxy_saved_bytes: int = 0
+
+    def prepare_zip(self, prune: bool = True, trim: bool = False,
+                    trim_handle: float = DEFAULT_HANDLE_SECONDS, proxy: bool = False,
+                    proxy_height: int = DEFAULT_PROXY_HEIGHT, proxy_cache: Path | str | None = None) -> Path:
         """
         data.zip を生成してパスを返す。
         既存の data.zip は削除する。
+        prune=True ではタイムラインから使われていないビン内の素材を同梱しない。
+        trim=True では動画素材のうちタイムラインで使う範囲（前後 trim_handle 秒の余白付き）だけを
+        ffmpeg でキーフレーム単位に切り出して同梱する（ffmpeg / ffprobe が無ければ切り出さない）。
+        proxy=True ではプロジェクトを高さ proxy_height に縮小し、素材も OpenCV で縮小したプロキシ
+        （proxy_cache、省略時は MLTPY_PROXY_CACHE かユーザーのキャッシュディレクトリに保存・再利用）に差し替える。
         """
         if self.zip_path.exists():
             try:
@@ -49,46 +214,87 @@ class MLTDataPackager:
                 except Exception:
                     pass
 
-        tree, root = self._parse_mlt()
+        with span("package.parse"):
+            root = _CopyOnWriteView(self._live_root if self._live_root is not None else self._parse_mlt()[1])
+
+        if prune:
+            with span("package.prune") as info:
+                self.pruned_elements, self.pruned_bytes = self._prune_unreachable(root)
+                info.update(elements=self.pruned_elements, bytes=self.pruned_bytes)
+            if self.pruned_elements:
+                print(f"Pruned {self.pruned_elements} unreferenced elements "
+                      f"({self.pruned_bytes / (1024 ** 2):.1f}MB of media not packaged)")
+
+        trim_dir = None
+        self._trim_origins.clear()
+        if trim:
+            trimmer = MediaTrimmer(handle_seconds=trim_handle)
+            if trimmer.available:
+                trim_dir = Path(tempfile.mkdtemp(prefix=".trim-", dir=self.work_dir))
+                with span("package.trim") as info:
+                    self.trimmed_bytes = info["saved_bytes"] = self._trim_used_ranges(root, trimmer, trim_dir)
+                print(f"Trimmed media to used ranges ({self.trimmed_bytes / (1024 ** 2):.1f}MB not packaged)")
+            else:
+                print("ffmpeg / ffprobe not found; packaging whole media files")
+
+        if proxy:
+            with span("package.proxy") as info:
+                generator = ProxyGenerator(proxy_cache)
+                self.proxy_saved_bytes = self._use_proxies(root, generator, proxy_height)
+                info.update(generated=generator.generated, reused=generator.reused, evicted=generator.evicted,
+                            saved_bytes=self.proxy_saved_bytes)
 
+        try:
+            with span("package.zip") as info:
+                self._write_zip(root)
+                info.update(files=len(self._path_mapping), bytes=self.zip_path.stat().st_size)
+        finally:
+            if trim_dir is not None:
+                shutil.rmtree(trim_dir, ignore_errors=True)
+        return self.zip_path
+
+    def _write_zip(self, root: _CopyOnWriteView):
+        """resource を書き換えて修正版MLTと素材を data.zip に格納"""
         # 全 producer / chain の resource を data/<basename> に書き換え
         self._path_mapping.clear()
 
-        def rewrite_resources_on_elements(elements):
-            for elem in elements:
-                for prop in elem.findall("property"):
-                    if prop.get("name") == "resource" and prop.text:
-                        original_text = prop.text.strip()
-                        src_path = self._resolve_resource_path(original_text)
-                        if src_path is None:
-                            # ファイルパスでなければスキップ
-                            continue
-                        if not src_path.exists():
-                            raise FileNotFoundError(f"Resource file not found: {src_path}")
-
-                        arcname = src_path.name
-                        self._path_mapping[src_path] = f"data/{arcname}"
-                        prop.text = f"data/{arcname}"
-
         # producerとchainを対象に実行
-        rewrite_resources_on_elements(root.findall("producer"))
-        rewrite_resources_on_elements(root.findall("chain"))
+        for elem in list(root):
+            if elem.tag not in ("producer", "chain"):
+                continue
+            for prop in elem.findall("property"):
+                if prop.get("name") == "resource" and prop.text:
+                    original_text = prop.text.strip()
+                    src_path = self._resolve_resource_path(original_text)
+                    if src_path is None:
+                        # ファイルパスでなければスキップ
+                        continue
+                    if not src_path.exists():
+                        raise FileNotFoundError(f"Resource file not found: {src_path}")
 
-        # 修正版MLTを書き出し
-        tree.write(self.modified_mlt_path, encoding="utf-8", xml_declaration=True)
+                    arcname = src_path.name
+                    self._path_mapping[src_path] = f"data/{arcname}"
+                    root.writable_node(elem, prop).text = f"data/{arcname}"
 
         # ZIP作成
         with zipfile.ZipFile(self.zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
             # リソースを追加
             for src, arc in self._path_mapping.items():
                 zf.write(src, arcname=arc)
-            # 修正版MLTを追加（ルート直下にファイル名で）
-            zf.write(self.modified_mlt_path, arcname=self.modified_mlt_path.name)
+            # 修正版MLTを中間ファイル無しで追加（ルート直下にファイル名で）
+            with io.TextIOWrapper(zf.open(MLT_ARCNAME, "w"), encoding="utf-8") as out:
+                root.write(out)
 
-        return self.zip_path
-
-    def upload(self, url: str | None = None, timeout: int = 60, progress_callback=None) -> Tuple[int, str]:
-        """生成済み ZIP を指定URLへPOSTする。戻り値は (status_code, text)。"""
+    def upload(self, url: str | None = None, timeout: int = 60, progress_callback=None,
+               render_profile: str | None = None, stream_ingest: bool = True,
+               preview: bool = False, progressive: bool = False) -> Tuple[int, str]:
+        """
+        生成済み ZIP を指定URLへPOSTする。戻り値は (status_code, text)。
+        render_profile を指定するとサーバ側のレンダリングプロファイル（draft/final など）を選択する。
+        stream_ingest=True ではサーバが受信しながら展開し、アップロード完了時点でレンダリング可能になる。
+        preview=True では本レンダリングの前に低解像度のプレビュー（/download/<id>/preview）を出力する。
+        progressive=True では断片化MP4で出力し、レンダリング中から /download/<id> で受信を始められる。
+        """
         if not self.zip_path.exists():
             raise FileNotFoundError("data.zip is not prepared. Call prepare_zip() first.")
 
@@ -99,6 +305,14 @@ class MLTDataPackager:
             "X-Filename": self.zip_path.name,
             "Content-Type": "application/octet-stream",
         }
+        if render_profile:
+            headers["X-Render-Profile"] = render_profile
+        if stream_ingest:
+            headers["X-Ingest"] = "stream"
+        if preview:
+            headers["X-Preview"] = "1"
+        if progressive:
+            headers["X-Progressive"] = "1"
         
         # ファイルサイズを取得
         file_size = self.zip_path.stat().st_size
@@ -124,7 +338,9 @@ class MLTDataPackager:
                     return getattr(self.file_obj, name)
             
             progress_file = ProgressAdapter(f, progress_callback, file_size)
-            resp = requests.post(url, data=progress_file, headers=headers, timeout=timeout)
+            with span("package.upload", bytes=file_size) as info:
+                resp = requests.post(url, data=progress_file, headers=headers, timeout=timeout)
+                info["status"] = resp.status_code
         return resp.status_code, resp.text
 
     # ----------------------- 内部ユーティリティ -----------------------
@@ -135,6 +351,262 @@ class MLTDataPackager:
         except ET.ParseError as e:
             raise ValueError(f"Failed to parse MLT XML: {e}")
 
+    @staticmethod
+    def _find_main_tractor(root):
+        """メインのタイムライン（最後の tractor。無ければ最後のサービス要素）"""
+        tractors = [elem for elem in root if elem.tag == "tractor"]
+        if tractors:
+            return tractors[-1]
+        services = [elem for elem in root if elem.tag in SERVICE_TAGS]
+        return services[-1] if services else None
+
+    def _prune_unreachable(self, root) -> Tuple[int, int]:
+        """
+        メインの tractor から track / entry を辿って到達できないトップレベル要素を削除する。
+        （ビンにだけある producer / chain、main_bin などの未使用プレイリスト）
+        transition と filter は親要素の中にあるため、親が残れば一緒に残る。
+
+        Returns: (削除した要素数, 同梱しなくて済んだ素材の合計バイト数)
+        """
+        main = self._find_main_tractor(root)
+        if main is None:
+            return 0, 0
+        services = {elem.get("id"): elem for elem in root if elem.tag in SERVICE_TAGS and elem.get("id")}
+
+        reachable = {id(main)}
+        pending = [main]
+        while pending:
+            for child in pending.pop().iter():
+                if child.tag not in ("track", "entry"):
+                    continue
+                target = services.get(child.get("producer"))
+                if target is not None and id(target) not in reachable:
+                    reachable.add(id(target))
+                    pending.append(target)
+
+        removed = [elem for elem in root if elem.tag in SERVICE_TAGS and id(elem) not in reachable]
+        if not removed:
+            return 0, 0
+
+        # 残る要素でも使われている素材は削減量に含めない
+        kept_paths = set()
+        for elem in root:
+            if elem.tag in SERVICE_TAGS and id(elem) in reachable:
+                kept_paths.update(self._resource_files(elem))
+        removed_paths = set()
+        for elem in removed:
+            removed_paths.update(self._resource_files(elem))
+            root.remove(elem)
+
+        # ルートの producer 属性（main_bin）が削除した要素を指していれば外す
+        removed_ids = {elem.get("id") for elem in removed}
+        if root.get("producer") in removed_ids:
+            del root.attrib["producer"]
+
+        saved = sum(path.stat().st_size for path in removed_paths - kept_paths)
+        return len(removed), saved
+
+    def _trim_used_ranges(self, root, trimmer: MediaTrimmer, trim_dir: Path) -> int:
+        """
+        動画素材を使用範囲だけに切り出し、producer / chain の resource と in/out を書き換える。
+        1つの素材から離れた範囲を複数使う場合は範囲ごとにファイルを分け、
+        producer を複製して entry の参照先を振り分ける。
+
+        Returns: 削減したバイト数
+        """
+        profile = root.find("profile")
+        try:
+            fps = int(profile.get("frame_rate_num")) / int(profile.get("frame_rate_den", "1"))
+        except (AttributeError, TypeError, ValueError, ZeroDivisionError):
+            print("Trim skipped: project frame rate is unknown")
+            return 0
+
+        # 素材ファイル -> それを resource に持つ producer / chain
+        services = {elem.get("id"): elem for elem in root if elem.tag in SERVICE_TAGS and elem.get("id")}
+        by_path: Dict[Path, list] = {}
+        for elem in root:
+            if elem.tag not in ("producer", "chain") or not elem.get("id"):
+                continue
+            resource = self._get_property(elem, "resource")
+            if resource is None or resource.text is None:
+                continue
+            path = self._resolve_resource_path(resource.text)
+            if path is None or not path.is_file() or MediaUtils.get_media_type(path) != "video":
+                continue
+            # timewarp（速度変更）は in/out が元素材の時間と一致しないため対象外
+            if self._get_text(elem, "mlt_service") == "timewarp" or _SPEED_PREFIX.match(resource.text.strip()):
+                continue
+            by_path.setdefault(path, []).append(elem)
+
+        # producer id -> 参照している (トップレベル要素, entry / track)
+        usages: Dict[str, list] = {}
+        for top in root:
+            for ref in top.iter():
+                if ref.tag in ("entry", "track") and ref.get("producer") in services:
+                    usages.setdefault(ref.get("producer"), []).append((top, ref))
+
+        saved = 0
+        for source_index, (path, elems) in enumerate(by_path.items()):
+            refs = [ref for elem in elems for _, ref in usages.get(elem.get("id"), [])]
+            frames = [(time_to_frames(ref.get("in"), fps), time_to_frames(ref.get("out"), fps)) for ref in refs]
+            if not refs or any(start is None or end is None for start, end in frames):
+                # 全体を参照している箇所がある素材は切り出さない
+                continue
+            try:
+                start_time, duration = trimmer.probe_times(path)
+                segments = merge_ranges([(start / fps, (end + 1) / fps) for start, end in frames],
+                                        trimmer.handle_seconds, duration)
+                if duration and sum(end - start for start, end in segments) > duration * (1 - MIN_SAVING_RATIO):
+                    continue
+                cut = []
+                for index, (start, end) in enumerate(segments):
+                    # 別のフォルダにある同名の素材（cam_a/C0001.MP4 と cam_b/C0001.MP4 など）で上書きしないよう番号を付ける
+                    dest = trim_dir / f"{path.stem}.{source_index}.trim{index}{path.suffix}"
+                    actual_start = trimmer.cut(path, start, end, dest, start_time)
+                    cut.append((actual_start, end, dest))
+                    self._trim_origins[dest] = (path, actual_start, end)
+            except Exception as e:
+                print(f"Trim skipped for {path.name}: {e}")
+                continue
+
+            for elem in elems:
+                self._retarget_segments(root, elem, usages.get(elem.get("id"), []), cut, fps)
+            saved += path.stat().st_size - sum(dest.stat().st_size for _, _, dest in cut)
+            print(f"Trimmed {path.name}: {len(cut)} range(s)")
+        return saved
+
+    def _use_proxies(self, root: _CopyOnWriteView, generator: ProxyGenerator, proxy_height: int) -> int:
+        """
+        プロファイルを proxy_height まで縮小し、素材をその大きさに収まるプロキシに差し替える。
+        画素単位の rect / geometry と文字の大きさも同じ倍率で縮める。
+
+        Returns: 削減したバイト数
+        """
+        profile = root.find("profile")
+        try:
+            width, height = int(profile.get("width")), int(profile.get("height"))
+        except (AttributeError, TypeError, ValueError):
+            print("Proxy skipped: project resolution is unknown")
+            return 0
+        new_width, new_height = scaled_profile_size(width, height, proxy_height)
+
+        # resource ごとの (トップレベル要素, property, 素材)
+        resources = []
+        for elem in root:
+            if elem.tag not in ("producer", "chain"):
+                continue
+            for prop in elem.findall("property"):
+                if prop.get("name") == "resource" and prop.text:
+                    path = self._resolve_resource_path(prop.text)
+                    if path is not None and path.is_file():
+                        resources.append((elem, prop, path))
+
+        proxies = generator.generate_all([path for _, _, path in resources], (new_width, new_height),
+                                         self._trim_origins)
+        for elem, prop, path in resources:
+            if path in proxies:
+                prefix = _SPEED_PREFIX.match(prop.text.strip())
+                root.writable_node(elem, prop).text = (prefix.group(0) if prefix else "") + str(proxies[path])
+        saved = sum(src.stat().st_size - dest.stat().st_size for src, dest in proxies.items())
+        print(f"Proxies: {generator.generated} generated, {generator.reused} reused, {generator.evicted} evicted "
+              f"({saved / (1024 ** 2):.1f}MB not packaged)")
+
+        if (new_width, new_height) != (width, height):
+            factor = new_height / height
+            scaled_profile = root.writable(profile)
+            scaled_profile.set("width", str(new_width))
+            scaled_profile.set("height", str(new_height))
+            self._scale_pixel_properties(root, factor)
+            print(f"Profile scaled to {new_width}x{new_height} for the proxy render")
+        return saved
+
+    def _scale_pixel_properties(self, root: _CopyOnWriteView, factor: float):
+        """filter / transition の画素単位のプロパティをプロファイルと同じ倍率で縮める"""
+        for top in list(root):
+            targets = []
+            for node in top.iter():
+                if node.tag not in ("filter", "transition"):
+                    continue
+                text_service = self._get_text(node, "mlt_service") in TEXT_SERVICES
+                for prop in node.findall("property"):
+                    name = prop.get("name")
+                    if prop.text and (name in GEOMETRY_PROPERTIES or (text_service and name in TEXT_SIZE_PROPERTIES)):
+                        targets.append(prop)
+            for prop in targets:
+                writable = root.writable_node(top, prop)
+                if prop.get("name") in GEOMETRY_PROPERTIES:
+                    writable.text = scale_geometry(prop.text, factor)
+                else:
+                    try:
+                        writable.text = str(max(1, int(round(float(prop.text) * factor))))
+                    except ValueError:
+                        pass
+
+    def _retarget_segments(self, root: _CopyOnWriteView, elem, refs, cut, fps):
+        """producer を切り出したファイルに向け直す（複数の範囲にまたがる場合は複製）"""
+        # 範囲ごとに参照をまとめる（参照は書き換え用の要素に置き換えておく）
+        groups: Dict[int, list] = {}
+        for top, ref in refs:
+            in_seconds = time_to_frames(ref.get("in"), fps) / fps
+            index = max(i for i, (start, _, _) in enumerate(cut) if start <= in_seconds + 1e-6)
+            groups.setdefault(index, []).append(root.writable_node(top, ref))
+
+        # 書き換え前の状態（元の要素）から複製する
+        ordered = sorted(groups.items())
+        clones = [copy.deepcopy(elem) for _ in ordered[1:]]
+        targets = [root.writable(elem)] + clones
+        previous = targets[0]
+        for target, (index, group) in zip(targets, ordered):
+            if target is not targets[0]:
+                target.set("id", f"{elem.get('id')}_trim{index}")
+                root.insert_after(previous, target)
+                previous = target
+                for ref in group:
+                    ref.set("producer", target.get("id"))
+
+            start, end, dest = cut[index]
+            offset = int(round(start * fps))
+            length = int(round((end - start) * fps))
+            self._get_property(target, "resource").text = str(dest)
+            length_prop = self._get_property(target, "length")
+            if length_prop is not None:
+                length_prop.text = str(length)
+            # producer 自身とクリップのフィルターの in/out も素材の時間で書かれている
+            for node in [target] + list(target.iter("filter")):
+                self._shift_in_out(node, offset, fps, length - 1)
+            for ref in group:
+                self._shift_in_out(ref, offset, fps, length - 1)
+
+    @staticmethod
+    def _shift_in_out(node, offset: int, fps: float, last_frame: int):
+        for name in ("in", "out"):
+            value = node.get(name)
+            frames = time_to_frames(value, fps)
+            if frames is not None:
+                node.set(name, frames_to_time(min(max(0, frames - offset), last_frame), fps, value))
+
+    @staticmethod
+    def _get_property(elem, name):
+        for prop in elem.findall("property"):
+            if prop.get("name") == name:
+                return prop
+        return None
+
+    @classmethod
+    def _get_text(cls, elem, name) -> Optional[str]:
+        prop = cls._get_property(elem, name)
+        return prop.text if prop is not None else None
+
+    def _resource_files(self, elem) -> set:
+        """要素内の resource プロパティのうち、存在するファイルの集合"""
+        files = set()
+        for prop in elem.iter("property"):
+            if prop.get("name") == "resource" and prop.text:
+                path = self._resolve_resource_path(prop.text)
+                if path is not None and path.is_file():
+                    files.add(path)
+        return files
+
     def _resolve_resource_path(self, value: str) -> Optional[Path]:
         """resource値がファイルパスであれば絶対Pathを返し、そうでなければNone。"""
         text = value.strip().strip('"')
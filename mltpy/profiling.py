@@ -0,0 +1,242 @@
+"""
+mltpy.profiling - 処理時間の計測フック / Built-in profiling hooks for CLI and GUI operations
+
+MLTEditor / MLTDataPackager / MediaUtils の各処理は span（名前付きの区間）として計測点を持つ。
+プロファイルが無効なときは何も記録しない（区間ごとのコストはフラグの確認1回）。
+
+    from mltpy.profiling import profiler, span, timed
+
+    @timed("editor.save")              # 関数全体を1区間として計測
+    def save(self): ...
+
+    with span("package.zip", files=3):  # 任意の区間と付加情報
+        ...
+
+    with profiler.session("project.mlt"):   # 計測を有効にし、終了時にレポートを書き出す
+        ...
+
+レポートはプロジェクトの隣に書き出す:
+- <名前>.profile.json  区間ごとの時間、cProfile の上位関数、tracemalloc のピーク
+- <名前>.profile.txt   人が読む要約
+- <名前>.profile.prof  cProfile の生データ（snakeviz や pstats で開ける）
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import threading
+import time
+import tracemalloc
+
+REPORT_FORMAT_VERSION = 1
+# レポートに載せる cProfile の関数数
+TOP_FUNCTIONS = 30
+
+
+class Profiler:
+    """区間の時間・cProfile・tracemalloc をまとめて記録するクラス（通常はモジュールの profiler を使う）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = None
+        self._elapsed = 0.0
+        self._cprofile = None
+        self._stats = None
+        self._owns_tracemalloc = False
+        self.python_peak_bytes: Optional[int] = None
+
+    # ----------------------- 計測の開始・終了 -----------------------
+    def start(self, cprofile: bool = True, memory: bool = True):
+        """
+        計測を開始する（以前の記録は捨てる）
+
+        cProfile は呼び出したスレッドの関数呼び出しだけを記録する。区間の時間はどのスレッドでも記録される。
+        """
+        self.spans = []
+        self._stats = None
+        self.python_peak_bytes = None
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._started = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        """計測を終了する（レポートはその後 write_report で書き出す）"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._elapsed = time.perf_counter() - self._started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._stats = pstats.Stats(self._cprofile)
+            self._cprofile = None
+        if tracemalloc.is_tracing():
+            self.python_peak_bytes = tracemalloc.get_traced_memory()[1]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+                self._owns_tracemalloc = False
+
+    @contextmanager
+    def session(self, project_path: Union[str, Path], enabled: bool = True):
+        """
+        with の間だけ計測し、終了時（例外でも）にプロジェクトの隣へレポートを書き出す。
+        enabled=False なら何もしない。
+        """
+        if not enabled:
+            yield self
+            return
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+            paths = self.write_report(project_path)
+            print(f"Profile written to {paths['json']} and {paths['txt']} / "
+                  f"プロファイルを {paths['json']} と {paths['txt']} に書き出しました")
+
+    # ----------------------- 区間 -----------------------
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """名前付きの区間を計測する。attrs は件数・バイト数などの付加情報（with の中で追加してもよい）"""
+        if not self.enabled:
+            yield attrs
+            return
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            stack.pop()
+            record = {
+                "name": name,
+                "parent": parent,
+                "thread": threading.current_thread().name,
+                "start_s": round(started - self._started, 6),
+                "duration_s": round(duration, 6),
+            }
+            if attrs:
+                record["attrs"] = attrs
+            if error:
+                record["error"] = error
+            with self._lock:
+                self.spans.append(record)
+
+    def timed(self, name: str):
+        """関数全体を区間 name として計測するデコレーター"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ----------------------- レポート -----------------------
+    def stage_summary(self) -> List[Dict]:
+        """区間名ごとの回数・合計・最大（最初に現れた順）"""
+        stages: Dict[str, Dict] = {}
+        for record in sorted(self.spans, key=lambda r: r["start_s"]):
+            stage = stages.setdefault(record["name"], {"name": record["name"], "count": 0,
+                                                       "total_s": 0.0, "max_s": 0.0})
+            stage["count"] += 1
+            stage["total_s"] += record["duration_s"]
+            stage["max_s"] = max(stage["max_s"], record["duration_s"])
+        for stage in stages.values():
+            stage["total_s"] = round(stage["total_s"], 6)
+        return list(stages.values())
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[Dict]:
+        """cProfile の累積時間の上位関数"""
+        if self._stats is None:
+            return []
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in self._stats.stats.items():
+            rows.append({
+                "function": f"{Path(filename).name}:{line}({function})",
+                "calls": calls,
+                "own_s": round(own, 6),
+                "cumulative_s": round(cumulative, 6),
+            })
+        rows.sort(key=lambda row: row["cumulative_s"], reverse=True)
+        return rows[:limit]
+
+    def report(self) -> Dict:
+        return {
+            "format": REPORT_FORMAT_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pid": os.getpid(),
+            "elapsed_s": round(self._elapsed, 6),
+            "python_peak_bytes": self.python_peak_bytes,
+            "stages": self.stage_summary(),
+            "spans": sorted(self.spans, key=lambda r: r["start_s"]),
+            "top_functions": self.top_functions(),
+        }
+
+    def summary_text(self, report: Optional[Dict] = None) -> str:
+        report = report or self.report()
+        lines = [f"Elapsed 経過時間: {report['elapsed_s']:.3f} s"]
+        if report["python_peak_bytes"] is not None:
+            lines.append(f"Python heap peak ピークメモリ: {report['python_peak_bytes'] / (1024 ** 2):.1f} MB "
+                         f"(tracemalloc; lxml / OpenCV の確保分は含まない)")
+        lines.append("")
+        lines.append(f"{'stage':<36} {'count':>6} {'total ms':>11} {'max ms':>11}")
+        for stage in report["stages"]:
+            lines.append(f"{stage['name']:<36} {stage['count']:>6} {stage['total_s'] * 1000:>11.1f} "
+                         f"{stage['max_s'] * 1000:>11.1f}")
+        if self._stats is not None:
+            lines.append("")
+            out, previous = io.StringIO(), self._stats.stream
+            self._stats.stream = out
+            try:
+                self._stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            finally:
+                self._stats.stream = previous
+            lines.append(out.getvalue().strip())
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, project_path: Union[str, Path]) -> Dict[str, Path]:
+        """project_path の隣に <名前>.profile.json / .txt / .prof を書き出してパスを返す"""
+        project_path = Path(project_path)
+        base = project_path.stem + ".profile"
+        paths = {"json": project_path.with_name(base + ".json"), "txt": project_path.with_name(base + ".txt")}
+        report = self.report()
+        paths["json"].write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        paths["txt"].write_text(self.summary_text(report), encoding="utf-8")
+        if self._stats is not None:
+            paths["prof"] = project_path.with_name(base + ".prof")
+            self._stats.dump_stats(str(paths["prof"]))
+        return paths
+
+
+# ライブラリ全体で共有するプロファイラ
+profiler = Profiler()
+span = profiler.span
+timed = profiler.timed
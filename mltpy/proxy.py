@@ -0,0 +1,307 @@
+"""
+mltpy.proxy - ドラフト用の低解像度プロキシ / Low-resolution proxies for draft cloud renders
+
+ドラフトの確認にはフル解像度の素材は要らない。素材ごとに OpenCV で縮小したプロキシを作り、
+cloud_rendering.mlt の resource をプロキシに差し替え、<profile> の解像度も同じ倍率で縮小する。
+
+- プロキシは素材のハッシュ（サイズ・更新時刻＋先頭・末尾の一部）と出力サイズをキーにキャッシュし、次回以降も再利用。
+  使用範囲を切り出した一時ファイル（--trim-media）は実行ごとに作り直されるため、元素材と切り出し範囲をキーにする
+- キャッシュは MLTPY_PROXY_CACHE_MB を超えたら、最後に使ってから長いものから削除する
+- 生成は素材ごとに並列実行（OpenCV はデコード・縮小・エンコード中に GIL を解放するためスレッドで全コアを使える）
+- OpenCV は音声を書き出せないため、動画の音声は ffmpeg で元素材からプロキシに多重化する。
+  ffmpeg が無い場合、動画はプロキシ化せず元の素材を同梱する（画像は常にプロキシ化）
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+import cv2
+
+from .media import MediaUtils
+
+# 既定のプロキシの高さ（プロジェクトの高さがこれ以下なら縮小しない）
+DEFAULT_PROXY_HEIGHT = 540
+# キャッシュ形式を変えたら上げる（古いプロキシを使わないように）
+PROXY_FORMAT_VERSION = 1
+# ハッシュに使う先頭・末尾のバイト数
+HASH_SAMPLE_BYTES = 1024 * 1024
+# キャッシュの上限（MB）。超えたら最後に使ってから長いプロキシから削除（0 なら無制限）
+MAX_CACHE_BYTES = int(float(os.getenv("MLTPY_PROXY_CACHE_MB", "20480")) * 1024 * 1024)
+PROXY_JPEG_QUALITY = 85
+
+# 画素単位の位置・大きさを持つプロパティ（プロファイルを縮小したら同じ倍率で縮める）
+GEOMETRY_PROPERTIES = ("rect", "geometry", "transition.rect", "transition.geometry")
+# 文字の大きさを画素で持つサービス
+TEXT_SERVICES = ("dynamictext", "qtext", "subtitle_feed")
+TEXT_SIZE_PROPERTIES = ("size", "outline")
+
+# キーフレーム "00:00:01.000~=0 0 1920 1080 1" の時刻部分
+_KEYFRAME_PREFIX = re.compile(r"^([^=]*=)?(.*)$")
+# 旧形式の geometry "x/y:wxh[:opacity]"
+_OLD_GEOMETRY = re.compile(r"^(-?[\d.]+)/(-?[\d.]+):(-?[\d.]+)x(-?[\d.]+)(.*)$")
+
+
+def default_cache_dir() -> Path:
+    """MLTPY_PROXY_CACHE、無ければ OS のキャッシュディレクトリ配下"""
+    if os.getenv("MLTPY_PROXY_CACHE"):
+        return Path(os.getenv("MLTPY_PROXY_CACHE"))
+    base = os.getenv("LOCALAPPDATA") or os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "mltpy" / "proxies"
+
+
+def source_hash(path: Path, cut: Optional[Tuple[float, float]] = None) -> str:
+    """
+    素材のハッシュ（サイズ・更新時刻と先頭・末尾 HASH_SAMPLE_BYTES。巨大な動画でも全体は読まない）
+
+    同じサイズで中間だけ違う内容に書き出し直された素材でも、更新時刻が変わるので古いプロキシを使わない。
+    cut（開始秒, 終了秒）を指定すると、path からその範囲を切り出したファイルのキーになる。
+    """
+    st = path.stat()
+    size = st.st_size
+    digest = hashlib.sha1(f"{size}:{st.st_mtime_ns}".encode("ascii"))
+    if cut is not None:
+        digest.update(f":cut={cut[0]:.6f}-{cut[1]:.6f}".encode("ascii"))
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_SAMPLE_BYTES))
+        if size > HASH_SAMPLE_BYTES:
+            f.seek(max(HASH_SAMPLE_BYTES, size - HASH_SAMPLE_BYTES))
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def _even(value: float) -> int:
+    """H.264 は偶数解像度が必要なので切り下げて偶数化"""
+    return max(2, int(value) // 2 * 2)
+
+
+def scaled_profile_size(width: int, height: int, max_height: int) -> Tuple[int, int]:
+    """プロジェクト解像度を高さ max_height に縮小したサイズ（縦横比を保つ。元が小さければそのまま）"""
+    if height <= max_height:
+        return width, height
+    return _even(width * max_height / height), _even(max_height)
+
+
+def _format_number(value: float) -> str:
+    return str(int(round(value))) if abs(value - round(value)) < 1e-6 else f"{value:.3f}".rstrip("0")
+
+
+def scale_geometry(value: str, factor: float) -> str:
+    """
+    rect / geometry の値（キーフレーム付きも可）の x, y, w, h に factor を掛ける。
+    % 指定の値は解像度に依存しないのでそのまま。
+    """
+    parts = []
+    for part in value.split(";"):
+        prefix, body = _KEYFRAME_PREFIX.match(part).groups()
+        old = _OLD_GEOMETRY.match(body.strip())
+        if "%" in body:
+            pass
+        elif old:
+            x, y, w, h, rest = old.groups()
+            body = (f"{_format_number(float(x) * factor)}/{_format_number(float(y) * factor)}:"
+                    f"{_format_number(float(w) * factor)}x{_format_number(float(h) * factor)}{rest}")
+        else:
+            tokens = body.split()
+            try:
+                scaled = [_format_number(float(token) * factor) for token in tokens[:4]]
+            except ValueError:
+                scaled = None
+            if scaled and len(scaled) == 4:
+                body = " ".join(scaled + tokens[4:])
+        parts.append((prefix or "") + body)
+    return ";".join(parts)
+
+
+class ProxyGenerator:
+    """OpenCV で素材の低解像度プロキシを生成・キャッシュするクラス"""
+
+    def __init__(self, cache_dir: Optional[Path] = None, ffmpeg: Optional[str] = None,
+                 workers: Optional[int] = None, max_cache_bytes: Optional[int] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.ffmpeg = ffmpeg or os.getenv("MLTPY_FFMPEG") or shutil.which("ffmpeg")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_cache_bytes = MAX_CACHE_BYTES if max_cache_bytes is None else max_cache_bytes
+        # 統計（generate_all 後に参照）
+        self.generated = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def proxy_path(self, src: Path, key: str, box: Tuple[int, int]) -> Path:
+        media_type = MediaUtils.get_media_type(src)
+        if media_type == "video":
+            suffix = ".mp4"
+        else:
+            # 透過を持ちうる形式は PNG のまま
+            suffix = ".jpg" if src.suffix.lower() in (".jpg", ".jpeg", ".bmp") else ".png"
+        return self.cache_dir / f"{key}-{box[0]}x{box[1]}-v{PROXY_FORMAT_VERSION}{suffix}"
+
+    def generate_all(self, sources: Iterable[Path], box: Tuple[int, int],
+                     origins: Optional[Dict[Path, Tuple[Path, float, float]]] = None) -> Dict[Path, Path]:
+        """
+        sources の各素材を box（幅, 高さ）に収まるよう縮小したプロキシを用意する
+
+        Args:
+            origins: 切り出した一時ファイル -> (元素材, 開始秒, 終了秒)。
+                     一時ファイルは実行ごとに更新時刻が変わるため、元素材と範囲をキャッシュのキーにする
+
+        Returns:
+            元の素材 -> プロキシ の対応表（作れなかった素材・縮小不要な素材は含まない）
+        """
+        sources = [src for src in dict.fromkeys(sources) if MediaUtils.get_media_type(src) in ("video", "image")]
+        if not self.ffmpeg and any(MediaUtils.get_media_type(src) == "video" for src in sources):
+            print("ffmpeg not found; video files are packaged without proxies (audio cannot be kept)")
+            sources = [src for src in sources if MediaUtils.get_media_type(src) == "image"]
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        proxies: Dict[Path, Path] = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="proxy") as pool:
+            futures = {pool.submit(self._ensure_proxy, src, box, (origins or {}).get(src)): src for src in sources}
+            for future, src in futures.items():
+                try:
+                    proxy, reused = future.result()
+                except Exception as e:
+                    print(f"Proxy skipped for {src.name}: {e}")
+                    continue
+                if proxy is not None:
+                    proxies[src] = proxy
+                    if reused:
+                        self.reused += 1
+                    else:
+                        self.generated += 1
+        self.evict(keep=set(proxies.values()))
+        return proxies
+
+    def evict(self, keep=()) -> int:
+        """
+        キャッシュが max_cache_bytes を超えていれば、最後に使ってから長いプロキシから削除する
+        （keep は今回使うプロキシ。上限を超えていても削除しない）
+
+        Returns: 削除したバイト数
+        """
+        if not self.max_cache_bytes:
+            return 0
+        entries = []
+        for path in self.cache_dir.iterdir():
+            # 生成中の一時ファイル（.xxx.partial）は対象外
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            freed += size
+            self.evicted += 1
+        return freed
+
+    def _ensure_proxy(self, src: Path, box: Tuple[int, int],
+                      origin: Optional[Tuple[Path, float, float]] = None) -> Tuple[Optional[Path], bool]:
+        """
+        キャッシュにあれば再利用し、無ければ生成する
+
+        Returns:
+            (プロキシ, キャッシュを再利用したか)。縮小の必要がなければプロキシは None
+        """
+        key = source_hash(origin[0], origin[1:]) if origin is not None else source_hash(src)
+        dest = self.proxy_path(src, key, box)
+        if dest.exists():
+            # 最後に使った時刻として更新時刻を使う（LRU での削除順）
+            try:
+                os.utime(dest)
+            except OSError:
+                pass
+            return dest, True
+        # 書き込み途中のファイルをキャッシュとして使わないよう、一時名で作ってから置き換える
+        partial = dest.with_name(f".{dest.stem}.{os.getpid()}-{threading.get_ident()}.partial{dest.suffix}")
+        try:
+            if MediaUtils.get_media_type(src) == "video":
+                made = self._make_video_proxy(src, partial, box)
+            else:
+                made = self._make_image_proxy(src, partial, box)
+            if not made:
+                return None, False
+            os.replace(partial, dest)
+        finally:
+            if partial.exists():
+                partial.unlink()
+        return dest, False
+
+    @staticmethod
+    def _fit(width: int, height: int, box: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """box に収まる縮小後のサイズ。縮小不要なら None"""
+        scale = min(box[0] / width, box[1] / height)
+        if scale >= 1.0:
+            return None
+        return _even(width * scale), _even(height * scale)
+
+    def _make_image_proxy(self, src: Path, dest: Path, box: Tuple[int, int]) -> bool:
+        img = MediaUtils._imread_unicode(str(src))
+        if img is None:
+            raise ValueError("could not read image")
+        size = self._fit(img.shape[1], img.shape[0], box)
+        if size is None:
+            return False
+        resized = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, PROXY_JPEG_QUALITY] if dest.suffix == ".jpg" else []
+        ok, data = cv2.imencode(dest.suffix, resized, params)
+        if not ok:
+            raise ValueError("could not encode proxy image")
+        # cv2.imwrite は Unicode パスに対応していないためバイト列で書き出す
+        dest.write_bytes(data.tobytes())
+        return True
+
+    def _make_video_proxy(self, src: Path, dest: Path, box: Tuple[int, int]) -> bool:
+        cap = cv2.VideoCapture(str(src))
+        if not cap.isOpened():
+            raise ValueError("OpenCV could not open the video")
+        video_only = dest.with_name(dest.stem + ".video.mp4")
+        writer = None
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            size = self._fit(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), box)
+            if size is None or fps <= 0:
+                return False
+            # フレームを間引かず元と同じ fps で書き出す（MLT の in/out がそのまま使える）
+            writer = cv2.VideoWriter(str(video_only), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+            if not writer.isOpened():
+                raise ValueError("OpenCV could not open the proxy writer")
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                writer.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+            writer.release()
+            writer = None
+
+            # 元素材の音声（あれば）を多重化
+            subprocess.run([
+                self.ffmpeg, "-v", "error", "-y", "-i", str(video_only), "-i", str(src),
+                "-map", "0:v:0", "-map", "1:a?", "-c:v", "copy", "-c:a", "aac", "-b:a", "128k",
+                str(dest)
+            ], check=True, capture_output=True)
+            return True
+        finally:
+            if writer is not None:
+                writer.release()
+            cap.release()
+            if video_only.exists():
+                video_only.unlink()
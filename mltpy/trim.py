@@ -0,0 +1,128 @@
+"""
+mltpy.trim - 使用範囲だけを切り出すパッケージング補助 / Cut media down to the ranges a project uses
+
+2時間の動画を15秒だけ使う場合でも、従来はファイル全体をアップロードしていた。
+プレイリストの entry（と tractor の track）の in/out から素材ごとの使用範囲を求め、
+前後に余白（ハンドル）を付けて結合し、その範囲だけを ffmpeg のストリームコピーで切り出す。
+
+ストリームコピーはキーフレームからしか始められないため、切り出し開始位置は
+ffprobe で求めた直前のキーフレームに揃え、MLT の in/out はその位置を基準に書き換える。
+"""
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+import json
+import os
+import re
+import shutil
+import subprocess
+
+_CLOCK_PATTERN = re.compile(r"^(\d+):(\d{2}):(\d{2}(?:[.,]\d+)?)$")
+
+# 既定の余白（秒）。トランジションや丸め誤差のために前後へ残す
+DEFAULT_HANDLE_SECONDS = 1.0
+# 使用範囲が元の長さのこの割合を超える素材は切り出さない
+MIN_SAVING_RATIO = 0.1
+
+
+def time_to_frames(value: Optional[str], fps: float) -> Optional[int]:
+    """in/out 属性（フレーム数 または HH:MM:SS.mmm）をフレーム数に変換。解釈できなければ None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    match = _CLOCK_PATTERN.match(value)
+    if not match or fps <= 0:
+        return None
+    hours, minutes, seconds = match.groups()
+    total = int(hours) * 3600 + int(minutes) * 60 + float(seconds.replace(",", "."))
+    return int(round(total * fps))
+
+
+def frames_to_time(frames: int, fps: float, like: str) -> str:
+    """フレーム数を元の値（like）と同じ書式に戻す"""
+    if like.strip().isdigit():
+        return str(frames)
+    total_ms = int(round(frames / fps * 1000))
+    hours, rest = divmod(total_ms, 3600 * 1000)
+    minutes, rest = divmod(rest, 60 * 1000)
+    seconds, ms = divmod(rest, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}.{ms:03}"
+
+
+def merge_ranges(ranges: List[Tuple[float, float]], handle: float,
+                 duration: Optional[float] = None) -> List[Tuple[float, float]]:
+    """使用範囲（秒）に余白を付けて、重なる・接する範囲を結合する"""
+    padded = sorted((max(0.0, start - handle), end + handle) for start, end in ranges)
+    merged: List[Tuple[float, float]] = []
+    for start, end in padded:
+        if duration is not None:
+            end = min(end, duration)
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class MediaTrimmer:
+    """ffprobe / ffmpeg で素材の一部をキーフレーム位置からストリームコピーするクラス"""
+
+    def __init__(self, ffmpeg: Optional[str] = None, ffprobe: Optional[str] = None,
+                 handle_seconds: float = DEFAULT_HANDLE_SECONDS):
+        self.ffmpeg = ffmpeg or os.getenv("MLTPY_FFMPEG") or shutil.which("ffmpeg")
+        self.ffprobe = ffprobe or os.getenv("MLTPY_FFPROBE") or shutil.which("ffprobe")
+        self.handle_seconds = handle_seconds
+
+    @property
+    def available(self) -> bool:
+        return bool(self.ffmpeg and self.ffprobe)
+
+    def _probe(self, args) -> str:
+        result = subprocess.run([self.ffprobe, "-v", "error"] + args,
+                                capture_output=True, text=True, check=True)
+        return result.stdout
+
+    def probe_times(self, path: Path) -> Tuple[float, Optional[float]]:
+        """(開始タイムスタンプ, 長さ) を秒で返す"""
+        info = json.loads(self._probe(["-show_entries", "format=start_time,duration", "-of", "json", str(path)]))
+        fmt = info.get("format", {})
+        start = float(fmt.get("start_time") or 0.0)
+        duration = float(fmt["duration"]) if fmt.get("duration") else None
+        return start, duration
+
+    def keyframe_before(self, path: Path, seconds: float, start_time: float) -> float:
+        """seconds（素材先頭からの秒）以前で最後のキーフレーム位置を、素材先頭からの秒で返す"""
+        if seconds <= 0:
+            return 0.0
+        target = start_time + seconds
+        output = self._probe([
+            "-select_streams", "v:0", "-skip_frame", "nokey",
+            "-read_intervals", f"{max(0.0, target - 30):.3f}%{target + 0.001:.3f}",
+            "-show_entries", "frame=pts_time", "-of", "csv=p=0", str(path)
+        ])
+        keyframes = []
+        for line in output.split():
+            try:
+                keyframes.append(float(line.strip(",")))
+            except ValueError:
+                continue
+        candidates = [pts for pts in keyframes if pts <= target + 0.001]
+        return max(0.0, max(candidates) - start_time) if candidates else 0.0
+
+    def cut(self, src: Path, start: float, end: float, dest: Path, start_time: float = 0.0) -> float:
+        """
+        src の start〜end（秒）を dest にストリームコピーする
+
+        Returns:
+            実際の切り出し開始位置（キーフレーム。素材先頭からの秒）
+        """
+        keyframe = self.keyframe_before(src, start, start_time)
+        subprocess.run([
+            self.ffmpeg, "-v", "error", "-y",
+            "-ss", f"{keyframe:.6f}", "-i", str(src), "-t", f"{end - keyframe:.6f}",
+            "-map", "0:v:0", "-map", "0:a?", "-c", "copy", "-avoid_negative_ts", "make_zero",
+            str(dest)
+        ], check=True, capture_output=True)
+        return keyframe
@@ -0,0 +1,236 @@
+"""
+mltpy.watch - 保存のたびに変換を差分で適用する監視モード / Re-apply transforms incrementally on project save
+
+    mltpy watch --input-path project.mlt --wrap-subtitles --wrap-max-length 42
+
+Shotcut で .mlt を保存するたびに読み込み直し、subtitle_feed / dynamictext フィルターごとに
+内容のハッシュを取り、前回から内容が変わったフィルターだけに折り返し・翻訳をかけて出力を書き出す。
+変わっていないフィルターは前回の結果を使うため、再翻訳しない。
+
+- 変更の検出はファイルの stat（更新時刻とサイズ）のポーリング。Windows / macOS / Linux で同じように動き、
+  1回の確認はシステムコール1回なので大きなプロジェクトでも負荷にならない
+- Shotcut の書き込み途中を読まないよう、stat が2回続けて同じになってから処理する
+- 出力は一時ファイルに書いてから置き換える（Shotcut で開いている出力が壊れない）
+"""
+
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from .editor import MLTEditor
+from .exceptions import MLTError
+from .profiling import profiler, span
+from .subtitle_utils import SubtitleUtils
+
+DEFAULT_INTERVAL = 0.5  # ポーリング間隔（秒）
+
+# 対象のフィルター: mlt_service -> 変換するプロパティ
+WATCHED_PROPERTIES = {
+    "subtitle_feed": "text",
+    "dynamictext": "argument",
+}
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ProjectWatcher:
+    """.mlt を監視し、内容が変わった字幕・テキストフィルターだけに変換をかけるクラス"""
+
+    def __init__(self, input_path: Union[str, Path], output_path: Union[str, Path, None] = None,
+                 wrap_subtitles: bool = False, wrap_dynamictext: bool = False,
+                 translate_dynamictext: bool = False, max_length: int = 90, force_wrap: bool = False,
+                 from_lang: str = "en", to_lang: str = "ja", service: str = "google",
+                 interval: float = DEFAULT_INTERVAL):
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path) if output_path else self.input_path.with_stem(
+            f"{self.input_path.stem}_watched")
+        if self.output_path.resolve() == self.input_path.resolve():
+            raise ValueError("Input path and output path are the same / 入力パスと出力パスが同じです")
+        self.wrap_subtitles = wrap_subtitles
+        self.wrap_dynamictext = wrap_dynamictext
+        self.translate_dynamictext = translate_dynamictext
+        self.max_length = max_length
+        self.force_wrap = force_wrap
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.service = service
+        self.interval = interval
+
+        self._translator = None
+        # (mlt_service, 元の内容のハッシュ) -> 変換後の内容。直近の1回で使ったものだけ残す
+        self._results: Dict[Tuple[str, str], str] = {}
+        # 統計（apply 後に参照）
+        self.changed = 0
+        self.reused = 0
+
+    # ----------------------- 変換 -----------------------
+    def _translate(self, text: str) -> str:
+        # 翻訳サービスの準備（認証など）は最初に必要になったときだけ
+        if self._translator is None:
+            if self.service == "Translate":
+                from translate import Translator
+                self._translator = Translator(from_lang=self.from_lang, to_lang=self.to_lang).translate
+            else:
+                from .translator import GoogleTranslator
+                self._translator = GoogleTranslator(from_language=self.from_lang,
+                                                    target_language=self.to_lang).translate_text
+        return self._translator(text)
+
+    def _transform_for(self, service: str) -> Optional[Callable[[str], str]]:
+        """mlt_service ごとの変換（設定で何もしないなら None）"""
+        if service == "subtitle_feed" and self.wrap_subtitles:
+            return lambda text: SubtitleUtils.wrap_srt_lines({"": text}, self.max_length, self.force_wrap)[""]
+        if service == "dynamictext" and (self.wrap_dynamictext or self.translate_dynamictext):
+            def transform(text):
+                # 翻訳してから折り返す（訳文の長さで折り返し位置が決まるように）
+                if self.translate_dynamictext:
+                    text = self._translate(text)
+                if self.wrap_dynamictext:
+                    text = "\n".join(SubtitleUtils.wrap_text_line(text, self.max_length, self.force_wrap))
+                return text
+            return transform
+        return None
+
+    def apply(self) -> Path:
+        """
+        入力を読み込み、変わったフィルターだけ変換して出力を書き出す
+
+        Returns:
+            出力パス
+        """
+        with span("watch.apply") as info:
+            editor = MLTEditor(self.input_path)
+            results: Dict[Tuple[str, str], str] = {}
+            self.changed = self.reused = 0
+            for filter_elem in editor.mlt_tag.iter("filter"):
+                service_elem = filter_elem.find("./property[@name='mlt_service']")
+                service = service_elem.text if service_elem is not None else filter_elem.get("mlt_service")
+                transform = self._transform_for(service) if service in WATCHED_PROPERTIES else None
+                if transform is None:
+                    continue
+                for prop in filter_elem.findall(f"./property[@name='{WATCHED_PROPERTIES[service]}']"):
+                    if not prop.text:
+                        continue
+                    key = (service, _digest(prop.text))
+                    if key in results:
+                        self.reused += 1
+                    elif key in self._results:
+                        results[key] = self._results[key]
+                        self.reused += 1
+                    else:
+                        results[key] = transform(prop.text)
+                        self.changed += 1
+                    prop.text = results[key]
+            self._results = results
+            info.update(changed=self.changed, reused=self.reused)
+
+            # 書き込み途中の出力を Shotcut に読ませないよう、一時ファイルから置き換える
+            partial = self.output_path.with_name(f".{self.output_path.name}.partial")
+            editor.tree.write(str(partial), encoding="utf-8", pretty_print=True, xml_declaration=True)
+            os.replace(partial, self.output_path)
+        return self.output_path
+
+    # ----------------------- 監視 -----------------------
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.input_path.stat()
+        except OSError:
+            # 保存中（一時ファイルからの置き換え中）は一瞬存在しないことがある
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _apply_and_report(self):
+        started = time.perf_counter()
+        try:
+            self.apply()
+        except (MLTError, OSError, ValueError) as e:
+            # 保存途中の壊れた XML などは次の保存で直るので、監視は続ける
+            print(f"Skipped this save: {e} / この保存はスキップしました: {e}")
+            return
+        print(f"{time.strftime('%H:%M:%S')} {self.changed} filters changed, {self.reused} unchanged "
+              f"({time.perf_counter() - started:.2f}s) -> {self.output_path}")
+
+    def run(self, max_cycles: Optional[int] = None):
+        """
+        Ctrl+C まで監視する（起動時に1回適用）
+
+        Args:
+            max_cycles: 適用回数の上限（起動時を含む）。None なら無制限
+        """
+        print(f"Watching {self.input_path} (Ctrl+C to stop) / {self.input_path} を監視中（Ctrl+C で終了）")
+        last = self._stat()
+        self._apply_and_report()
+        cycles = 1
+        try:
+            while max_cycles is None or cycles < max_cycles:
+                time.sleep(self.interval)
+                current = self._stat()
+                if current is None or current == last:
+                    continue
+                # 書き込みが終わって stat が落ち着くまで待つ
+                time.sleep(self.interval)
+                settled = self._stat()
+                if settled != current:
+                    continue
+                last = settled
+                self._apply_and_report()
+                cycles += 1
+        except KeyboardInterrupt:
+            print("Stopped watching / 監視を終了しました")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="mltpy watch",
+        description="Re-apply wrap / translate to changed filters every time the project is saved / "
+                    "プロジェクトの保存ごとに、変更されたフィルターだけに折り返し・翻訳を適用する"
+    )
+    parser.add_argument('--input-path', type=str, required=True,
+                        help='Path to the MLT file to watch / 監視するMLTファイルへのパス')
+    parser.add_argument('--output-path', type=str, default=None,
+                        help='Output MLT file (default: <name>_watched.mlt) / 出力先（デフォルト: <名前>_watched.mlt）')
+    parser.add_argument('--wrap-subtitles', action='store_true',
+                        help='Wrap long subtitle lines / 長い字幕行を折り返す')
+    parser.add_argument('--wrap-dynamictext', action='store_true',
+                        help='Wrap long simple text lines / 長いシンプルテキストの行を折り返す')
+    parser.add_argument('--wrap-max-length', type=int, default=90,
+                        help='Maximum length for wrapped lines / 折り返し処理する行の最大長')
+    parser.add_argument('--force-wrap', action='store_true',
+                        help='Force wrapping lines even without spaces / スペースがない言語でも強制的に折り返す')
+    parser.add_argument('--translate-dynamictext', action='store_true',
+                        help='Translate simple text (translated text is cached per filter) / '
+                             'シンプルテキストを翻訳する（訳文はフィルターごとに再利用）')
+    parser.add_argument('--translate-from', type=str, default='en', help='language to translate from')
+    parser.add_argument('--translate-to', type=str, default='ja', help='language to translate to')
+    parser.add_argument('--translate-service', choices=('google', 'Translate'), default='google',
+                        help='Translation service (default: google) / 翻訳サービス（デフォルト: google）')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f'Polling interval in seconds (default: {DEFAULT_INTERVAL}) / 監視間隔（秒）')
+    parser.add_argument('--once', action='store_true',
+                        help='Apply once and exit / 1回だけ適用して終了する')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record a profile next to the project on exit / 終了時にプロジェクトの隣へプロファイルを記録する')
+    parsed = parser.parse_args(args)
+
+    if not (parsed.wrap_subtitles or parsed.wrap_dynamictext or parsed.translate_dynamictext):
+        parser.error("choose at least one of --wrap-subtitles, --wrap-dynamictext, --translate-dynamictext")
+
+    watcher = ProjectWatcher(
+        parsed.input_path, parsed.output_path,
+        wrap_subtitles=parsed.wrap_subtitles, wrap_dynamictext=parsed.wrap_dynamictext,
+        translate_dynamictext=parsed.translate_dynamictext, max_length=parsed.wrap_max_length,
+        force_wrap=parsed.force_wrap, from_lang=parsed.translate_from, to_lang=parsed.translate_to,
+        service=parsed.translate_service, interval=parsed.interval,
+    )
+    with profiler.session(parsed.input_path, enabled=parsed.profile):
+        watcher.run(max_cycles=1 if parsed.once else None)
+
+
+if __name__ == "__main__":
+    sys.exit(main())